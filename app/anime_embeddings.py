@@ -4,16 +4,58 @@ Anime Database Embeddings Generator
 This script fetches anime data from Supabase, processes it, and generates 
 embeddings using sentence-transformers, then stores them in Pinecone 
 for vector search capabilities.
+
+With `--snapshot-dir` it also writes a local snapshot (embedding matrix plus
+metadata sidecar) that `app.vector_store.LocalVectorStore` can serve from,
+and the BM25 keyword index of the same texts (`app.keyword_index`).
+
+Each vector's metadata carries the anime's query-independent quality score
+(`normalized_score`). `--refresh-scores` recomputes those scores from the
+current feedback counts and only updates the vectors whose score changed,
+without re-embedding anything.
+
+Every run records a content hash per anime id in a manifest. `--incremental`
+compares against it and only embeds new or changed rows, re-upserts the
+stored vector with fresh metadata for rows whose text is unchanged, and
+deletes vectors of removed ids. Add
+`--since <timestamp|last>` to only fetch rows whose updated-at column moved.
+
+A full run is a streaming pipeline with bounded queues between stages:
+concurrent keyset-paginated fetch (the row count is discovered, not
+assumed), preprocessing, embedding in a process pool sized to the available
+cores, and concurrent batched upserts with retries. Memory stays flat
+because no stage holds more than a few batches.
+
+Usage:
+    python -m app.anime_embeddings [--snapshot-dir data/embeddings] [--skip-pinecone]
+    python -m app.anime_embeddings --incremental [--since last] [--snapshot-dir data/embeddings]
+    python -m app.anime_embeddings --refresh-scores [--snapshot-dir data/embeddings]
 """
 
+import argparse
+import hashlib
+import json
 import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timezone
+import numpy as np
 import pandas as pd
 from supabase import create_client
 from langchain.embeddings import HuggingFaceEmbeddings
 import pinecone as pc
-from typing import List, Dict
+from typing import Any, List, Dict, Iterator, Optional, Set, Tuple
 from tqdm import tqdm
 from dotenv import load_dotenv
+from app.embedding_backends import available_cores, create_embeddings
+from app.keyword_index import build_keyword_index
+from app.vector_store import (
+    SNAPSHOT_VECTORS_FILE, SnapshotWriter, update_snapshot_metadata, apply_snapshot_changes
+)
+from app.scoring import compute_feedback_scores, compute_normalized_ranks, compute_normalized_scores
 
 # Environment variables
 load_dotenv(dotenv_path=".env.local", override=True)
@@ -21,28 +63,127 @@ load_dotenv(dotenv_path=".env.local", override=True)
 SUPABASE_URL = os.getenv('NEXT_PUBLIC_SUPABASE_URL')
 SUPABASE_KEY = os.getenv('NEXT_PUBLIC_SUPABASE_ANON_KEY')
 PINECONE_API_KEY = os.getenv('PINECONE_API_KEY')
+INDEX_NAME = "embeddings-animes"
+QUALITY_COLUMNS = ['id', 'rating', 'rank', 'num_favorites', 'num_list_users', 'feedback']
+SCORES_MANIFEST = os.getenv('QUALITY_SCORES_MANIFEST', 'data/quality_scores.json')
+EMBEDDING_MANIFEST = os.getenv('EMBEDDING_MANIFEST', 'data/embedding_manifest.json')
+# Refreshed by --refresh-scores; excluded from the metadata hash so score drift never triggers a sync
+SCORE_FIELDS = ('feedback_score', 'normalized_score')
+UPSERT_RETRIES = 3
+EMBED_RETRIES = 3
+
+def count_anime(supabase_client) -> int:
+    """Ask Supabase for the exact row count instead of assuming it."""
+    response = supabase_client.table('anime').select('id', count='exact').limit(1).execute()
+    return response.count or 0
 
-def fetch_anime_data(supabase_client, chunk_size: int = 1000) -> List[Dict]:
+def _id_shards(supabase_client, shards: int) -> List[Tuple[Any, Any]]:
     """
-    Fetch anime data from Supabase in chunks.
+    Split the table into `shards` half-open keyset ranges.
+
+    The boundaries are real ids read at evenly spaced positions of the id
+    order, so shards are balanced whatever the id type or its gaps, and
+    each range compares ids the same way the keyset pagination does.
+    """
+    total = count_anime(supabase_client)
+    if total == 0:
+        return []
+    boundaries = []
+    for k in range(1, shards):
+        position = k * total // shards
+        row = supabase_client.table('anime').select('id').order('id').range(position, position).execute().data
+        if row and (not boundaries or row[0]['id'] != boundaries[-1]):
+            boundaries.append(row[0]['id'])
+    edges = [None] + boundaries + [None]
+    return list(zip(edges[:-1], edges[1:]))
+
+def _fetch_shard(supabase_client, 
+                 bounds: Tuple[Any, Any], 
+                 columns: str, 
+                 chunk_size: int, 
+                 pages: queue.Queue) -> None:
+    """Keyset-paginate one id range, putting each page on `pages`."""
+    low, high = bounds
+    last_id = None
+    while True:
+        request = supabase_client.table('anime').select(columns)
+        if last_id is not None:
+            request = request.gt('id', last_id)
+        elif low is not None:
+            request = request.gte('id', low)
+        if high is not None:
+            request = request.lt('id', high)
+        page = request.order('id').limit(chunk_size).execute().data
+        if page:
+            pages.put(page)
+            last_id = page[-1]['id']
+        if len(page) < chunk_size:
+            return
+
+def iter_anime_pages(supabase_client, 
+                     chunk_size: int = 1000, 
+                     columns: str = '*', 
+                     workers: int = 4, 
+                     max_queued_pages: int = 8) -> Iterator[List[Dict]]:
+    """
+    Stream anime pages from concurrent keyset-paginated fetches.
+    
+    The table is split at sampled ids into one range per worker; each worker
+    pages through its range with `id > last_id` (no OFFSET scans) and pushes pages
+    onto a bounded queue, so fetching never runs far ahead of the consumer.
+    Pages arrive in no particular order. `columns` must include `id`.
     
     Args:
         supabase_client: Initialized Supabase client
         chunk_size: Number of records to fetch per request
+        columns: Comma-separated columns to select
+        workers: Number of concurrent fetchers
+        max_queued_pages: Bound of the page queue
+        
+    Yields:
+        Lists of anime records
+    """
+    pages: queue.Queue = queue.Queue(maxsize=max_queued_pages)
+    shards = _id_shards(supabase_client, workers)
+    done = object()
+    errors = []
+
+    def run(bounds):
+        try:
+            _fetch_shard(supabase_client, bounds, columns, chunk_size, pages)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            pages.put(done)
+
+    threads = [threading.Thread(target=run, args=(bounds,), daemon=True) for bounds in shards]
+    for thread in threads:
+        thread.start()
+    remaining = len(threads)
+    while remaining:
+        page = pages.get()
+        if page is done:
+            remaining -= 1
+            continue
+        yield page
+    if errors:
+        raise errors[0]
+
+def fetch_anime_data(supabase_client, chunk_size: int = 1000, columns: str = '*') -> List[Dict]:
+    """
+    Fetch all anime data from Supabase.
+    
+    Args:
+        supabase_client: Initialized Supabase client
+        chunk_size: Number of records to fetch per request
+        columns: Comma-separated columns to select
         
     Returns:
         List of anime records
     """
     all_animes = []
-    total_records = 24012  # Total number of records to fetch
-    
-    for start in tqdm(range(0, total_records, chunk_size), desc="Fetching data"):
-        response = supabase_client.table('anime').select('*').range(
-            start, 
-            start + chunk_size - 1
-        ).execute()
-        all_animes.extend(response.data)
-        
+    for page in tqdm(iter_anime_pages(supabase_client, chunk_size, columns), desc="Fetching data", unit="page"):
+        all_animes.extend(page)
     return all_animes
 
 def preprocess_data(df: pd.DataFrame) -> pd.DataFrame:
@@ -73,72 +214,718 @@ def preprocess_data(df: pd.DataFrame) -> pd.DataFrame:
     
     return df
 
+def fetch_anime_ids(supabase_client, chunk_size: int = 1000) -> Set[str]:
+    """
+    Fetch every anime id currently in the table.
+    
+    Args:
+        supabase_client: Initialized Supabase client
+        chunk_size: Number of ids to fetch per request
+        
+    Returns:
+        Set of anime ids as strings
+    """
+    return {
+        str(row['id'])
+        for page in iter_anime_pages(supabase_client, chunk_size, columns='id')
+        for row in page
+    }
+
+def fetch_updated_since(supabase_client, 
+                        since: str, 
+                        updated_column: str = 'updated_at', 
+                        chunk_size: int = 1000) -> List[Dict]:
+    """
+    Fetch the anime rows whose updated-at column is at or after `since`, paging by `id > last_id`.
+    
+    Args:
+        supabase_client: Initialized Supabase client
+        since: ISO-8601 timestamp
+        updated_column: Name of the updated-at column
+        chunk_size: Number of records to fetch per request
+        
+    Returns:
+        List of anime records
+    """
+    rows = []
+    last_id = None
+    while True:
+        request = supabase_client.table('anime').select('*').gte(updated_column, since)
+        if last_id is not None:
+            request = request.gt('id', last_id)
+        page = request.order('id').limit(chunk_size).execute().data
+        rows.extend(page)
+        if len(page) < chunk_size:
+            return rows
+        last_id = page[-1]['id']
+
+def compute_quality_scores(df: pd.DataFrame, total_docs: Optional[int] = None) -> pd.DataFrame:
+    """
+    Add the query-independent `feedback_score` and `normalized_score` columns.
+    
+    One vectorised pass over the whole frame; the formula is shared with the
+    API's catalog through `app.scoring`.
+    
+    Args:
+        df: DataFrame with rating, rank, num_favorites, num_list_users and feedback
+        total_docs: Catalog size, if `df` is only part of it
+        
+    Returns:
+        The same DataFrame with the score columns added
+    """
+    total_docs = total_docs or len(df)
+    numeric = {
+        column: pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=np.float64)
+        for column in QUALITY_COLUMNS[1:]
+    }
+    feedback_scores = compute_feedback_scores(
+        numeric['num_favorites'], numeric['num_list_users'], numeric['feedback']
+    )
+    normalized_ranks = compute_normalized_ranks(numeric['rank'], total_docs)
+    df['feedback_score'] = feedback_scores
+    df['normalized_score'] = compute_normalized_scores(
+        numeric['rating'], feedback_scores, normalized_ranks, total_docs
+    )
+    return df
+
+def save_scores_manifest(scores: Dict[str, float], path: str = SCORES_MANIFEST) -> None:
+    """Record the published scores so `refresh_quality_scores` can tell what changed."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({anime_id: round(float(score), 6) for anime_id, score in scores.items()}, f)
+
+def refresh_quality_scores(supabase_client, 
+                           index: Optional[pc.Index], 
+                           snapshot_dir: Optional[str] = None,
+                           manifest_path: str = SCORES_MANIFEST,
+                           batch_size: int = 100) -> int:
+    """
+    Recompute quality scores and update only the vectors whose score changed.
+    
+    Fetches just the scoring columns, so no text is re-read or re-embedded.
+    Ids that were never published (not in the manifest, the index or the
+    snapshot) are skipped; the next embedding run writes their scores.
+    
+    Args:
+        supabase_client: Initialized Supabase client
+        index: Pinecone index to update, or None to skip Pinecone
+        snapshot_dir: Local snapshot to update, if any
+        manifest_path: JSON map of anime id to the last published score
+        batch_size: Vectors rewritten per Pinecone request
+        
+    Returns:
+        Number of anime whose score was updated
+    """
+    df = pd.DataFrame(fetch_anime_data(supabase_client, columns=','.join(QUALITY_COLUMNS)))
+    df['id'] = df['id'].astype(str)
+    df = compute_quality_scores(df)
+    
+    previous = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+    published = df['id'].map(previous).astype(float)
+    changed = df[~np.isclose(df['normalized_score'].round(6), published, rtol=0, atol=1e-6)]
+    
+    updates = {
+        row.id: {'normalized_score': float(row.normalized_score), 'feedback_score': float(row.feedback_score)}
+        for row in changed.itertuples(index=False)
+    }
+    written: Set[str] = set()
+    if index is not None:
+        written |= rewrite_metadata(index, updates, batch_size)
+    if snapshot_dir and updates:
+        written |= update_snapshot_metadata(snapshot_dir, updates)
+    unpublished = sum(1 for anime_id in updates if anime_id not in written and anime_id not in previous)
+    print(f"{len(written)} of {len(df)} quality scores updated ({unpublished} unpublished ids skipped)")
+    
+    # Only record what is actually stored, so failed and unpublished ids are retried next run
+    scores = dict(previous)
+    scores.update({anime_id: updates[anime_id]['normalized_score'] for anime_id in written})
+    save_scores_manifest(scores, manifest_path)
+    return len(written)
+
+def rewrite_metadata(index: pc.Index, 
+                     updates: Dict[str, Dict], 
+                     batch_size: int = 100, 
+                     merge: bool = True) -> Set[str]:
+    """
+    Rewrite the metadata of stored vectors, a batch at a time.
+    
+    Pinecone's `update` takes one id per request and only merges fields, so
+    each batch is fetched (values and metadata in one request) and upserted
+    back whole instead. Ids that are not in the index are left out.
+    
+    Args:
+        index: Pinecone index
+        updates: Map of anime id to metadata fields
+        batch_size: Ids fetched and upserted per request
+        merge: Merge `updates` into the stored metadata; otherwise replace it,
+            dropping fields that are no longer set
+        
+    Returns:
+        Ids that were written
+    """
+    written = set()
+    ids = list(updates)
+    for i in tqdm(range(0, len(ids), batch_size), desc="Updating Pinecone metadata"):
+        batch = ids[i:i+batch_size]
+        try:
+            stored = index.fetch(ids=batch).vectors
+            found = [anime_id for anime_id in batch if anime_id in stored]
+            if found:
+                upsert_vectors(
+                    index,
+                    found,
+                    [stored[anime_id].values for anime_id in found],
+                    [
+                        {**(stored[anime_id].metadata or {}), **updates[anime_id]} if merge else updates[anime_id]
+                        for anime_id in found
+                    ],
+                )
+            written.update(found)
+        except Exception as e:
+            print(f"Error updating metadata for batch starting at id {batch[0]}: {e}")
+    return written
+
+def build_metadata(batch: pd.DataFrame) -> List[Dict]:
+    """
+    Build the per-vector metadata records for a batch.
+    
+    Values are stored in filterable types so query filters can be pushed
+    down to the vector store: numeric `year` and `rating`, `genres` as a
+    list plus lower-cased `genre_keys`, and a lower-cased `season_key`.
+    Missing values are left out, as Pinecone rejects nulls.
+    
+    Args:
+        batch: Batch of preprocessed records
+        
+    Returns:
+        List of metadata dicts
+    """
+    records = []
+    for row in batch.itertuples(index=False):
+        genres = [
+            genre.strip() for genre in (row.genres if isinstance(row.genres, str) else '').split(',')
+            if genre.strip()
+        ]
+        meta = {
+            'id': row.id,
+            'title': row.title,
+            'description': row.description,
+            'genres': genres,
+            'genre_keys': [genre.lower() for genre in genres],
+            'year': _optional_number(row.year, int),
+            'season': row.season,
+            'season_key': row.season.lower() if isinstance(row.season, str) else None,
+            'rating': _optional_number(row.rating, float),
+            'feedback_score': _optional_number(getattr(row, 'feedback_score', None), float),
+            'normalized_score': _optional_number(getattr(row, 'normalized_score', None), float),
+        }
+        records.append({
+            key: value for key, value in meta.items()
+            if value is not None and not (isinstance(value, float) and pd.isna(value))
+        })
+    return records
+
+def _optional_number(value, cast):
+    try:
+        if value is None or pd.isna(value):
+            return None
+        return cast(value)
+    except (TypeError, ValueError):
+        return None
+
+def content_hashes(df: pd.DataFrame) -> Dict[str, Dict[str, str]]:
+    """
+    Hash what each vector is built from.
+    
+    `text` covers the embedded text (a change needs a re-embed); `meta`
+    covers the stored metadata minus the quality scores (a change only needs
+    a metadata update).
+    
+    Args:
+        df: Preprocessed DataFrame
+        
+    Returns:
+        Map of anime id to its `text` and `meta` hashes
+    """
+    hashes = {}
+    for (anime_id, text), meta in zip(df[['id', 'combined_text']].itertuples(index=False), build_metadata(df)):
+        stable_meta = {key: value for key, value in meta.items() if key not in SCORE_FIELDS}
+        hashes[anime_id] = {
+            'text': hashlib.sha1(str(text).encode('utf-8')).hexdigest(),
+            'meta': hashlib.sha1(json.dumps(stable_meta, sort_keys=True, default=str).encode('utf-8')).hexdigest(),
+        }
+    return hashes
+
+def load_manifest(path: str = EMBEDDING_MANIFEST) -> Dict:
+    if not os.path.exists(path):
+        return {'synced_at': None, 'items': {}}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_manifest(items: Dict[str, Dict[str, str]], 
+                  synced_at: str, 
+                  path: str = EMBEDDING_MANIFEST) -> None:
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'synced_at': synced_at, 'items': items}, f)
+    os.replace(path + '.tmp', path)
+
+def plan_sync(hashes: Dict[str, Dict[str, str]], 
+              manifest_items: Dict[str, Dict[str, str]], 
+              current_ids: Set[str]) -> Tuple[List[str], List[str], List[str]]:
+    """
+    Compare fresh hashes with the manifest.
+    
+    Args:
+        hashes: Hashes of the fetched rows
+        manifest_items: Hashes recorded by the last sync
+        current_ids: Every id currently in the table
+        
+    Returns:
+        Ids to (re-)embed, ids needing only a metadata update, ids to delete
+    """
+    to_embed, to_update = [], []
+    for anime_id, digest in hashes.items():
+        previous = manifest_items.get(anime_id)
+        if previous is None or previous['text'] != digest['text']:
+            to_embed.append(anime_id)
+        elif previous['meta'] != digest['meta']:
+            to_update.append(anime_id)
+    to_delete = sorted(set(manifest_items) - current_ids)
+    return to_embed, to_update, to_delete
+
+def sync_incremental(supabase_client, 
+                     index: Optional[pc.Index], 
+                     embeddings: HuggingFaceEmbeddings, 
+                     snapshot_dir: Optional[str] = None, 
+                     since: Optional[str] = None, 
+                     updated_column: str = 'updated_at', 
+                     manifest_path: str = EMBEDDING_MANIFEST, 
+                     batch_size: int = 100) -> Dict[str, int]:
+    """
+    Bring the vector store in line with the table, touching only what changed.
+    
+    Args:
+        supabase_client: Initialized Supabase client
+        index: Pinecone index, or None to skip Pinecone
+        embeddings: Embedding model instance
+        snapshot_dir: Local snapshot to update, if any
+        since: Only consider rows updated at or after this timestamp ('last' = previous sync)
+        updated_column: Name of the updated-at column used with `since`
+        manifest_path: Path of the content-hash manifest
+        batch_size: Rows embedded and upserted per request
+        
+    Returns:
+        Counts of embedded, metadata-updated and deleted vectors
+    """
+    manifest = load_manifest(manifest_path)
+    started_at = datetime.now(timezone.utc).isoformat()
+    if since == 'last':
+        since = manifest.get('synced_at')
+    
+    current_ids = fetch_anime_ids(supabase_client)
+    if since:
+        print(f"Fetching rows updated since {since}...")
+        rows = fetch_updated_since(supabase_client, since, updated_column)
+    else:
+        rows = fetch_anime_data(supabase_client)
+    items = dict(manifest.get('items', {}))
+    counts = {'embedded': 0, 'updated': 0, 'deleted': 0}
+    
+    if rows:
+        df = preprocess_data(pd.DataFrame(rows))
+        df = compute_quality_scores(df, total_docs=len(current_ids))
+        hashes = content_hashes(df)
+        to_embed, to_update, to_delete = plan_sync(hashes, items, current_ids)
+    else:
+        hashes, to_embed, to_update = {}, [], []
+        to_delete = sorted(set(items) - current_ids)
+    print(f"{len(to_embed)} to embed, {len(to_update)} metadata updates, {len(to_delete)} to delete")
+    
+    snapshot_vectors: Dict[str, List[float]] = {}
+    snapshot_metadata: Dict[str, Dict] = {}
+    if to_update:
+        # Replaced whole rather than merged, so fields that became null upstream are dropped
+        updated = df[df['id'].isin(set(to_update))]
+        metadata = dict(zip(updated['id'], build_metadata(updated)))
+        if index is not None:
+            written = rewrite_metadata(index, metadata, batch_size, merge=False)
+            # Ids whose vector is gone or whose batch failed are embedded and upserted whole instead
+            to_embed += [anime_id for anime_id in metadata if anime_id not in written]
+            metadata = {anime_id: meta for anime_id, meta in metadata.items() if anime_id in written}
+        for anime_id, meta in metadata.items():
+            snapshot_metadata[anime_id] = meta
+            items[anime_id] = hashes[anime_id]
+            counts['updated'] += 1
+    
+    if to_embed:
+        changed = df[df['id'].isin(set(to_embed))]
+        for i in tqdm(range(0, len(changed), batch_size), desc="Embedding changed rows"):
+            batch = changed.iloc[i:i+batch_size]
+            embeds = upsert_to_pinecone(batch, index, embeddings)
+            if embeds is None:
+                continue  # left out of the manifest, so the next run retries it
+            for anime_id, vector, meta in zip(batch['id'], embeds, build_metadata(batch)):
+                snapshot_vectors[anime_id] = vector
+                snapshot_metadata[anime_id] = meta
+                items[anime_id] = hashes[anime_id]
+                counts['embedded'] += 1
+    
+    if to_delete:
+        try:
+            if index is not None:
+                for i in range(0, len(to_delete), 1000):
+                    index.delete(ids=to_delete[i:i+1000])
+            for anime_id in to_delete:
+                items.pop(anime_id, None)
+            counts['deleted'] = len(to_delete)
+        except Exception as e:
+            print(f"Error deleting vectors: {e}")
+            to_delete = []
+    
+    if snapshot_dir and (snapshot_metadata or to_delete):
+        apply_snapshot_changes(snapshot_dir, snapshot_vectors, snapshot_metadata, to_delete)
+        build_keyword_index(snapshot_dir)
+    
+    save_manifest(items, started_at, manifest_path)
+    return counts
+
+def upsert_vectors(index: pc.Index, 
+                   ids: List[str], 
+                   embeds: List[List[float]], 
+                   meta: List[Dict], 
+                   retries: int = UPSERT_RETRIES) -> None:
+    """
+    Upsert one batch, retrying with exponential backoff.
+    
+    Raises the last error once the retries are used up.
+    """
+    for attempt in range(retries + 1):
+        try:
+            index.upsert(vectors=list(zip(ids, embeds, meta)), batch_size=100)
+            return
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(2 ** attempt)
+
 def upsert_to_pinecone(batch: pd.DataFrame, 
-                       index: pc.Index, 
-                       embeddings: HuggingFaceEmbeddings) -> None:
+                       index: Optional[pc.Index], 
+                       embeddings: HuggingFaceEmbeddings) -> Optional[List[List[float]]]:
     """
     Upload a batch of embeddings to Pinecone.
     
     Args:
         batch: Batch of records to process
-        index: Pinecone index instance
+        index: Pinecone index instance, or None to only generate embeddings
         embeddings: Embedding model instance
+        
+    Returns:
+        The generated embeddings, or None if the batch failed after retries
     """
     try:
         # Generate embeddings for the batch
         embeds = embeddings.embed_documents(batch['combined_text'].tolist())
         ids = batch['id'].tolist()
-        meta = batch[
-            ['id', 'title', 'description', 'genres', 'year', 'season', 'rating']
-        ].to_dict('records')
+        meta = build_metadata(batch)
         
         # Upsert to Pinecone
-        index.upsert(vectors=list(zip(ids, embeds, meta)), batch_size=100)
+        if index is not None:
+            upsert_vectors(index, ids, embeds, meta)
+        return embeds
     except Exception as e:
-        print(f"Error upserting batch: {e}")
+        print(f"Error upserting batch starting at id {batch['id'].iloc[0]}: {e}")
+        return None
+
+_worker_embeddings = None
+
+def _init_embedding_worker(threads: int) -> None:
+    """Load the model once per embedding process."""
+    global _worker_embeddings
+    _worker_embeddings = create_embeddings(threads=threads)
 
-def main():
+def _embed_texts(texts: List[str]) -> List[List[float]]:
+    return _worker_embeddings.embed_documents(texts)
+
+def iter_batches(pages: Iterator[List[Dict]], 
+                 total_docs: int, 
+                 batch_size: int) -> Iterator[pd.DataFrame]:
+    """
+    Preprocess pages as they arrive and cut them into embedding batches.
+    
+    Args:
+        pages: Stream of raw anime pages
+        total_docs: Catalog size, for the quality scores
+        batch_size: Rows per embedding batch
+        
+    Yields:
+        Preprocessed, scored batches
+    """
+    for page in pages:
+        df = compute_quality_scores(preprocess_data(pd.DataFrame(page)), total_docs=total_docs)
+        for i in range(0, len(df), batch_size):
+            yield df.iloc[i:i+batch_size]
+
+def iter_embedded(batches: Iterator[pd.DataFrame], 
+                  workers: int,
+                  failed_batches: Optional[List[str]] = None,
+                  retries: int = EMBED_RETRIES) -> Iterator[Tuple[pd.DataFrame, List[List[float]]]]:
+    """
+    Embed batches in a process pool, keeping at most two batches per worker in flight.
+    
+    A batch that fails (e.g. a worker killed by the OOM killer) is resubmitted
+    up to `retries` times with backoff; a broken pool is replaced first. A
+    batch that still fails is skipped and its first id added to `failed_batches`.
+    
+    Args:
+        batches: Stream of preprocessed batches
+        workers: Number of embedding processes
+        failed_batches: Collects the first id of every skipped batch
+        retries: Resubmissions per batch
+        
+    Yields:
+        Each batch with its embeddings, in completion order
+    """
+    threads = max(1, available_cores() // workers)
+
+    def new_pool() -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=workers, initializer=_init_embedding_worker, initargs=(threads,))
+
+    pool = new_pool()
+    generation = 0
+    in_flight = {}
+
+    def submit(batch: pd.DataFrame, attempt: int) -> None:
+        in_flight[pool.submit(_embed_texts, batch['combined_text'].tolist())] = (batch, attempt, generation)
+
+    def settle(return_when) -> Iterator[Tuple[pd.DataFrame, List[List[float]]]]:
+        nonlocal pool, generation
+        finished, _ = wait(list(in_flight), return_when=return_when)
+        for future in finished:
+            batch, attempt, submitted_to = in_flight.pop(future)
+            try:
+                embeds = future.result()
+            except Exception as e:
+                # Every batch in flight on a dead pool fails with it; replace the pool once
+                if isinstance(e, BrokenProcessPool) and submitted_to == generation:
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    pool, generation = new_pool(), generation + 1
+                if attempt >= retries:
+                    print(f"Error embedding batch starting at id {batch['id'].iloc[0]} after {retries} retries: {e}")
+                    if failed_batches is not None:
+                        failed_batches.append(str(batch['id'].iloc[0]))
+                    continue
+                time.sleep(2 ** attempt)
+                submit(batch, attempt + 1)
+                continue
+            yield batch, embeds
+
+    try:
+        for batch in batches:
+            submit(batch, 0)
+            while len(in_flight) >= 2 * workers:
+                yield from settle(FIRST_COMPLETED)
+        while in_flight:
+            yield from settle(FIRST_COMPLETED)
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+def run_pipeline(supabase_client, 
+                 index: Optional[pc.Index], 
+                 snapshot_dir: Optional[str] = None, 
+                 manifest_path: str = EMBEDDING_MANIFEST, 
+                 batch_size: int = 100, 
+                 fetch_workers: int = 4, 
+                 embed_workers: Optional[int] = None, 
+                 upsert_workers: int = 4) -> Dict[str, int]:
+    """
+    Fetch, preprocess, embed and upsert the whole catalog as a stream.
+    
+    Args:
+        supabase_client: Initialized Supabase client
+        index: Pinecone index, or None to skip Pinecone
+        snapshot_dir: Also write a local snapshot here, if set
+        manifest_path: Path of the content-hash manifest
+        batch_size: Rows per embedding / upsert batch
+        fetch_workers: Concurrent keyset fetchers
+        embed_workers: Embedding processes (default: available cores)
+        upsert_workers: Concurrent upsert threads
+        
+    Returns:
+        Counts of upserted rows and failed batches
+    """
+    synced_at = datetime.now(timezone.utc).isoformat()
+    total_docs = count_anime(supabase_client)
+    embed_workers = embed_workers or available_cores()
+    print(f"{total_docs} anime rows, {embed_workers} embedding processes")
+
+    fetch_progress = tqdm(total=total_docs, desc="Fetched", unit="row", position=0)
+    embed_progress = tqdm(total=total_docs, desc="Embedded", unit="row", position=1)
+    upsert_progress = tqdm(total=total_docs, desc="Upserted", unit="row", position=2)
+
+    def counted_pages():
+        for page in iter_anime_pages(supabase_client, workers=fetch_workers):
+            fetch_progress.update(len(page))
+            yield page
+
+    manifest_items: Dict[str, Dict[str, str]] = {}
+    scores: Dict[str, float] = {}
+    # Rows go straight to disk, so memory does not grow with the catalog
+    snapshot = SnapshotWriter(snapshot_dir, total_docs) if snapshot_dir else None
+    failed_batches: List[str] = []
+    counts = {'upserted': 0, 'failed_batches': 0}
+
+    def finish(batch: pd.DataFrame, embeds: List[List[float]], meta: List[Dict]) -> None:
+        manifest_items.update(content_hashes(batch))
+        scores.update(zip(batch['id'], batch['normalized_score']))
+        if snapshot is not None:
+            snapshot.append(embeds, meta)
+        counts['upserted'] += len(batch)
+        upsert_progress.update(len(batch))
+
+    with ThreadPoolExecutor(max_workers=upsert_workers) as upserts:
+        pending = {}
+        batches = iter_batches(counted_pages(), total_docs, batch_size)
+        for batch, embeds in iter_embedded(batches, embed_workers, failed_batches):
+            embed_progress.update(len(batch))
+            meta = build_metadata(batch)
+            if index is None:
+                finish(batch, embeds, meta)
+                continue
+            future = upserts.submit(upsert_vectors, index, batch['id'].tolist(), embeds, meta)
+            pending[future] = (batch, embeds, meta)
+            # Bound the upload backlog so embedded batches do not pile up in memory
+            if len(pending) >= 2 * upsert_workers:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for done in finished:
+                    _collect_upsert(done, pending.pop(done), finish, failed_batches)
+        for done in list(pending):
+            _collect_upsert(done, pending.pop(done), finish, failed_batches)
+
+    for progress in (fetch_progress, embed_progress, upsert_progress):
+        progress.close()
+
+    counts['failed_batches'] = len(failed_batches)
+    if failed_batches:
+        print(f"{len(failed_batches)} batches failed after retries "
+              f"(first ids: {', '.join(failed_batches[:10])}); they are left out of the manifest "
+              f"so `--incremental` picks them up")
+    if snapshot is not None:
+        snapshot.close()
+        print(f"Wrote local snapshot with {snapshot.rows} rows to {snapshot_dir}")
+        build_keyword_index(snapshot_dir)
+    save_scores_manifest(scores)
+    save_manifest(manifest_items, synced_at, manifest_path)
+    return counts
+
+def _collect_upsert(future, item, finish, failed_batches: List[str]) -> None:
+    batch, embeds, meta = item
+    try:
+        future.result()
+    except Exception as e:
+        print(f"Error upserting batch starting at id {batch['id'].iloc[0]}: {e}")
+        failed_batches.append(str(batch['id'].iloc[0]))
+        return
+    finish(batch, embeds, meta)
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Generate anime embeddings")
+    parser.add_argument(
+        '--snapshot-dir',
+        help="Also write a local vector snapshot for VECTOR_STORE_BACKEND=local"
+    )
+    parser.add_argument(
+        '--skip-pinecone', action='store_true',
+        help="Do not upsert to Pinecone (requires --snapshot-dir)"
+    )
+    parser.add_argument(
+        '--refresh-scores', action='store_true',
+        help="Only recompute quality scores and update the vectors whose score changed"
+    )
+    parser.add_argument(
+        '--incremental', action='store_true',
+        help="Only embed new or changed rows and delete vectors of removed ids"
+    )
+    parser.add_argument(
+        '--since',
+        help="With --incremental, only fetch rows updated at or after this ISO timestamp ('last' = previous sync)"
+    )
+    parser.add_argument(
+        '--updated-column', default='updated_at',
+        help="Updated-at column used by --since"
+    )
+    parser.add_argument(
+        '--manifest', default=EMBEDDING_MANIFEST,
+        help="Path of the content-hash manifest"
+    )
+    parser.add_argument('--batch-size', type=int, default=100, help="Rows per embedding / upsert batch")
+    parser.add_argument('--fetch-workers', type=int, default=4, help="Concurrent Supabase fetchers")
+    parser.add_argument(
+        '--embed-workers', type=int, default=None,
+        help="Embedding processes (default: available cores)"
+    )
+    parser.add_argument('--upsert-workers', type=int, default=4, help="Concurrent upsert threads")
+    return parser.parse_args(argv)
+
+def connect_index() -> pc.Index:
+    return pc.Pinecone(api_key=PINECONE_API_KEY).Index(INDEX_NAME)
+
+def main(argv: Optional[List[str]] = None):
     """Main execution function."""
+    args = parse_args(argv)
+    if args.skip_pinecone and not args.snapshot_dir:
+        raise SystemExit("--skip-pinecone requires --snapshot-dir")
+    if args.since and not args.incremental:
+        raise SystemExit("--since requires --incremental")
+    if (args.incremental and args.snapshot_dir
+            and not os.path.exists(os.path.join(args.snapshot_dir, SNAPSHOT_VECTORS_FILE))):
+        raise SystemExit("--incremental needs an existing snapshot; build it with a full --snapshot-dir run first")
     try:
         # Initialize Supabase client
         supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
         print("Connected to Supabase")
         
-        # Fetch data
-        print("Fetching anime data...")
-        all_animes = fetch_anime_data(supabase)
-        df = pd.DataFrame(all_animes)
-        print(f"Total records fetched: {len(df)}")
-        
-        # Preprocess data
-        print("Preprocessing data...")
-        df = preprocess_data(df)
+        if args.refresh_scores:
+            index = None if args.skip_pinecone else connect_index()
+            updated = refresh_quality_scores(supabase, index, args.snapshot_dir)
+            print(f"Updated {updated} quality scores")
+            return
         
-        # Initialize embeddings
-        print("Initializing embedding model...")
-        embeddings = HuggingFaceEmbeddings(
-            model_name='sentence-transformers/all-MiniLM-L6-v2'
-        )
+        if args.incremental:
+            print("Initializing embedding model...")
+            embeddings = create_embeddings()
+            index = None if args.skip_pinecone else connect_index()
+            counts = sync_incremental(
+                supabase, index, embeddings, args.snapshot_dir,
+                since=args.since, updated_column=args.updated_column, manifest_path=args.manifest
+            )
+            print(f"Incremental sync completed: {counts}")
+            return
         
         # Initialize Pinecone
         # Uncomment these lines when setting up a new index
         # pc = Pinecone(api_key=PINECONE_API_KEY)
-        index_name = "embeddings-animes"
-        # if index_name not in pc.list_indexes().names():
-        #   pc.create_index(index_name, dimension=384, metric='cosine',   
+        # if INDEX_NAME not in pc.list_indexes().names():
+        #   pc.create_index(INDEX_NAME, dimension=384, metric='cosine',   
         #           spec=ServerlessSpec(cloud='aws', region='us-east-1'))
         
-        index = pc.Index(index_name)
-        print("Connected to Pinecone")
+        index = None
+        if not args.skip_pinecone:
+            index = connect_index()
+            print("Connected to Pinecone")
         
-        # Process and upload in batches
-        batch_size = 100
-        total_batches = len(df) // batch_size + (1 if len(df) % batch_size != 0 else 0)
-        
-        print("Starting batch processing...")
-        for i in tqdm(range(0, len(df), batch_size), total=total_batches):
-            batch = df.iloc[i:i+batch_size]
-            upsert_to_pinecone(batch, index, embeddings)
+        print("Starting streaming pipeline...")
+        counts = run_pipeline(
+            supabase, index, args.snapshot_dir, args.manifest,
+            batch_size=args.batch_size,
+            fetch_workers=args.fetch_workers,
+            embed_workers=args.embed_workers,
+            upsert_workers=args.upsert_workers
+        )
+        print(f"Pipeline finished: {counts}")
             
         print("Processing completed successfully!")
         
@@ -0,0 +1,177 @@
+"""
+Columnar index over the filterable anime attributes.
+
+`filter_metadata` re-parses the genre string, lower-cases lists and
+converts year and rating for every candidate of every request. The index
+does that work once per catalog (or snapshot): one packed bitmap per
+genre, year and rating positions sorted for range lookups, and a small
+integer code per season. `compile` turns a `QueryFilter` into a boolean
+row mask with a handful of array operations; the mask pre-filters a local
+vector search, and `check` tests a whole candidate list in one step.
+
+Matching follows `filter_metadata`: genres and seasons compare
+case-insensitively and match when any requested value matches, a missing
+year or rating counts as 0, and zero bounds are ignored.
+"""
+
+import math
+from typing import Any, Collection, Dict, Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.models import QueryFilter
+
+
+class AttributeIndex:
+    """
+    Immutable per-row attribute columns, addressed by the same positions as
+    the collection it was built from (catalog rows or snapshot rows).
+    """
+
+    def __init__(
+        self,
+        ids: Sequence[str],
+        genres: Sequence[Iterable[str]],
+        years: Sequence[Any],
+        seasons: Sequence[Optional[str]],
+        ratings: Sequence[Any],
+    ):
+        self.ids = [str(anime_id) for anime_id in ids]
+        self.size = len(self.ids)
+        self.position: Dict[str, int] = {anime_id: i for i, anime_id in enumerate(self.ids)}
+
+        rows_by_genre: Dict[str, list] = {}
+        for row, row_genres in enumerate(genres):
+            for genre in {str(genre).strip().lower() for genre in row_genres or ()}:
+                if genre:
+                    rows_by_genre.setdefault(genre, []).append(row)
+        self.genre_bitmaps: Dict[str, np.ndarray] = {}
+        for genre, rows in rows_by_genre.items():
+            bits = np.zeros(self.size, dtype=bool)
+            bits[rows] = True
+            self.genre_bitmaps[genre] = np.packbits(bits)
+
+        self.year = _number_column(years, np.int32)
+        self.year_order = np.argsort(self.year, kind='stable')
+        self.sorted_year = self.year[self.year_order]
+        self.rating = _number_column(ratings, np.float32)
+        self.rating_order = np.argsort(self.rating, kind='stable')
+        self.sorted_rating = self.rating[self.rating_order]
+
+        season_keys = [(season or '').strip().lower() for season in seasons]
+        self.season_codes_by_name: Dict[str, int] = {
+            season: code for code, season in enumerate(sorted(set(season_keys)))
+        }
+        self.season_codes = np.array(
+            [self.season_codes_by_name[season] for season in season_keys], dtype=np.int16
+        )
+
+    @classmethod
+    def from_metadata(cls, metadata: Sequence[Dict[str, Any]]) -> 'AttributeIndex':
+        """Build from vector metadata records as written by `anime_embeddings.build_metadata`."""
+        from app.utils import extract_genres_from_string
+
+        return cls(
+            ids=[meta.get('id') for meta in metadata],
+            genres=[meta.get('genre_keys') or extract_genres_from_string(meta.get('genres', [])) for meta in metadata],
+            years=[meta.get('year') for meta in metadata],
+            seasons=[meta.get('season_key') or meta.get('season') for meta in metadata],
+            ratings=[meta.get('rating') for meta in metadata],
+        )
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _genre_mask(self, genres: Collection[str]) -> np.ndarray:
+        packed = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+        for genre in genres:
+            bitmap = self.genre_bitmaps.get(genre.lower())
+            if bitmap is not None:
+                packed |= bitmap
+        return np.unpackbits(packed, count=self.size).view(bool)
+
+    def _range_mask(self, order: np.ndarray, sorted_values: np.ndarray, low: float, high: float) -> np.ndarray:
+        mask = np.zeros(self.size, dtype=bool)
+        if np.issubdtype(sorted_values.dtype, np.floating):
+            # Compare at the column's precision, so a stored 5.1 still satisfies a 5.1 bound
+            low, high = sorted_values.dtype.type(low), sorted_values.dtype.type(high)
+        start = sorted_values.searchsorted(low, side='left')
+        end = sorted_values.searchsorted(high, side='right')
+        mask[order[start:end]] = True
+        return mask
+
+    def compile(self, filters: QueryFilter, exclude_ids: Collection[str] = ()) -> Optional[np.ndarray]:
+        """Boolean row mask of the rows `filters` keeps, minus `exclude_ids`; None when nothing is constrained."""
+        mask = None
+
+        def restrict(part: np.ndarray) -> None:
+            nonlocal mask
+            mask = part if mask is None else mask & part
+
+        if filters.genres:
+            restrict(self._genre_mask(filters.genres))
+        if filters.year_start or filters.year_end:
+            restrict(self._range_mask(
+                self.year_order, self.sorted_year, filters.year_start or -math.inf, filters.year_end or math.inf
+            ))
+        if filters.seasons:
+            codes = [
+                self.season_codes_by_name[season.lower()] for season in filters.seasons
+                if season.lower() in self.season_codes_by_name
+            ]
+            restrict(np.isin(self.season_codes, codes))
+        if filters.rating_min or filters.rating_max:
+            restrict(self._range_mask(
+                self.rating_order, self.sorted_rating, filters.rating_min or -math.inf, filters.rating_max or math.inf
+            ))
+        if exclude_ids:
+            rows = [self.position[anime_id] for anime_id in map(str, exclude_ids) if anime_id in self.position]
+            if mask is None:
+                mask = np.ones(self.size, dtype=bool)
+            mask[rows] = False
+        return mask
+
+    def ids_matching(self, filters: QueryFilter) -> Optional[set]:
+        """Ids of the rows `filters` keeps; None when nothing is constrained."""
+        mask = self.compile(filters)
+        if mask is None:
+            return None
+        return {self.ids[row] for row in np.flatnonzero(mask)}
+
+    def selectivity(self, filters: QueryFilter) -> float:
+        """Exact fraction of the rows `filters` keeps."""
+        mask = self.compile(filters)
+        if mask is None or self.size == 0:
+            return 1.0
+        return int(np.count_nonzero(mask)) / self.size
+
+    def rows(self, ids: Sequence[Any]) -> np.ndarray:
+        """Row of every id, -1 for ids the index does not know."""
+        return np.fromiter((self.position.get(str(anime_id), -1) for anime_id in ids), dtype=np.int64, count=len(ids))
+
+    def check(self, ids: Sequence[Any], filters: QueryFilter) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Test many ids against `filters` at once.
+
+        Returns `(keep, known)`: whether each id passes, and whether the index
+        knew it at all (unknown ids have `keep` False; the caller decides).
+        """
+        rows = self.rows(ids)
+        known = rows >= 0
+        mask = self.compile(filters)
+        if mask is None:
+            return known.copy(), known
+        keep = np.zeros(len(rows), dtype=bool)
+        keep[known] = mask[rows[known]]
+        return keep, known
+
+
+def _number_column(values: Sequence[Any], dtype) -> np.ndarray:
+    column = np.zeros(len(values), dtype=dtype)
+    for i, value in enumerate(values):
+        try:
+            if value is not None and not (isinstance(value, float) and math.isnan(value)):
+                column[i] = value
+        except (TypeError, ValueError):
+            pass
+    return column
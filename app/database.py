@@ -1,66 +1,309 @@
-from supabase import create_client, Client
 import os
-from typing import List, Dict, Any
+import threading
+import time
+import numpy as np
+from typing import List, Dict, Any, Iterable, Optional
 from ast import literal_eval
+from functools import lru_cache
+from app.attribute_index import AttributeIndex
+from app.scoring import compute_feedback_scores, compute_normalized_ranks, compute_normalized_scores
+from app.metrics import timed
+from app.registry import registry, get_supabase
 from dotenv import load_dotenv
 load_dotenv(dotenv_path=".env.local", override=True)
-SUPABASE_URL = os.getenv('NEXT_PUBLIC_SUPABASE_URL')
-SUPABASE_KEY = os.getenv('NEXT_PUBLIC_SUPABASE_ANON_KEY')
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+ENRICHMENT_COLUMNS = ('id', 'num_favorites', 'num_list_users', 'feedback', 'rank', 'image_url')
+ENRICHMENT_CHUNK_SIZE = 200  # keeps the `in_` filter well under PostgREST's URL length limit
 
+CATALOG_COLUMNS = (
+    'id', 'title', 'description', 'rank', 'num_favorites', 'num_list_users', 'feedback',
+    'rating', 'image_url', 'genres', 'year', 'season'
+)
+CATALOG_PAGE_SIZE = 1000  # PostgREST's default max rows per request
+CATALOG_TTL_SECONDS = float(os.getenv('CATALOG_TTL_SECONDS', '900'))
+FALLBACK_TOTAL_DOCS = 24012  # only used until the catalog has loaded once
+
+
+class AnimeCatalog:
+    """
+    Immutable, column-oriented snapshot of the scoring attributes of every anime.
+
+    Rows are addressed by position; `position` maps an anime id (as a string)
+    to its row so lookups are O(1). A refresh builds a new snapshot and swaps
+    the module-level reference, so readers never see a half-loaded catalog.
+    """
+
+    def __init__(self, rows: List[Dict[str, Any]]):
+        self.ids: List[str] = [str(row['id']) for row in rows]
+        self.position: Dict[str, int] = {anime_id: i for i, anime_id in enumerate(self.ids)}
+        self.titles: List[str] = [row.get('title') or '' for row in rows]
+        self.descriptions: List[str] = [row.get('description') or '' for row in rows]
+        self.image_urls: List[str] = [row.get('image_url') or '' for row in rows]
+        self.seasons: List[str] = [row.get('season') or '' for row in rows]
+        self.genres: List[tuple] = [_genres_from_value(row.get('genres')) for row in rows]
+        self.rank = _numeric_column(rows, 'rank', 0.0)
+        self.num_favorites = _numeric_column(rows, 'num_favorites', 0.0)
+        self.num_list_users = _numeric_column(rows, 'num_list_users', 1.0)
+        self.feedback = _numeric_column(rows, 'feedback', 1.0)
+        self.rating = _numeric_column(rows, 'rating', 0.0)
+        self.year = _numeric_column(rows, 'year', 0.0).astype(np.int32)
+        self.loaded_at = time.time()
+
+        # Query-independent scoring columns, computed once per snapshot instead of per request
+        total_docs = max(len(self.ids), 1)
+        self.feedback_score = compute_feedback_scores(self.num_favorites, self.num_list_users, self.feedback)
+        self.normalized_rank = compute_normalized_ranks(self.rank, total_docs)
+        self.normalized_score = compute_normalized_scores(
+            self.rating, self.feedback_score, self.normalized_rank, total_docs
+        )
+
+        # Genre bitmaps, sorted year/rating and season codes for vectorised filtering
+        self.attributes = AttributeIndex(self.ids, self.genres, self.year, self.seasons, self.rating)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, anime_id: Any) -> bool:
+        return str(anime_id) in self.position
+
+    def row(self, anime_id: Any) -> Optional[Dict[str, Any]]:
+        i = self.position.get(str(anime_id))
+        if i is None:
+            return None
+        return {
+            'id': self.ids[i],
+            'title': self.titles[i],
+            'description': self.descriptions[i],
+            'rank': float(self.rank[i]),
+            'num_favorites': float(self.num_favorites[i]),
+            'num_list_users': float(self.num_list_users[i]),
+            'feedback': float(self.feedback[i]),
+            'rating': float(self.rating[i]),
+            'image_url': self.image_urls[i],
+            'genres': list(self.genres[i]),
+            'year': int(self.year[i]),
+            'season': self.seasons[i],
+        }
+
+    def vector_metadata(self, anime_id: Any) -> Optional[Dict[str, Any]]:
+        """
+        The row shaped like vector metadata (`anime_embeddings.build_metadata`),
+        so candidates need no store lookup.
+        """
+        i = self.position.get(str(anime_id))
+        if i is None:
+            return None
+        metadata = {
+            'id': self.ids[i],
+            'title': self.titles[i],
+            'description': self.descriptions[i],
+            'genres': list(self.genres[i]),
+            'season': self.seasons[i],
+            # Via the float32's shortest repr, so 8.7 comes back as 8.7 and not 8.699999809
+            'rating': float(str(self.rating[i])),
+            'normalized_score': float(self.normalized_score[i]),
+        }
+        # Missing years are stored as 0 here but left out of vector metadata
+        if self.year[i]:
+            metadata['year'] = int(self.year[i])
+        return metadata
+
+def _numeric_column(rows: List[Dict[str, Any]], column: str, default: float) -> np.ndarray:
+    values = np.empty(len(rows), dtype=np.float32)
+    for i, row in enumerate(rows):
+        try:
+            value = row.get(column)
+            values[i] = default if value is None else float(value)
+        except (TypeError, ValueError):
+            values[i] = default
+    return values
+
+
+def _genres_from_value(value: Any) -> tuple:
+    if isinstance(value, (list, tuple)):
+        return tuple(str(genre).strip() for genre in value if str(genre).strip())
+    if isinstance(value, str):
+        return tuple(genre.strip().strip("\"'") for genre in value.strip().strip("[]").split(',') if genre.strip())
+    return ()
+
+
+_catalog: Optional[AnimeCatalog] = None
+_catalog_load_lock = threading.Lock()
+_catalog_load_attempted = False
+_catalog_refresh_requested = threading.Event()
+_catalog_stop = threading.Event()
+_catalog_thread: Optional[threading.Thread] = None
+
+
+@timed('db_load_catalog')
+def load_catalog() -> Optional[AnimeCatalog]:
+    """Page through the whole `anime` table and swap in a fresh catalog snapshot."""
+    global _catalog
+    try:
+        rows: List[Dict[str, Any]] = []
+        start = 0
+        while True:
+            response = (
+                get_supabase().table('anime')
+                .select(*CATALOG_COLUMNS)
+                .order('id')
+                .range(start, start + CATALOG_PAGE_SIZE - 1)
+                .execute()
+            )
+            page = response.data or []
+            rows.extend(page)
+            if len(page) < CATALOG_PAGE_SIZE:
+                break
+            start += CATALOG_PAGE_SIZE
+        _catalog = AnimeCatalog(rows)
+        print(f"Loaded anime catalog with {len(_catalog)} rows")
+    except Exception as e:
+        print(f"Error loading anime catalog: {e}")
+    return _catalog
+
+
+def get_catalog() -> Optional[AnimeCatalog]:
+    """
+    Return the current catalog snapshot.
+
+    The first call loads it synchronously if the refresher has not been
+    started; after that, reloading is left to the refresher so a failing
+    database never turns a lookup into a full table scan.
+    """
+    global _catalog_load_attempted
+    if _catalog is None and not _catalog_load_attempted:
+        with _catalog_load_lock:
+            if _catalog is None and not _catalog_load_attempted:
+                _catalog_load_attempted = True
+                load_catalog()
+    return _catalog
+
+
+def request_catalog_refresh() -> None:
+    """Signal the background refresher to reload the catalog now instead of waiting for the TTL."""
+    _catalog_refresh_requested.set()
+
+
+def _catalog_refresh_loop(ttl_seconds: float) -> None:
+    while not _catalog_stop.is_set():
+        _catalog_refresh_requested.wait(timeout=ttl_seconds)
+        if _catalog_stop.is_set():
+            break
+        _catalog_refresh_requested.clear()
+        load_catalog()
+
+
+def start_catalog_refresher(ttl_seconds: float = CATALOG_TTL_SECONDS) -> None:
+    """Load the catalog and keep it fresh from a daemon thread."""
+    global _catalog_thread, _catalog_load_attempted
+    if _catalog_thread is not None and _catalog_thread.is_alive():
+        return
+    _catalog_load_attempted = True
+    # Already loaded when a pre-fork parent (app.serve) shares its catalog with the workers
+    if _catalog is None:
+        load_catalog()
+    _catalog_stop.clear()
+    _catalog_thread = threading.Thread(
+        target=_catalog_refresh_loop, args=(ttl_seconds,), name='catalog-refresher', daemon=True
+    )
+    _catalog_thread.start()
+
+
+def stop_catalog_refresher() -> None:
+    _catalog_stop.set()
+    _catalog_refresh_requested.set()
+
+
+@timed('db_anime_details')
 def get_anime_details(anime_ids: List[str]) -> List[Dict[str, Any]]:
     try:
-        response = supabase.table('anime').select('*').in_('id', anime_ids).execute()
-        return response.data
+        catalog = get_catalog()
+        details = []
+        missing = []
+        for anime_id in anime_ids:
+            row = catalog.row(anime_id) if catalog is not None else None
+            if row is None:
+                missing.append(anime_id)
+            else:
+                details.append(row)
+        if missing:
+            response = get_supabase().table('anime').select('*').in_('id', missing).execute()
+            details.extend(response.data)
+        return details
     except Exception as e:
         print(f"Error fetching anime details: {e}")
         return []
 
+async def get_async_supabase():
+    # Created on first use inside the running event loop
+    return await registry.aget('async_supabase')
+
+@lru_cache(maxsize=4096)
+def _literal_watched_list(watched_list: str) -> tuple:
+    # Unchanged watch lists come back as the same string, so parse each one only once
+    return tuple(literal_eval(watched_list))
+
+def _parse_watched_list(response_data: List[Dict[str, Any]]) -> List[str]:
+    if response_data:
+        user = response_data[0]
+        watched_list = user.get('user_watched_list', '')
+        return list(_literal_watched_list(watched_list))
+    return []
+
+@timed('db_user_history')
 def get_user_history(user_id: str) -> List[str]:
     try:
-        response = supabase.table('user').select('user_watched_list').eq('user_id', user_id).execute()
-        if response.data:
-            user = response.data[0]
-            watched_list = user.get('user_watched_list', '')
-            return literal_eval(watched_list)
+        response = get_supabase().table('user').select('user_watched_list').eq('user_id', user_id).execute()
+        return _parse_watched_list(response.data)
+    except Exception as e:
+        print(f"Error fetching user history: {e}")
         return []
+
+@timed('db_user_history')
+async def async_get_user_history(user_id: str) -> List[str]:
+    try:
+        client = await get_async_supabase()
+        response = await client.table('user').select('user_watched_list').eq('user_id', user_id).execute()
+        return _parse_watched_list(response.data)
     except Exception as e:
         print(f"Error fetching user history: {e}")
         return []
 
+@timed('db_anime_feedback')
 def get_anime_feedback(anime_id: str) -> float:
     try:
-        response = supabase.table('anime').select('num_favorites', 'num_list_users', 'feedback').eq('id', anime_id).execute()
+        catalog = get_catalog()
+        if catalog is not None and anime_id in catalog:
+            return float(catalog.feedback_score[catalog.position[str(anime_id)]])
+        response = get_supabase().table('anime').select('num_favorites', 'num_list_users', 'feedback').eq('id', anime_id).execute()
         if response.data:
-            anime = response.data[0]
-            num_favorites = float(anime.get('num_favorites', 0))
-            num_lists = float(anime.get('num_list_users', 1))
-            if num_lists == 0:
-                num_lists = 1
-            user_feedback = anime.get('feedback', 1)
-            return num_favorites / num_lists + user_feedback
+            return _feedback_from_row(response.data[0])
         return 0.0
     except Exception as e:
         print(f"Error getting anime feedback: {e}")
         return 0.0
 
+@timed('db_anime_normalized_rank')
 def get_anime_normalized_rank(anime_id: str) -> float:
     try:
-        response = supabase.table('anime').select('rank').eq('id', anime_id).execute()
+        catalog = get_catalog()
+        if catalog is not None and anime_id in catalog:
+            return float(catalog.normalized_rank[catalog.position[str(anime_id)]])
+        response = get_supabase().table('anime').select('rank').eq('id', anime_id).execute()
         if response.data:
-            anime = response.data[0]
-            rank = float(anime.get('rank', 0))
-            normalized_rank = (get_total_docs() - rank) / get_total_docs()
-            return normalized_rank
+            return _normalized_rank_from_row(response.data[0])
         return 0.0
     except Exception as e:
         print(f"Error getting anime rank: {e}")
         return 0.0
 
+@timed('db_anime_image_url')
 def get_anime_image_url(anime_id: str) -> str:
     try:
-        response = supabase.table('anime').select('image_url').eq('id', anime_id).execute()
+        catalog = get_catalog()
+        if catalog is not None and anime_id in catalog:
+            return catalog.image_urls[catalog.position[str(anime_id)]]
+        response = get_supabase().table('anime').select('image_url').eq('id', anime_id).execute()
         if response.data:
             anime = response.data[0]
             return anime.get('image_url', '')
@@ -70,5 +313,62 @@ def get_anime_image_url(anime_id: str) -> str:
         return ''
 
 def get_total_docs() -> int:
-    return 24012  # Fallback to a fixed number to avoid division by zero
+    catalog = _catalog
+    if catalog is not None and len(catalog) > 0:
+        return len(catalog)
+    return FALLBACK_TOTAL_DOCS  # Fallback to a fixed number to avoid division by zero
+
+def _feedback_from_row(anime: Dict[str, Any]) -> float:
+    num_favorites = float(anime.get('num_favorites') or 0)
+    num_lists = float(anime.get('num_list_users') or 1)
+    if num_lists == 0:
+        num_lists = 1
+    user_feedback = anime.get('feedback')
+    if user_feedback is None:
+        user_feedback = 1
+    return num_favorites / num_lists + float(user_feedback)
+
+def _normalized_rank_from_row(anime: Dict[str, Any]) -> float:
+    rank = float(anime.get('rank') or 0)
+    total_docs = get_total_docs()
+    return (total_docs - rank) / total_docs
+
+@timed('db_anime_enrichment')
+def get_anime_enrichment(anime_ids: Iterable[str], chunk_size: int = ENRICHMENT_CHUNK_SIZE) -> Dict[str, Dict[str, Any]]:
+    """
+    Fetch the scoring attributes for a whole candidate set in as few queries as possible.
 
+    Returns a map of anime id (as a string) to its `feedback`, `normalized_rank`,
+    `image_url` and, for catalog hits, the precomputed `normalized_score`. Ids
+    are served from the in-process catalog; only ids it does not know yet are
+    fetched from Supabase. Ids missing from the table are absent from the map.
+    """
+    unique_ids = list(dict.fromkeys(str(anime_id) for anime_id in anime_ids))
+    enrichment: Dict[str, Dict[str, Any]] = {}
+    catalog = get_catalog()
+    missing = []
+    for anime_id in unique_ids:
+        i = catalog.position.get(anime_id) if catalog is not None else None
+        if i is None:
+            missing.append(anime_id)
+            continue
+        enrichment[anime_id] = {
+            'feedback': float(catalog.feedback_score[i]),
+            'normalized_rank': float(catalog.normalized_rank[i]),
+            'normalized_score': float(catalog.normalized_score[i]),
+            'image_url': catalog.image_urls[i],
+        }
+    for start in range(0, len(missing), chunk_size):
+        chunk = missing[start:start + chunk_size]
+        try:
+            response = get_supabase().table('anime').select(*ENRICHMENT_COLUMNS).in_('id', chunk).execute()
+        except Exception as e:
+            print(f"Error fetching anime enrichment: {e}")
+            continue
+        for anime in response.data or []:
+            enrichment[str(anime['id'])] = {
+                'feedback': _feedback_from_row(anime),
+                'normalized_rank': _normalized_rank_from_row(anime),
+                'image_url': anime.get('image_url') or '',
+            }
+    return enrichment
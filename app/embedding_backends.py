@@ -0,0 +1,179 @@
+"""
+Selectable CPU embedding backends.
+
+All backends implement the LangChain `Embeddings` interface
+(`embed_documents` / `embed_query`) and produce the same vectors as the
+float32 model up to quantisation error, so they can serve an index built
+with any of them. Pick one with `EMBEDDING_BACKEND`:
+
+- `torch` (default): float32 PyTorch via `HuggingFaceEmbeddings`.
+- `int8`: the same sentence-transformer with its Linear layers dynamically
+  quantised to int8 (`torch.quantization.quantize_dynamic`). Roughly a
+  quarter of the weight memory and faster matmuls on CPUs with VNNI/AVX2.
+- `onnx`: an ONNX export of the transformer run by onnxruntime, loaded from
+  `EMBEDDING_ONNX_PATH` (see `python -m app.embedding_backends export`).
+
+Thread counts default to the cores the container may actually use (CPU
+affinity and cgroup quota), not the host's core count. Check top-k quality
+against float32 with `python -m benchmarks.embedding_recall`.
+
+Usage:
+    python -m app.embedding_backends export [--output models/all-MiniLM-L6-v2-onnx]
+"""
+
+import argparse
+import math
+import os
+from typing import List, Optional
+
+MODEL_NAME = 'sentence-transformers/all-MiniLM-L6-v2'
+MAX_SEQ_LENGTH = 256  # all-MiniLM-L6-v2's limit; longer texts are truncated like sentence-transformers does
+DEFAULT_ONNX_PATH = 'models/all-MiniLM-L6-v2-onnx'
+BACKENDS = ('torch', 'int8', 'onnx')
+
+
+def _cgroup_cpu_limit() -> Optional[float]:
+    """CPU quota of this container in cores, or None when unlimited / not in a cgroup."""
+    try:
+        # cgroup v2: "<quota> <period>" or "max <period>"
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+    try:
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+            quota = int(f.read())
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+            period = int(f.read())
+        return quota / period if quota > 0 else None
+    except (OSError, ValueError):
+        return None
+
+
+def available_cores() -> int:
+    """Cores this process can use: CPU affinity, capped by the cgroup CPU quota."""
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    limit = _cgroup_cpu_limit()
+    if limit is not None:
+        cores = min(cores, max(1, math.ceil(limit)))
+    return cores
+
+
+def embedding_threads() -> int:
+    return int(os.getenv('EMBEDDING_THREADS', '0')) or available_cores()
+
+
+class QuantizedEmbeddings:
+    """sentence-transformer with int8 dynamically quantised Linear layers."""
+
+    def __init__(self, model_name: str = MODEL_NAME, threads: Optional[int] = None):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        torch.set_num_threads(threads or embedding_threads())
+        model = SentenceTransformer(model_name, device='cpu')
+        self.model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.model.encode(list(texts), convert_to_numpy=True).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class OnnxEmbeddings:
+    """Exported transformer on onnxruntime, with the model's mean pooling and L2 normalisation."""
+
+    def __init__(self, path: str = DEFAULT_ONNX_PATH, threads: Optional[int] = None):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads or embedding_threads()
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            os.path.join(path, 'model.onnx'), options, providers=['CPUExecutionProvider']
+        )
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(path)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        import numpy as np
+
+        if not texts:
+            return []
+        encoded = self.tokenizer(
+            list(texts), padding=True, truncation=True, max_length=MAX_SEQ_LENGTH, return_tensors='np'
+        )
+        inputs = {name: value.astype(np.int64) for name, value in encoded.items() if name in self.input_names}
+        token_embeddings = self.session.run(None, inputs)[0]
+        mask = encoded['attention_mask'][..., None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def create_embeddings(backend: Optional[str] = None, threads: Optional[int] = None):
+    """Embeddings for `backend` (default: EMBEDDING_BACKEND, else float32 torch)."""
+    backend = (backend or os.getenv('EMBEDDING_BACKEND', 'torch')).lower()
+    if backend == 'int8':
+        return QuantizedEmbeddings(threads=threads)
+    if backend == 'onnx':
+        return OnnxEmbeddings(os.getenv('EMBEDDING_ONNX_PATH', DEFAULT_ONNX_PATH), threads=threads)
+    if backend != 'torch':
+        raise ValueError(f"Unknown embedding backend: {backend!r} (expected one of {', '.join(BACKENDS)})")
+
+    import torch
+    from langchain_huggingface import HuggingFaceEmbeddings
+    torch.set_num_threads(threads or embedding_threads())
+    return HuggingFaceEmbeddings(model_name=MODEL_NAME)
+
+
+def export_onnx(output: str = DEFAULT_ONNX_PATH, model_name: str = MODEL_NAME) -> str:
+    """Export the model's transformer to `output/model.onnx` next to its tokenizer."""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(output, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name).eval()
+    sample = tokenizer(["an example anime description"], return_tensors='pt')
+    names = ['input_ids', 'attention_mask', 'token_type_ids']
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in names}
+    dynamic_axes['last_hidden_state'] = {0: 'batch', 1: 'sequence'}
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[name] for name in names),
+            os.path.join(output, 'model.onnx'),
+            input_names=names,
+            output_names=['last_hidden_state'],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+        )
+    tokenizer.save_pretrained(output)
+    return output
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Embedding backend tools")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export = subparsers.add_parser('export', help="Export the model to ONNX for EMBEDDING_BACKEND=onnx")
+    export.add_argument('--output', default=DEFAULT_ONNX_PATH)
+    args = parser.parse_args(argv)
+    if args.command == 'export':
+        print(f"ONNX model written to {export_onnx(args.output)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Dynamic micro-batching for query embeddings.
+
+Concurrent requests each need one query vector. Encoding them one by one
+means many tiny forward passes; `EmbeddingBatcher` instead collects the
+texts that arrive within `max_wait_ms` (or until `max_batch_size` is
+reached), encodes them with a single `embed_documents` call and resolves
+each caller's future with its own vector. An LRU cache of recent query
+vectors sits in front, so repeated queries skip the model entirely.
+"""
+
+import asyncio
+import os
+from typing import Dict, List, Optional, Set
+
+from app.cache import TTLCache
+from app.metrics import timed, increment, cache_hits, cache_misses
+
+
+class EmbeddingBatcher:
+    def __init__(
+        self,
+        embeddings,
+        max_batch_size: int = int(os.getenv('EMBEDDING_MAX_BATCH_SIZE', '32')),
+        max_wait_ms: float = float(os.getenv('EMBEDDING_MAX_WAIT_MS', '5')),
+        cache_size: int = int(os.getenv('EMBEDDING_CACHE_SIZE', '4096')),
+        executor=None,
+    ):
+        self.embeddings = embeddings
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.executor = executor
+        # Encoding is deterministic, so cached vectors never go stale
+        self.cache = TTLCache(max_size=cache_size, ttl_seconds=float('inf'))
+        self.batches = 0
+        self.batched_texts = 0
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    @timed('embed_query')
+    async def embed(self, text: str) -> List[float]:
+        vector = self.cache.get(text)
+        increment(cache_hits if vector is not None else cache_misses, 'embedding')
+        if vector is not None:
+            return vector
+
+        # Identical texts waiting or being encoded share one slot in the batch
+        future = self._pending.get(text) or self._in_flight.get(text)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._pending[text] = future
+            if len(self._pending) >= self.max_batch_size:
+                self._flush()
+            elif self._flush_handle is None:
+                self._flush_handle = loop.call_later(self.max_wait, self._flush)
+        return await asyncio.shield(future)
+
+    @timed('embed_query')
+    async def embed_many(self, texts: List[str]) -> List[List[float]]:
+        """Encode a whole batch of texts with one `embed_documents` call for the cache misses."""
+        vectors = {text: self.cache.get(text) for text in dict.fromkeys(texts)}
+        misses = [text for text, vector in vectors.items() if vector is None]
+        increment(cache_hits, 'embedding', amount=len(vectors) - len(misses))
+        increment(cache_misses, 'embedding', amount=len(misses))
+        if misses:
+            loop = asyncio.get_running_loop()
+            encoded = await loop.run_in_executor(self.executor, self.embeddings.embed_documents, misses)
+            self.batches += 1
+            self.batched_texts += len(misses)
+            for text, vector in zip(misses, encoded):
+                self.cache.set(text, vector)
+                vectors[text] = vector
+        return [vectors[text] for text in texts]
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        self._in_flight.update(pending)
+        task = asyncio.get_running_loop().create_task(self._encode(pending))
+        # The loop only keeps weak references to tasks
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _encode(self, pending: Dict[str, asyncio.Future]) -> None:
+        texts = list(pending)
+        loop = asyncio.get_running_loop()
+        try:
+            vectors = await loop.run_in_executor(self.executor, self.embeddings.embed_documents, texts)
+        except Exception as e:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            for text in texts:
+                self._in_flight.pop(text, None)
+
+        self.batches += 1
+        self.batched_texts += len(texts)
+        for text, vector in zip(texts, vectors):
+            self.cache.set(text, vector)
+            future = pending[text]
+            if not future.done():
+                future.set_result(vector)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'batches': self.batches,
+            'batched_texts': self.batched_texts,
+            'mean_batch_size': self.batched_texts / self.batches if self.batches else 0.0,
+            'cache': self.cache.stats(),
+        }
@@ -0,0 +1,180 @@
+"""
+Item-to-Item Neighbour Table
+
+Offline job that computes the top-N cosine neighbours of every anime from
+the local embedding snapshot written by `app.anime_embeddings`. It uses
+blocked matrix multiplication, so peak memory is one `block_size x n_items`
+score block and never the full similarity matrix.
+
+The result is a compact array-backed table (`neighbours.npz`): the anime id
+of each row, plus `[n_items, N]` arrays of neighbour ids (int32) and
+similarities (float16). History recommendations in `neighbours` mode merge
+the lists of the watched items with a table lookup, with no embedding or
+vector query at request time.
+
+Usage:
+    python -m app.item_neighbours [--snapshot-dir data/embeddings] [--neighbours 50]
+"""
+
+import argparse
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from tqdm import tqdm
+
+from app.vector_store import DEFAULT_SNAPSHOT_DIR, LocalVectorStore
+
+NEIGHBOURS_FILE = 'neighbours.npz'
+
+
+def compute_neighbours(vectors: np.ndarray,
+                       n_neighbours: int = 50,
+                       block_size: int = 512) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find the top-N cosine neighbours of every row.
+
+    Args:
+        vectors: L2-normalised embedding matrix, one row per item
+        n_neighbours: Neighbours kept per item
+        block_size: Rows scored per matrix multiplication
+
+    Returns:
+        Row indices of the neighbours and their similarities, best first
+    """
+    n_items = vectors.shape[0]
+    n_neighbours = min(n_neighbours, n_items - 1)
+    matrix = np.ascontiguousarray(vectors, dtype=np.float32)
+    neighbour_rows = np.empty((n_items, n_neighbours), dtype=np.int32)
+    neighbour_scores = np.empty((n_items, n_neighbours), dtype=np.float16)
+
+    for start in tqdm(range(0, n_items, block_size), desc="Computing neighbours"):
+        end = min(start + block_size, n_items)
+        scores = matrix[start:end] @ matrix.T
+        # An item is not its own neighbour
+        scores[np.arange(end - start), np.arange(start, end)] = -np.inf
+        best = np.argpartition(-scores, n_neighbours - 1, axis=1)[:, :n_neighbours]
+        best_scores = np.take_along_axis(scores, best, axis=1)
+        order = np.argsort(-best_scores, axis=1, kind='stable')
+        neighbour_rows[start:end] = np.take_along_axis(best, order, axis=1)
+        neighbour_scores[start:end] = np.take_along_axis(best_scores, order, axis=1)
+    return neighbour_rows, neighbour_scores
+
+
+def build_neighbour_table(snapshot_dir: str = DEFAULT_SNAPSHOT_DIR,
+                          n_neighbours: int = 50,
+                          block_size: int = 512,
+                          output: Optional[str] = None) -> str:
+    """
+    Compute and save the neighbour table for a snapshot.
+
+    Args:
+        snapshot_dir: Local snapshot written by app.anime_embeddings
+        n_neighbours: Neighbours kept per item
+        block_size: Rows scored per matrix multiplication
+        output: Output path (default: neighbours.npz in the snapshot)
+
+    Returns:
+        Path of the written table
+    """
+    store = LocalVectorStore(snapshot_dir)
+    anime_ids = np.array([int(anime_id) for anime_id in store.ids], dtype=np.int32)
+    neighbour_rows, neighbour_scores = compute_neighbours(store.vectors, n_neighbours, block_size)
+
+    output = output or os.path.join(snapshot_dir, NEIGHBOURS_FILE)
+    np.savez(
+        output + '.tmp.npz',
+        anime_ids=anime_ids,
+        neighbour_ids=anime_ids[neighbour_rows],
+        scores=neighbour_scores,
+    )
+    os.replace(output + '.tmp.npz', output)
+    return output
+
+
+class NeighbourTable:
+    def __init__(self, path: str):
+        with np.load(path) as data:
+            self.anime_ids = data['anime_ids']
+            self.neighbour_ids = data['neighbour_ids']
+            self.scores = data['scores']
+        self.position: Dict[int, int] = {int(anime_id): i for i, anime_id in enumerate(self.anime_ids)}
+
+    def recommend(self,
+                  watched_ids: Sequence[str],
+                  n_results: int,
+                  recency_decay: float = 0.0) -> List[Tuple[str, float]]:
+        """
+        Merge the neighbour lists of the watched items.
+
+        A candidate's score is the weighted mean of its similarity to each
+        watched item (0 where it is not in that item's list). With
+        `recency_decay > 0`, later entries of the watch list weigh more.
+
+        Args:
+            watched_ids: Watched anime ids, oldest first
+            n_results: Number of candidates to return
+            recency_decay: Per-position weight decay towards older items
+
+        Returns:
+            (anime id, score) pairs, best first, excluding watched items
+        """
+        rows, weights = [], []
+        for age, anime_id in enumerate(reversed(list(watched_ids))):
+            try:
+                row = self.position.get(int(anime_id))
+            except (TypeError, ValueError):
+                row = None
+            if row is not None:
+                rows.append(row)
+                weights.append((1.0 - recency_decay) ** age)
+        if not rows:
+            return []
+
+        weights = np.asarray(weights, dtype=np.float32)
+        candidate_ids = self.neighbour_ids[rows].ravel()
+        candidate_scores = (self.scores[rows].astype(np.float32) * weights[:, None]).ravel()
+        unique_ids, inverse = np.unique(candidate_ids, return_inverse=True)
+        totals = np.bincount(inverse, weights=candidate_scores) / weights.sum()
+
+        watched = np.array([int(self.anime_ids[row]) for row in rows], dtype=np.int32)
+        totals[np.isin(unique_ids, watched)] = -np.inf
+        k = min(n_results, int(np.isfinite(totals).sum()))
+        if k <= 0:
+            return []
+        best = np.argpartition(-totals, k - 1)[:k]
+        best = best[np.argsort(-totals[best], kind='stable')]
+        return [(str(unique_ids[i]), float(totals[i])) for i in best]
+
+
+_table: Optional[NeighbourTable] = None
+_table_loaded = False
+
+
+def get_neighbour_table() -> Optional[NeighbourTable]:
+    """The table at NEIGHBOUR_TABLE_PATH, loaded once; None if it has not been built."""
+    global _table, _table_loaded
+    if not _table_loaded:
+        _table_loaded = True
+        path = os.getenv('NEIGHBOUR_TABLE_PATH', os.path.join(DEFAULT_SNAPSHOT_DIR, NEIGHBOURS_FILE))
+        if os.path.exists(path):
+            try:
+                _table = NeighbourTable(path)
+            except Exception as e:
+                print(f"Error loading neighbour table: {e}")
+    return _table
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Build the item-to-item neighbour table")
+    parser.add_argument('--snapshot-dir', default=DEFAULT_SNAPSHOT_DIR, help="Local embedding snapshot")
+    parser.add_argument('--neighbours', type=int, default=50, help="Neighbours kept per item")
+    parser.add_argument('--block-size', type=int, default=512, help="Rows scored per matrix multiplication")
+    parser.add_argument('--output', help="Output path (default: neighbours.npz in the snapshot)")
+    args = parser.parse_args(argv)
+    path = build_neighbour_table(args.snapshot_dir, args.neighbours, args.block_size, args.output)
+    print(f"Neighbour table written to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""
+Keyword Inverted Index
+
+A compact in-process BM25 index over the text each anime is embedded from
+(title, description and genres, as `app.anime_embeddings.preprocess_data`
+combines them). It is built from a local snapshot's metadata and saved next
+to the embeddings as `keywords.npz`, in CSR layout: the sorted vocabulary,
+each term's offset into one postings array of row indices (int32) with
+their term frequencies (uint16), and the token count of every document.
+
+Query recommendations search it with the query text plus the parsed
+`description_keywords` and fuse the keyword ranking with the vector ranking
+by reciprocal rank fusion, so exact titles and rare terms are found without
+a larger dense `top_k`.
+
+`app.anime_embeddings` rebuilds it whenever it writes a snapshot; rebuild
+by hand with:
+    python -m app.keyword_index [--snapshot-dir data/embeddings]
+"""
+
+import argparse
+import json
+import os
+import re
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.vector_store import DEFAULT_SNAPSHOT_DIR, SNAPSHOT_METADATA_FILE
+
+KEYWORDS_FILE = 'keywords.npz'
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60
+
+TOKEN_PATTERN = re.compile(r"\w+")
+STOPWORDS = frozenset("""
+    a an and are as at be but by for from has have he her his in is it its of on or she so
+    that the their them they this to was were which who will with about after all also any
+    been into like me more most my not one only other our out some than then there these
+    those up very we what when where while you your i anime show series something want
+""".split())
+
+
+def tokenize(text: Any) -> List[str]:
+    """Lower-cased word tokens of `text`, without stopwords and single characters."""
+    if not isinstance(text, str):
+        return []
+    return [
+        token for token in TOKEN_PATTERN.findall(text.lower())
+        if len(token) > 1 and token not in STOPWORDS
+    ]
+
+
+def document_text(meta: Dict[str, Any]) -> str:
+    """The `combined_text` of a snapshot row, rebuilt from its metadata."""
+    genres = meta.get('genres') or []
+    if isinstance(genres, list):
+        genres = ','.join(genres)
+    return f"{meta.get('title') or ''} {meta.get('description') or ''} {genres}"
+
+
+class KeywordIndex:
+    def __init__(self, ids: np.ndarray, terms: List[str], offsets: np.ndarray,
+                 postings: np.ndarray, frequencies: np.ndarray, lengths: np.ndarray):
+        self.ids = ids
+        self.terms = terms
+        self.offsets = offsets
+        self.postings = postings
+        self.frequencies = frequencies
+        self.lengths = lengths
+        self.term_ids: Dict[str, int] = {term: i for i, term in enumerate(terms)}
+
+        n_docs = len(ids)
+        document_frequency = np.diff(offsets).astype(np.float32)
+        self.idf = np.log1p((n_docs - document_frequency + 0.5) / (document_frequency + 0.5)).astype(np.float32)
+        average_length = float(lengths.mean()) if n_docs else 0.0
+        # Per-document part of the BM25 denominator, computed once
+        self.length_norm = (BM25_K1 * (1 - BM25_B + BM25_B * lengths / max(average_length, 1.0))).astype(np.float32)
+
+    @classmethod
+    def build(cls, ids: Sequence[Any], texts: Iterable[str]) -> 'KeywordIndex':
+        rows: Dict[str, List[Tuple[int, int]]] = {}
+        lengths = []
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            for term, count in Counter(tokens).items():
+                rows.setdefault(term, []).append((row, count))
+
+        terms = sorted(rows)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(rows[term]) for term in terms])
+        postings = np.empty(offsets[-1], dtype=np.int32)
+        frequencies = np.empty(offsets[-1], dtype=np.uint16)
+        for i, term in enumerate(terms):
+            entries = np.asarray(rows[term], dtype=np.int64)
+            postings[offsets[i]:offsets[i + 1]] = entries[:, 0]
+            frequencies[offsets[i]:offsets[i + 1]] = np.minimum(entries[:, 1], np.iinfo(np.uint16).max)
+        return cls(
+            np.asarray([str(anime_id) for anime_id in ids]),
+            terms,
+            offsets,
+            postings,
+            frequencies,
+            np.asarray(lengths, dtype=np.int32),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> 'KeywordIndex':
+        with np.load(path) as data:
+            terms = data['terms'].tobytes().decode('utf-8').split('\n') if data['terms'].size else []
+            return cls(data['ids'], terms, data['offsets'], data['postings'], data['frequencies'], data['lengths'])
+
+    def save(self, path: str) -> None:
+        # Write to a temporary name first so a running service never loads a half-written file
+        np.savez(
+            path + '.tmp.npz',
+            ids=self.ids,
+            # One newline-separated UTF-8 buffer; a fixed-width string array would pad every term to the longest
+            terms=np.frombuffer('\n'.join(self.terms).encode('utf-8'), dtype=np.uint8),
+            offsets=self.offsets,
+            postings=self.postings,
+            frequencies=self.frequencies,
+            lengths=self.lengths,
+        )
+        os.replace(path + '.tmp.npz', path)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def search(self, tokens: Sequence[str], top_k: int) -> List[Tuple[str, float]]:
+        """
+        BM25 search.
+
+        Args:
+            tokens: Query tokens (see `tokenize`); repeats are counted once
+            top_k: Number of documents to return
+
+        Returns:
+            (anime id, BM25 score) pairs, best first
+        """
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        matched = False
+        for token in set(tokens):
+            term = self.term_ids.get(token)
+            if term is None:
+                continue
+            start, end = self.offsets[term], self.offsets[term + 1]
+            docs = self.postings[start:end]
+            tf = self.frequencies[start:end].astype(np.float32)
+            # Each document appears once per term, so plain fancy-index addition is safe
+            scores[docs] += self.idf[term] * tf * (BM25_K1 + 1) / (tf + self.length_norm[docs])
+            matched = True
+        if not matched:
+            return []
+
+        hits = np.flatnonzero(scores)
+        k = min(top_k, hits.size)
+        if k <= 0:
+            return []
+        best = hits[np.argpartition(-scores[hits], k - 1)[:k]] if k < hits.size else hits
+        best = best[np.argsort(-scores[best], kind='stable')]
+        return [(str(self.ids[row]), float(scores[row])) for row in best]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = RRF_K) -> Dict[str, float]:
+    """Sum of 1 / (k + rank) over the rankings each id appears in (rank starts at 1)."""
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, anime_id in enumerate(ranking, start=1):
+            fused[anime_id] = fused.get(anime_id, 0.0) + 1.0 / (k + rank)
+    return fused
+
+
+def build_keyword_index(snapshot_dir: str = DEFAULT_SNAPSHOT_DIR, output: Optional[str] = None) -> str:
+    """
+    Build and save the keyword index for a snapshot.
+
+    Args:
+        snapshot_dir: Local snapshot written by app.anime_embeddings
+        output: Output path (default: keywords.npz in the snapshot)
+
+    Returns:
+        Path of the written index
+    """
+    with open(os.path.join(snapshot_dir, SNAPSHOT_METADATA_FILE), 'r', encoding='utf-8') as f:
+        metadata = json.load(f)
+    index = KeywordIndex.build([meta['id'] for meta in metadata], (document_text(meta) for meta in metadata))
+    output = output or os.path.join(snapshot_dir, KEYWORDS_FILE)
+    index.save(output)
+    return output
+
+
+_index: Optional[KeywordIndex] = None
+_index_loaded = False
+
+
+def get_keyword_index() -> Optional[KeywordIndex]:
+    """The index at KEYWORD_INDEX_PATH, loaded once; None if it has not been built or hybrid retrieval is off."""
+    global _index, _index_loaded
+    if not _index_loaded:
+        _index_loaded = True
+        if os.getenv('HYBRID_RETRIEVAL', 'true').lower() != 'true':
+            return None
+        path = os.getenv('KEYWORD_INDEX_PATH', os.path.join(DEFAULT_SNAPSHOT_DIR, KEYWORDS_FILE))
+        if os.path.exists(path):
+            try:
+                _index = KeywordIndex.load(path)
+            except Exception as e:
+                print(f"Error loading keyword index: {e}")
+    return _index
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Build the BM25 keyword index of a snapshot")
+    parser.add_argument('--snapshot-dir', default=DEFAULT_SNAPSHOT_DIR, help="Local embedding snapshot")
+    parser.add_argument('--output', help="Output path (default: keywords.npz in the snapshot)")
+    args = parser.parse_args(argv)
+    path = build_keyword_index(args.snapshot_dir, args.output)
+    print(f"Keyword index written to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -14,15 +14,52 @@
 # def root():
 #     return {"message": "Anime Recommendation System API"}
 
-from fastapi import FastAPI, HTTPException
+import asyncio
+import os
+import signal
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from app.models import RecommendationRequest, HistoryRecommendationRequest, AnimeRecommendation
-from app.recommendation import query_based_recommendation, history_based_recommendation
+from fastapi.responses import JSONResponse, PlainTextResponse
+from app.models import RecommendationRequest, HistoryRecommendationRequest, AnimeRecommendation, BatchRecommendationResult
+from app.recommendation import (
+    async_query_recommendation_page,
+    async_history_recommendation_page,
+    async_batch_query_recommendation,
+    async_batch_history_recommendation,
+)
+from app.database import stop_catalog_refresher, request_catalog_refresh
+from app.registry import registry, warmup
+from app.response_cache import response_cache
+from app.pagination import InvalidCursor
+from app import pagination
+from app.resilience import request_budget
+from app import metrics
+from app.utils import get_parse_stats
+
+MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', '64'))
+REQUEST_BUDGET_SECONDS = float(os.getenv('REQUEST_BUDGET_MS', '3000')) / 1000
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Serve /healthz right away; /readyz turns ready once the model, clients and catalog are loaded
+    warmup_task = asyncio.create_task(warmup())
+    # `kill -HUP <pid>` reloads the catalog without waiting for the TTL
+    if hasattr(signal, "SIGHUP"):
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, request_catalog_refresh)
+        except (NotImplementedError, RuntimeError):
+            pass
+    yield
+    warmup_task.cancel()
+    stop_catalog_refresher()
 
 app = FastAPI(
     title="Anime Recommendation System API",
     description="API for providing anime recommendations using LangChain and Gemini",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 app.add_middleware(
     CORSMiddleware,
@@ -30,32 +67,115 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Query-Parse-Path"],
 )
 
+@app.middleware("http")
+async def apply_budget(request: Request, call_next):
+    with request_budget(REQUEST_BUDGET_SECONDS) as budget:
+        response = await call_next(request)
+    if budget is not None and budget.parse_paths:
+        response.headers["X-Query-Parse-Path"] = ",".join(budget.parse_paths)
+    return response
+
+if metrics.METRICS_ENABLED:
+    @app.middleware("http")
+    async def record_timings(request: Request, call_next):
+        start = time.perf_counter()
+        with metrics.request_timings() as timings:
+            response = await call_next(request)
+        # Label by route template, not raw path, to keep the series count bounded
+        route = request.scope.get("route")
+        metrics.request_seconds.observe(time.perf_counter() - start, getattr(route, "path", "unmatched"))
+        if timings:
+            response.headers["Server-Timing"] = metrics.server_timing_header(timings)
+        return response
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    def get_metrics():
+        return PlainTextResponse(metrics.expose(), media_type="text/plain; version=0.0.4")
+
 @app.get("/")
 def root():
     return {"message": "Anime Recommendation System API"}
 
+@app.get("/healthz")
+def healthz():
+    return {"status": "ok"}
+
+@app.get("/readyz")
+def readyz():
+    return JSONResponse(registry.status(), status_code=200 if registry.ready else 503)
+
+@app.get("/stats/cache")
+def cache_stats():
+    return {
+        "responses": response_cache.stats(),
+        "result_sets": pagination.stats(),
+        "query_parse": get_parse_stats(),
+    }
+
+def _set_next_cursor(response: Response, page) -> list[AnimeRecommendation]:
+    if page.next_cursor:
+        response.headers["X-Next-Cursor"] = page.next_cursor
+    return page.recommendations
+
 @app.post("/recommendation", response_model=list[AnimeRecommendation])
-async def get_recommendation(request: RecommendationRequest):
+async def get_recommendation(request: RecommendationRequest, response: Response):
     try:
-        recommendations = query_based_recommendation(
+        page = await async_query_recommendation_page(
             query=request.query,
             n_results=request.n_results,
             personalized=request.personalized,
-            user_id=request.user_id
+            user_id=request.user_id,
+            weights=request.weights,
+            cursor=request.cursor
         )
-        return recommendations
+        return _set_next_cursor(response, page)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/history-recommendation", response_model=list[AnimeRecommendation])
-async def get_history_recommendation(request: HistoryRecommendationRequest):
+async def get_history_recommendation(request: HistoryRecommendationRequest, response: Response):
     try:
-        recommendations = history_based_recommendation(
+        page = await async_history_recommendation_page(
             user_id=request.user_id,
-            n_results=request.n_results
+            n_results=request.n_results,
+            weights=request.weights,
+            mode=request.mode,
+            cursor=request.cursor
         )
-        return recommendations
+        return _set_next_cursor(response, page)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _batch_response(results) -> list[BatchRecommendationResult]:
+    return [
+        BatchRecommendationResult(error=str(result) or type(result).__name__)
+        if isinstance(result, Exception) else BatchRecommendationResult(recommendations=result)
+        for result in results
+    ]
+
+def _check_batch_size(requests: list) -> None:
+    if len(requests) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_SIZE} requests per batch")
+
+@app.post("/recommendation/batch", response_model=list[BatchRecommendationResult])
+async def get_recommendation_batch(requests: list[RecommendationRequest]):
+    _check_batch_size(requests)
+    try:
+        return _batch_response(await async_batch_query_recommendation(requests))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/history-recommendation/batch", response_model=list[BatchRecommendationResult])
+async def get_history_recommendation_batch(requests: list[HistoryRecommendationRequest]):
+    _check_batch_size(requests)
+    try:
+        return _batch_response(await async_batch_history_recommendation(requests))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
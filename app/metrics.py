@@ -0,0 +1,201 @@
+"""
+Opt-in, low-overhead stage tracing.
+
+With `METRICS_ENABLED=true`, `timed(stage)` (a context manager and
+decorator for sync and async functions) records how long each pipeline
+stage takes. Durations go into a per-stage histogram, exposed with the
+counters below in Prometheus text format on `/metrics`, and are summed per
+request into a `Server-Timing` response header. When disabled, `timed`
+and `increment` return immediately.
+
+The current request's timings live in a context variable. Executor work
+only sees them if it is submitted through `ContextThreadPoolExecutor`,
+which runs each task in a copy of the submitter's context.
+"""
+
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'false').lower() == 'true'
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, label_values)} {value:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> (per-bucket counts, sum, count)
+        self._values: Dict[LabelValues, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(
+                        f"{self.name}_bucket{_labels(self.labels + ('le',), label_values + (f'{bound:g}',))} {cumulative}"
+                    )
+                lines.append(f"{self.name}_bucket{_labels(self.labels + ('le',), label_values + ('+Inf',))} {count}")
+                lines.append(f"{self.name}_sum{_labels(self.labels, label_values)} {total:.6f}")
+                lines.append(f"{self.name}_count{_labels(self.labels, label_values)} {count}")
+        return lines
+
+
+def _labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    pairs = ','.join(
+        f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for name, value in zip(names, values)
+    )
+    return '{' + pairs + '}'
+
+
+stage_seconds = Histogram('recommendation_stage_seconds', 'Time spent in each pipeline stage', ['stage'])
+request_seconds = Histogram('http_request_duration_seconds', 'End-to-end request latency', ['path'])
+stage_errors = Counter('recommendation_stage_errors_total', 'Pipeline stages that raised', ['stage'])
+candidates_fetched = Counter('recommendation_candidates_fetched_total', 'Matches returned by the vector store')
+candidates_filtered = Counter('recommendation_candidates_filtered_total', 'Matches dropped by local filtering or exclusion')
+cache_hits = Counter('recommendation_cache_hits_total', 'Cache hits', ['cache'])
+cache_misses = Counter('recommendation_cache_misses_total', 'Cache misses', ['cache'])
+llm_fallbacks = Counter('query_parse_llm_fallbacks_total', 'LLM parses that failed, timed out or were skipped and fell back to rule-based filters')
+query_parse_paths = Counter('query_parse_paths_total', 'Query parses by the path that produced the filter', ['path'])
+
+REGISTRY = [
+    stage_seconds, request_seconds, stage_errors,
+    candidates_fetched, candidates_filtered, cache_hits, cache_misses, llm_fallbacks, query_parse_paths,
+]
+
+# stage -> summed seconds for the request being served
+_request_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    'request_timings', default=None
+)
+
+
+def increment(counter: Counter, *label_values: str, amount: float = 1.0) -> None:
+    if METRICS_ENABLED:
+        counter.inc(*label_values, amount=amount)
+
+
+_timings_lock = threading.Lock()
+
+
+def record(stage: str, seconds: float) -> None:
+    stage_seconds.observe(seconds, stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        # Executor threads of the same request add to the same map
+        with _timings_lock:
+            timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+class timed:
+    """Time a block (`with timed('stage'):`) or every call of a function (`@timed('stage')`)."""
+
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        if METRICS_ENABLED:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if METRICS_ENABLED:
+            record(self.stage, time.perf_counter() - self.start)
+            if exc_type is not None:
+                stage_errors.inc(self.stage)
+        return False
+
+    def __call__(self, func):
+        stage = self.stage
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with timed(stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(stage):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+@contextmanager
+def request_timings() -> Iterator[Dict[str, float]]:
+    """Collect the stage timings of one request; yields the stage -> seconds map."""
+    timings: Dict[str, float] = {}
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+
+def server_timing_header(timings: Dict[str, float]) -> str:
+    return ', '.join(f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in timings.items())
+
+
+def expose() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.expose())
+    return '\n'.join(lines) + '\n'
+
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    """ThreadPoolExecutor whose tasks run in the submitter's context, so their stage timings reach the request."""
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from pydantic import BaseModel, Field, model_validator
+from typing import List, Literal, Optional
 
 class QueryFilter(BaseModel):
     genres: Optional[List[str]] = Field(None, description="List of genres to filter by")
@@ -10,15 +10,36 @@ class QueryFilter(BaseModel):
     rating_max: Optional[float] = Field(None, description="Maximum rating")
     description_keywords: Optional[List[str]] = Field(None, description="Keywords to look for in description")
 
+class ScoreWeights(BaseModel):
+    similarity_weight: float = Field(default=0.7, ge=0, description="Weight of the cosine similarity to the query")
+    normalized_weight: float = Field(default=0.3, ge=0, description="Weight of the rating/feedback/rank quality score")
+
+    @model_validator(mode="after")
+    def check_total(self):
+        if self.similarity_weight + self.normalized_weight <= 0:
+            raise ValueError("At least one score weight must be positive")
+        return self
+
 class RecommendationRequest(BaseModel):
     query: str
     n_results: int = Field(default=5, ge=1, le=20)
     personalized: bool = False
     user_id: Optional[str] = None
+    weights: Optional[ScoreWeights] = None
+    cursor: Optional[str] = Field(None, description="X-Next-Cursor of the previous page; same body otherwise")
 
 class HistoryRecommendationRequest(BaseModel):
     user_id: str
     n_results: int = Field(default=5, ge=1, le=20)
+    weights: Optional[ScoreWeights] = None
+    mode: Literal["profile", "text", "neighbours"] = Field(
+        default="profile",
+        description=(
+            "profile: search with the user's stored taste vector; text: embed a query built from watched titles; "
+            "neighbours: merge the precomputed item-to-item neighbours of watched titles"
+        )
+    )
+    cursor: Optional[str] = Field(None, description="X-Next-Cursor of the previous page; same body otherwise")
 
 class AnimeScore(BaseModel):
     cosine_similarity: float
@@ -36,3 +57,6 @@ class AnimeRecommendation(BaseModel):
     image_url: Optional[str] = None
     scores: AnimeScore
 
+class BatchRecommendationResult(BaseModel):
+    recommendations: List[AnimeRecommendation] = Field(default_factory=list)
+    error: Optional[str] = Field(None, description="Why this item failed; the other items are unaffected")
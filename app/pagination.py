@@ -0,0 +1,160 @@
+"""
+Server-side ranked result sets behind cursor pagination.
+
+The first page of `/recommendation` or `/history-recommendation` ranks every
+candidate the pipeline fetched and keeps the ranked ids and scores here for
+`RESULT_SET_TTL_SECONDS`, under a key that identifies the request without
+its page size. The response carries an opaque cursor in `X-Next-Cursor`.
+Sending the same request body with that cursor serves the next page from
+the kept list, so the LLM parse, the encode and the vector search are not
+repeated, and pages never reorder. Only when a page runs past the kept list
+does the pipeline fetch more candidates, excluding the ones it already has.
+
+Result sets live in the worker's memory. If a cursor reaches a worker that
+has no set for it (it expired, or another worker served the first page), the
+set is rebuilt from the request body and the page is cut from it.
+"""
+
+import asyncio
+import base64
+import os
+from typing import Any, Awaitable, Callable, Collection, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.cache import TTLCache
+from app.models import AnimeRecommendation, ScoreWeights
+from app.response_cache import ResponseCache, watch_list_hash
+from app.utils import normalize_query
+
+RESULT_SET_TTL_SECONDS = float(os.getenv('RESULT_SET_TTL_SECONDS', '600'))
+RESULT_SET_CACHE_SIZE = int(os.getenv('RESULT_SET_CACHE_SIZE', '2048'))
+MAX_RESULT_SET_SIZE = int(os.getenv('MAX_RESULT_SET_SIZE', '500'))
+
+# (count, ids to skip) -> up to `count` new candidates
+FetchMore = Callable[[int, Collection[str]], Awaitable[List[Any]]]
+# candidates -> their ids and score rows, best first
+RankAll = Callable[[List[Any]], Awaitable[Tuple[List[str], np.ndarray]]]
+# ids and score rows of one page -> its response models
+BuildPage = Callable[[List[str], np.ndarray], Awaitable[List[AnimeRecommendation]]]
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class Page(NamedTuple):
+    recommendations: List[AnimeRecommendation]
+    next_cursor: Optional[str]
+
+
+class ResultSet:
+    """
+    A ranked list that grows on demand.
+
+    Only ids and score rows are kept; `build` turns the slice a page needs
+    into response models. `fetch_more` returns candidates the set has not
+    seen; they are ranked among themselves and appended, so already-served
+    positions never change. `keep` drops candidates that must not be shown
+    (e.g. watched titles), judged on their metadata.
+    """
+
+    def __init__(self, fetch_more: Optional[FetchMore], rank: RankAll, build: BuildPage,
+                 keep: Optional[Callable[[Dict[str, Any]], bool]] = None):
+        self.ids: List[str] = []
+        self.scores = np.empty((0, 0), dtype=np.float64)
+        self.seen_ids: set = set()
+        self.exhausted = fetch_more is None
+        self._fetch_more = fetch_more
+        self._rank = rank
+        self._build = build
+        self._keep = keep
+        # How the request that built the set was parsed, replayed on later pages
+        self.parse_paths: List[str] = []
+        self._lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    async def add(self, candidates: Sequence[Any]) -> None:
+        new = [match for match in candidates if str(match.metadata.get('id')) not in self.seen_ids]
+        self.seen_ids.update(str(match.metadata.get('id')) for match in new)
+        if self._keep is not None:
+            new = [match for match in new if self._keep(match.metadata)]
+        if not new:
+            return
+        ids, scores = await self._rank(new)
+        self.ids.extend(ids)
+        self.scores = scores if not self.scores.size else np.concatenate([self.scores, scores])
+
+    async def page(self, offset: int, size: int) -> List[AnimeRecommendation]:
+        end = min(offset + size, MAX_RESULT_SET_SIZE)
+        async with self._lock:
+            while len(self.ids) < end and not self.exhausted:
+                before = len(self.ids)
+                candidates = await self._fetch_more(end - before, frozenset(self.seen_ids))
+                await self.add(candidates)
+                # Nothing new means the store has no more matches for this request
+                if not candidates or len(self.ids) == before:
+                    self.exhausted = True
+            ids, scores = self.ids[offset:end], self.scores[offset:end]
+        return await self._build(ids, scores) if ids else []
+
+    @property
+    def complete(self) -> bool:
+        return self.exhausted or len(self.ids) >= MAX_RESULT_SET_SIZE
+
+
+result_sets = TTLCache(max_size=RESULT_SET_CACHE_SIZE, ttl_seconds=RESULT_SET_TTL_SECONDS)
+
+
+def query_set_key(query: str, personalized: bool, weights: Optional[ScoreWeights],
+                  watch_history: Optional[Sequence[str]]) -> str:
+    return ResponseCache.make_key(
+        'query_pages',
+        query=normalize_query(query),
+        personalized=personalized,
+        weights=weights.model_dump() if weights else None,
+        watch_list=watch_list_hash(watch_history),
+    )
+
+
+def history_set_key(user_id: str, mode: str, weights: Optional[ScoreWeights], watch_history: Sequence[str]) -> str:
+    return ResponseCache.make_key(
+        'history_pages',
+        user_id=user_id,
+        mode=mode,
+        weights=weights.model_dump() if weights else None,
+        watch_list=watch_list_hash(watch_history),
+    )
+
+
+def encode_cursor(set_key: str, offset: int) -> str:
+    return base64.urlsafe_b64encode(f"{set_key}|{offset}".encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str, set_key: str) -> int:
+    """Offset a cursor points at; raises `InvalidCursor` if it is malformed or from another request."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        key, offset = raw.rsplit('|', 1)
+        offset = int(offset)
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidCursor("Malformed cursor")
+    if key != set_key or offset < 0:
+        raise InvalidCursor("Cursor does not belong to this request")
+    return offset
+
+
+def next_cursor(set_key: str, offset: int, page: Sequence[Any], size: int, result_set: Optional[ResultSet]) -> Optional[str]:
+    """Cursor of the page after this one, or None when there is nothing more to serve."""
+    end = offset + len(page)
+    if len(page) < size or end >= MAX_RESULT_SET_SIZE:
+        return None
+    if result_set is not None and result_set.complete and end >= len(result_set):
+        return None
+    return encode_cursor(set_key, end)
+
+
+def stats() -> Dict[str, Any]:
+    return result_sets.stats()
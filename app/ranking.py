@@ -0,0 +1,142 @@
+"""
+Vectorised candidate scoring and top-k selection.
+
+All surviving candidates are scored at once as NumPy arrays; only the
+`n_results` winners, picked with `argpartition`, are turned into response
+models.
+"""
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.database import get_anime_enrichment, get_total_docs
+from app.metrics import timed
+from app.models import AnimeRecommendation, AnimeScore, ScoreWeights
+from app.scoring import compute_normalized_scores
+from app.utils import extract_genres_from_string
+
+DEFAULT_WEIGHTS = ScoreWeights()
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the `k` highest scores, best first, without sorting the rest."""
+    if k <= 0 or scores.size == 0:
+        return np.empty(0, dtype=np.intp)
+    if k < scores.size:
+        best = np.argpartition(-scores, k - 1)[:k]
+    else:
+        best = np.arange(scores.size)
+    return best[np.argsort(-scores[best], kind='stable')]
+
+
+def _relevance(match: Any) -> float:
+    relevance = getattr(match, 'relevance', None)
+    return match.score if relevance is None else relevance
+
+
+# Columns of a scored candidate, as returned by `score_candidates`
+SIMILARITY, FEEDBACK, NORMALIZED, COMBINED, RATING = range(5)
+
+
+def score_candidates(
+    candidates: Sequence[Any],
+    weights: Optional[ScoreWeights] = None,
+    enrichment: Optional[Dict[str, Dict[str, Any]]] = None,
+) -> Tuple[np.ndarray, List[Dict[str, Any]]]:
+    """
+    Score every candidate without building response models.
+
+    Returns an `[n, 5]` array (cosine, feedback, normalized, combined score
+    and rating, indexed by the module constants) and each candidate's
+    enrichment attributes.
+    """
+    weights = weights or DEFAULT_WEIGHTS
+    total_weight = weights.similarity_weight + weights.normalized_weight
+
+    ids = [str(match.metadata['id']) for match in candidates]
+    if enrichment is None:
+        enrichment = get_anime_enrichment(ids)
+    attributes = [enrichment.get(anime_id, {}) for anime_id in ids]
+
+    scores = np.empty((len(candidates), 5), dtype=np.float64)
+    scores[:, SIMILARITY] = np.fromiter((match.score for match in candidates), dtype=np.float64, count=len(candidates))
+    # Hybrid retrieval ranks by the fused relevance but still reports the cosine
+    relevance = np.fromiter(
+        (_relevance(match) for match in candidates), dtype=np.float64, count=len(candidates)
+    )
+    scores[:, FEEDBACK] = np.fromiter((a.get('feedback', 0.0) for a in attributes), dtype=np.float64, count=len(candidates))
+    scores[:, RATING] = np.fromiter(
+        (float(match.metadata.get('rating', 1)) for match in candidates), dtype=np.float64, count=len(candidates)
+    )
+
+    # Precomputed at catalog load / ingestion; only ids unknown to both are scored here
+    normalized = scores[:, NORMALIZED]
+    for i, (a, match) in enumerate(zip(attributes, candidates)):
+        value = a.get('normalized_score', match.metadata.get('normalized_score'))
+        normalized[i] = np.nan if value is None else value
+    missing = np.isnan(normalized)
+    if missing.any():
+        normalized_rank = np.fromiter(
+            (a.get('normalized_rank', 0.0) for a in attributes), dtype=np.float64, count=len(candidates)
+        )
+        normalized[missing] = compute_normalized_scores(
+            scores[missing, RATING], scores[missing, FEEDBACK], normalized_rank[missing], get_total_docs()
+        )
+
+    scores[:, COMBINED] = (
+        relevance * (weights.similarity_weight / total_weight)
+        + normalized * (weights.normalized_weight / total_weight)
+    )
+    return scores, attributes
+
+
+def build_recommendation(metadata: Dict[str, Any], image_url: str, scores: np.ndarray) -> AnimeRecommendation:
+    """Response model of one candidate from its metadata and its row of `score_candidates`."""
+    return AnimeRecommendation(
+        title=metadata.get('title', ''),
+        description=metadata.get('description', ''),
+        rating=float(scores[RATING]),
+        year=str(metadata.get('year', '')),
+        season=metadata.get('season', ''),
+        genres=extract_genres_from_string(metadata.get('genres', '[]')),
+        image_url=image_url,
+        scores=AnimeScore(
+            cosine_similarity=round(float(scores[SIMILARITY]), 4),
+            feedback_score=round(float(scores[FEEDBACK]), 4),
+            normalized_score=round(float(scores[NORMALIZED]), 4),
+            combined_score=round(float(scores[COMBINED]), 4)
+        )
+    )
+
+
+@timed('rank')
+def rank_candidates(
+    candidates: Sequence[Any],
+    n_results: int,
+    weights: Optional[ScoreWeights] = None,
+    enrichment: Optional[Dict[str, Dict[str, Any]]] = None,
+) -> List[AnimeRecommendation]:
+    """
+    Score `candidates` and return the best `n_results` as response models.
+
+    `enrichment` is the result of `get_anime_enrichment` for (at least) the
+    candidate ids; batch callers look it up once for all their items.
+    """
+    if not candidates:
+        return []
+    scores, attributes = score_candidates(candidates, weights, enrichment)
+    return [
+        build_recommendation(candidates[i].metadata, attributes[i].get('image_url', ''), scores[i])
+        for i in top_k_indices(scores[:, COMBINED], n_results)
+    ]
+
+
+@timed('rank')
+def rank_all(candidates: Sequence[Any], weights: Optional[ScoreWeights] = None) -> Tuple[List[str], np.ndarray]:
+    """Ids and score rows of every candidate, best first; no response models are built."""
+    if not candidates:
+        return [], np.empty((0, 5), dtype=np.float64)
+    scores, _ = score_candidates(candidates, weights)
+    order = top_k_indices(scores[:, COMBINED], len(candidates))
+    return [str(candidates[i].metadata['id']) for i in order], scores[order]
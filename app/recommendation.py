@@ -1,114 +1,587 @@
-from typing import List, Dict, Any
-from app.models import AnimeRecommendation, AnimeScore, QueryFilter
-from app.database import get_anime_details, get_user_history, get_anime_feedback, get_anime_normalized_rank, get_anime_image_url, get_total_docs
-from app.utils import parse_query, filter_metadata, calculate_normalized_evaluation, combine_scores, extract_genres_from_string
-from pinecone import Pinecone
-from langchain_huggingface import HuggingFaceEmbeddings
+import asyncio
+import math
 import os
+import numpy as np
+from typing import List, Dict, Any, Awaitable, Callable, Collection, Optional, Sequence, Tuple, Union
+from app.models import AnimeRecommendation, QueryFilter, ScoreWeights, RecommendationRequest, HistoryRecommendationRequest
+from app.database import get_anime_details, async_get_user_history, get_catalog, get_anime_enrichment
+from app.utils import async_parse_query, begin_parse_query, filter_metadata, build_vector_filter, extract_genres_from_string
+from app.ranking import build_recommendation, rank_all, rank_candidates
+from app.user_profiles import get_taste_vector
+from app.item_neighbours import get_neighbour_table
+from app.keyword_index import get_keyword_index, reciprocal_rank_fusion, tokenize
+from app.vector_store import VectorMatch
+from app.embedding_service import EmbeddingBatcher
+from app.response_cache import response_cache
+from app.metrics import ContextThreadPoolExecutor, timed, increment, candidates_fetched, candidates_filtered
+from app.registry import registry, get_vector_index, get_embeddings
+from app.resilience import budget_exhausted, current_parse_paths, replay_parse_paths, request_degraded
+from app.pagination import (
+    FetchMore, InvalidCursor, Page, ResultSet, decode_cursor, history_set_key, next_cursor, query_set_key, result_sets,
+)
 from dotenv import load_dotenv
 load_dotenv(dotenv_path=".env.local", override=True)
-# Initialize Pinecone
-PINECONE_API_KEY = os.getenv('PINECONE_API_KEY')
-pinecone = Pinecone(api_key=PINECONE_API_KEY)
-index = pinecone.Index("embeddings-animes")
 
-# Initialize embedding model
-embeddings = HuggingFaceEmbeddings(model_name='sentence-transformers/all-MiniLM-L6-v2')
+# Blocking work of the async pipeline (model encode, vector store calls, catalog misses) runs here
+executor = ContextThreadPoolExecutor(
+    max_workers=int(os.getenv('RECOMMENDATION_WORKERS', '8')),
+    thread_name_prefix='recommendation'
+)
 
-def query_based_recommendation(query: str, n_results: int = 5, personalized=False, user_id=None) -> List[AnimeRecommendation]:
-    try:
-        if personalized and user_id is not None:
-            watch_history = get_user_history(user_id)
-            if watch_history:
-                history_details = get_anime_details(watch_history)
-                query_parts = [
-                    f"{anime.get('title', '')} {' '.join(extract_genres_from_string(anime.get('genres', '[]')))}"
-                    for anime in history_details if anime.get('title', '').strip()
-                ]
-                query = f"{query} {' '.join(query_parts)}"
-
-        filters = parse_query(query)
-        query_embedding = embeddings.embed_query(query)
-
-        results = index.query(
-            vector=query_embedding,
-            top_k=n_results * 10,
-            include_metadata=True
-        )
-
-        total_docs = get_total_docs()
-        ranked_results = []
-
-        for match in results.matches:
-            if filter_metadata(match.metadata, filters):
-                anime_id = match.metadata['id']
-                feedback = get_anime_feedback(anime_id)
-                normalized_rank = get_anime_normalized_rank(anime_id)
-                image_url = get_anime_image_url(anime_id)
-                rating = float(match.metadata.get('rating', 1))
-
-                normalized_score = calculate_normalized_evaluation(
-                    rating=rating,
-                    feedback=feedback,
-                    normalized_rank=normalized_rank,
-                    total_docs=total_docs
-                )
-
-                combined_score = combine_scores(
-                    cosine_similarity=match.score,
-                    normalized_score=normalized_score
-                )
-
-                ranked_results.append(AnimeRecommendation(
-                    title=match.metadata.get('title', ''),
-                    description=match.metadata.get('description', ''),
-                    rating=rating,
-                    year=str(match.metadata.get('year', '')),
-                    season=match.metadata.get('season', ''),
-                    genres=extract_genres_from_string(match.metadata.get('genres', '[]')),
-                    image_url=image_url,
-                    scores=AnimeScore(
-                        cosine_similarity=round(match.score, 4),
-                        feedback_score=round(feedback, 4),
-                        normalized_score=round(normalized_score, 4),
-                        combined_score=round(combined_score, 4)
-                    )
-                ))
-
-        ranked_results.sort(key=lambda x: x.scores.combined_score, reverse=True)
-        return ranked_results[:n_results]
+# Batches concurrent query encodes into one forward pass and caches recent query vectors
+registry.register('embedding_service', lambda: EmbeddingBatcher(get_embeddings(), executor=executor))
 
-    except Exception as e:
-        print(f"Error in query_based_recommendation: {e}")
+def get_embedding_service() -> EmbeddingBatcher:
+    return registry.get('embedding_service')
+
+# Push QueryFilter constraints into the vector query; needs metadata written by the current anime_embeddings
+FILTER_PUSHDOWN = os.getenv('VECTOR_FILTER_PUSHDOWN', 'true').lower() == 'true'
+PUSHDOWN_OVERFETCH = 3  # every match already satisfies the filter; headroom is only for quality re-ranking
+UNFILTERED_OVERFETCH = 10
+MAX_TOP_K = 1000  # Pinecone's limit when metadata is included
+MAX_REQUERIES = 2
+KEYWORD_TOP_K = int(os.getenv('KEYWORD_TOP_K', '50'))
+HYBRID_RRF_K = int(os.getenv('HYBRID_RRF_K', '60'))
+# Per-position weight decay of older watch-list entries in neighbours mode (0 is a plain mean)
+NEIGHBOUR_RECENCY_DECAY = float(os.getenv('NEIGHBOUR_RECENCY_DECAY', '0.1'))
+
+def estimate_selectivity(filters: QueryFilter) -> float:
+    """
+    Fraction of the catalog a filter keeps, counted exactly on the catalog's
+    attribute index; returns 1.0 when the catalog is not loaded.
+    """
+    catalog = get_catalog()
+    if catalog is None or len(catalog) == 0:
+        return 1.0
+    return catalog.attributes.selectivity(filters)
+
+def plan_top_k(n_results: int, filters: QueryFilter, pushed_down: bool, excluded: int = 0) -> int:
+    if pushed_down:
+        return min(MAX_TOP_K, n_results * PUSHDOWN_OVERFETCH)
+    selectivity = max(estimate_selectivity(filters), 1e-3)
+    return min(MAX_TOP_K, excluded + max(n_results * UNFILTERED_OVERFETCH, math.ceil(n_results * PUSHDOWN_OVERFETCH / selectivity)))
+
+def _next_top_k(top_k: int, fetched: int, survivors: int, n_results: int) -> int:
+    survival_rate = max(survivors / fetched if fetched else 0.0, 1e-3)
+    return min(MAX_TOP_K, max(top_k * 2, math.ceil(n_results * PUSHDOWN_OVERFETCH / survival_rate)))
+
+def _retrieval_done(top_k: int, fetched: int, survivors: int, n_results: int, attempt: int) -> bool:
+    # Stop when there are enough candidates, the store has nothing more, or the budget is spent
+    return (
+        survivors >= n_results or fetched < top_k or top_k >= MAX_TOP_K or attempt >= MAX_REQUERIES
+        or budget_exhausted()
+    )
+
+def _vector_filter(filters: QueryFilter, exclude_ids: Collection[str]) -> Optional[Union[Dict[str, Any], np.ndarray]]:
+    if not FILTER_PUSHDOWN:
+        return None
+    store = get_vector_index()
+    if store.attribute_index is not None:
+        # In-process store: pre-filter the search with a row mask instead of a metadata filter
+        return store.attribute_index.compile(filters, exclude_ids)
+    if not store.typed_metadata:
+        return None
+    vector_filter = build_vector_filter(filters)
+    if not exclude_ids:
+        return vector_filter
+    exclusion = {'id': {'$nin': sorted(exclude_ids)}}
+    if vector_filter is None:
+        return exclusion
+    clauses = vector_filter['$and'] if '$and' in vector_filter else [vector_filter]
+    return {'$and': clauses + [exclusion]}
+
+@timed('filter')
+def _survivors(matches: Sequence[Any], filters: QueryFilter, exclude_ids: Collection[str]) -> List[Any]:
+    ids = [str(match.metadata.get('id')) for match in matches]
+    catalog = get_catalog()
+    if catalog is not None:
+        keep, known = catalog.attributes.check(ids, filters)
+    else:
+        keep = known = np.zeros(len(ids), dtype=bool)
+    survivors = [
+        match for match, anime_id, passed, indexed in zip(matches, ids, keep, known)
+        if anime_id not in exclude_ids and (passed if indexed else filter_metadata(match.metadata, filters))
+    ]
+    increment(candidates_fetched, amount=len(matches))
+    increment(candidates_filtered, amount=len(matches) - len(survivors))
+    return survivors
+
+async def async_fetch_candidates(query_embedding: List[float], filters: QueryFilter, n_results: int, exclude_ids: Collection[str] = frozenset()) -> List[Any]:
+    """
+    Query the vector store for matches that satisfy `filters` and are not in `exclude_ids`.
+
+    With pushdown the filter runs inside the store; otherwise the over-fetch
+    is sized from the estimated selectivity. Either way, if fewer than
+    `n_results` candidates survive, the query is repeated with a larger
+    `top_k`, at most MAX_REQUERIES times.
+    """
+    vector_filter = _vector_filter(filters, exclude_ids)
+    top_k = plan_top_k(n_results, filters, pushed_down=vector_filter is not None, excluded=len(exclude_ids))
+    attempt = 0
+    while True:
+        with timed('vector_query'):
+            results = await get_vector_index().aquery(
+                vector=query_embedding, top_k=top_k, filter=vector_filter, include_metadata=True, executor=executor
+            )
+        candidates = _survivors(results.matches, filters, exclude_ids)
+        if _retrieval_done(top_k, len(results.matches), len(candidates), n_results, attempt):
+            return candidates
+        top_k = _next_top_k(top_k, len(results.matches), len(candidates), n_results)
+        attempt += 1
+
+def keyword_tokens(query: str, filters: QueryFilter) -> List[str]:
+    tokens = tokenize(query)
+    for keyword in filters.description_keywords or []:
+        tokens.extend(tokenize(keyword))
+    return tokens
+
+def keyword_candidates(query_embedding: List[float], query: str, filters: QueryFilter, exclude_ids: Collection[str] = frozenset()) -> List[Any]:
+    """
+    BM25 matches of the query text and its `description_keywords` that
+    satisfy `filters`, best first, each scored by its cosine to the query.
+    Empty when no keyword index is loaded.
+    """
+    index = get_keyword_index()
+    tokens = keyword_tokens(query, filters) if index is not None else []
+    if not tokens:
+        return []
+    with timed('keyword_search'):
+        hits = [anime_id for anime_id, _ in index.search(tokens, KEYWORD_TOP_K)]
+    if not hits:
         return []
+    with timed('vector_fetch'):
+        scored = {str(match.metadata.get('id', match.id)): match for match in get_vector_index().score(query_embedding, hits)}
+    return _survivors([scored[anime_id] for anime_id in hits if anime_id in scored], filters, exclude_ids)
+
+def fuse_candidates(dense: Sequence[Any], keyword: Sequence[Any]) -> List[Any]:
+    """
+    Merge vector and keyword candidates by reciprocal rank fusion.
+
+    The fused order is written into each match's `relevance` as the cosine
+    at that position among all candidates, so ranking keeps the scale of
+    its similarity weight while `score` still reports the true cosine.
+    """
+    if not keyword:
+        return list(dense)
+    matches: Dict[str, Any] = {}
+    rankings = []
+    for candidates in (sorted(dense, key=lambda match: -match.score), keyword):
+        ranking = []
+        for match in candidates:
+            anime_id = str(match.metadata.get('id'))
+            matches.setdefault(anime_id, match)
+            ranking.append(anime_id)
+        rankings.append(ranking)
+    fused = reciprocal_rank_fusion(rankings, HYBRID_RRF_K)
+    order = sorted(matches, key=lambda anime_id: -fused[anime_id])
+    cosines = sorted((match.score for match in matches.values()), reverse=True)
+    return [
+        VectorMatch(id=anime_id, score=matches[anime_id].score, metadata=matches[anime_id].metadata, relevance=relevance)
+        for anime_id, relevance in zip(order, cosines)
+    ]
 
-def history_based_recommendation(user_id: str, n_results: int = 5) -> List[AnimeRecommendation]:
+async def async_hybrid_candidates(query_embedding: List[float], query: str, filters: QueryFilter, n_results: int) -> List[Any]:
+    """`async_fetch_candidates` fused with the keyword matches of `query`, both searched concurrently."""
+    loop = asyncio.get_running_loop()
+    dense, keyword = await asyncio.gather(
+        async_fetch_candidates(query_embedding, filters, n_results),
+        loop.run_in_executor(executor, keyword_candidates, query_embedding, query, filters),
+    )
+    return fuse_candidates(dense, keyword)
+
+def build_history_query(query: str, watch_history: List[str]) -> str:
+    if not watch_history:
+        return query
+    history_details = get_anime_details(watch_history)
+    query_parts = [
+        f"{anime.get('title', '')} {' '.join(extract_genres_from_string(anime.get('genres', '[]')))}"
+        for anime in history_details if anime.get('title', '').strip()
+    ]
+    return f"{query} {' '.join(query_parts)}"
+
+async def _async_query_result_set(query: str, n_results: int, weights: Optional[ScoreWeights],
+                                  watch_history: Optional[List[str]] = None,
+                                  keep: Optional[Callable[[Dict[str, Any]], bool]] = None) -> ResultSet:
+    """
+    Parse, encode and search `query`, and rank every candidate into a result set.
+
+    When the query needs Gemini, the LLM parse is hedged: it runs while the
+    query is encoded and searched with the rule-based filter. If Gemini
+    answers within its budget with different constraints, the search is
+    repeated with its filter; otherwise the rule-based results are used.
+    """
+    loop = asyncio.get_running_loop()
+    pending = begin_parse_query(query)
+    search_query = query
+    if watch_history is not None:
+        search_query = await loop.run_in_executor(executor, build_history_query, query, watch_history)
+    query_embedding = await get_embedding_service().embed(search_query)
+
+    rule_filters = filters = pending.filters
+    if pending.settled:
+        candidates = await async_hybrid_candidates(query_embedding, query, filters, n_results)
+    else:
+        speculative = asyncio.ensure_future(async_fetch_candidates(query_embedding, rule_filters, n_results))
+        with timed('parse_query'):
+            filters = await pending.result()
+        # The keyword search waits for the parse since Gemini may add description_keywords
+        keyword = loop.run_in_executor(executor, keyword_candidates, query_embedding, query, filters)
+        if _same_constraints(filters, rule_filters):
+            candidates = await speculative
+        else:
+            _discard(speculative)
+            candidates = await async_fetch_candidates(query_embedding, filters, n_results)
+        candidates = fuse_candidates(candidates, await keyword)
+
+    result_set = ResultSet(_vector_fetch_more(query_embedding, filters), _ranker(weights), _build_page, keep)
+    await result_set.add(candidates)
+    return result_set
+
+def _ranker(weights: Optional[ScoreWeights]) -> Callable[[List[Any]], Awaitable[Tuple[List[str], np.ndarray]]]:
+    async def rank(candidates: List[Any]) -> Tuple[List[str], np.ndarray]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, rank_all, candidates, weights)
+    return rank
+
+def _page_recommendations(ids: List[str], scores: np.ndarray) -> List[AnimeRecommendation]:
+    """Response models for one page of a result set; only these are ever built."""
+    metadata = _candidate_metadata(ids)
+    enrichment = get_anime_enrichment(ids)
+    return [
+        build_recommendation(metadata[anime_id], enrichment.get(anime_id, {}).get('image_url', ''), row)
+        for anime_id, row in zip(ids, scores) if anime_id in metadata
+    ]
+
+async def _build_page(ids: List[str], scores: np.ndarray) -> List[AnimeRecommendation]:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, _page_recommendations, ids, scores)
+
+def _candidate_metadata(ids: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+    """Vector metadata for `ids` from the in-process catalog; only ids it does not know go to the store."""
+    catalog = get_catalog()
+    metadata = {}
+    for anime_id in ids:
+        meta = catalog.vector_metadata(anime_id) if catalog is not None else None
+        if meta is not None:
+            metadata[anime_id] = meta
+    missing = [anime_id for anime_id in ids if anime_id not in metadata]
+    if missing:
+        metadata.update(get_vector_index().fetch_metadata(missing))
+    return metadata
+
+def _vector_fetch_more(vector: List[float], filters: QueryFilter, exclude_ids: Collection[str] = frozenset()):
+    """Extends a result set with the next-best vector matches it has not seen."""
+    async def fetch_more(count: int, seen_ids: Collection[str]) -> List[Any]:
+        return await async_fetch_candidates(vector, filters, count, exclude_ids=frozenset(exclude_ids) | frozenset(seen_ids))
+    return fetch_more
+
+def _neighbour_fetch_more(watch_history: List[str]):
+    async def fetch_more(count: int, seen_ids: Collection[str]) -> List[Any]:
+        loop = asyncio.get_running_loop()
+        candidates = await loop.run_in_executor(executor, _neighbour_candidates, watch_history, len(seen_ids) + count)
+        return [match for match in candidates or [] if str(match.metadata.get('id')) not in seen_ids]
+    return fetch_more
+
+async def _result_page(set_key: str, offset: int, n_results: int,
+                       build: Callable[[], Awaitable[Optional[ResultSet]]]) -> Tuple[List[AnimeRecommendation], Optional[ResultSet]]:
+    """
+    A page from the kept result set for `set_key`. The first page always
+    builds (and keeps) a new set; the response cache is what serves repeats.
+    """
+    result_set = result_sets.get(set_key) if offset > 0 else None
+    if result_set is not None:
+        replay_parse_paths('result-set', result_set.parse_paths)
+    else:
+        result_set = await build()
+        if result_set is None:
+            return [], None
+        result_set.parse_paths = current_parse_paths()
+        # Sets built from a fallback parse are not kept, like their responses
+        if not request_degraded():
+            result_sets.set(set_key, result_set)
+    return await result_set.page(offset, n_results), result_set
+
+async def async_query_recommendation_page(query: str, n_results: int = 5, personalized=False, user_id=None,
+                                          weights: Optional[ScoreWeights] = None, cursor: Optional[str] = None) -> Page:
+    """
+    Query recommendations as served by the API, one page at a time.
+
+    The first page ranks all fetched candidates and keeps them as a result
+    set; `cursor` (the previous page's `next_cursor`) serves later pages from
+    it, fetching more matches only when it runs out. Blocking calls go to
+    `executor` so the event loop keeps serving other requests while they
+    wait. Personalised requests fetch the watch list first, since it is part
+    of the cache keys. Raises `InvalidCursor` for a cursor of another request.
+    """
     try:
-        watch_history = get_user_history(user_id)
-        if not watch_history:
-            print(f"No watch history found for user {user_id}")
-            return []
+        watch_history = await async_get_user_history(user_id) if personalized and user_id is not None else None
+        set_key = query_set_key(query, personalized, weights, watch_history)
+        offset = decode_cursor(cursor, set_key) if cursor else 0
+        result_set = None
 
-        history_details = get_anime_details(watch_history)
-        if not history_details:
-            print(f"Could not fetch anime details for watch history")
-            return []
+        async def compute():
+            nonlocal result_set
+            page, result_set = await _result_page(
+                set_key, offset, n_results, lambda: _async_query_result_set(query, n_results, weights, watch_history)
+            )
+            return page
 
-        query_parts = [
-            f"{anime.get('title', '')} {' '.join(extract_genres_from_string(anime.get('genres', '[]')))}"
-            for anime in history_details if anime.get('title', '').strip()
-        ]
+        if offset == 0:
+            key = response_cache.query_key(query, n_results, personalized, weights, watch_history)
+            recommendations = await response_cache.aget_or_compute(key, compute)
+        else:
+            recommendations = await compute()
+        return Page(recommendations, next_cursor(set_key, offset, recommendations, n_results, result_set))
+
+    except InvalidCursor:
+        raise
+    except Exception as e:
+        print(f"Error in query recommendation: {e}")
+        return Page([], None)
 
-        if not query_parts:
-            print("No valid anime data found in history")
-            return []
+async def async_query_based_recommendation(query: str, n_results: int = 5, personalized=False, user_id=None, weights: Optional[ScoreWeights] = None) -> List[AnimeRecommendation]:
+    page = await async_query_recommendation_page(query, n_results, personalized, user_id, weights)
+    return page.recommendations
 
-        combined_query = " ".join(query_parts)
-        recommendations = query_based_recommendation(combined_query, n_results)
+def _same_constraints(a: QueryFilter, b: QueryFilter) -> bool:
+    # Compared as the search sees them: case-insensitive, without description_keywords
+    return build_vector_filter(a) == build_vector_filter(b)
 
-        return [rec for rec in recommendations if rec.title not in set(anime.get('title', '') for anime in history_details)]
+def _discard(task: asyncio.Future) -> None:
+    task.cancel()
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
 
+def _history_titles_and_query(user_id: str, watch_history: List[str]) -> Optional[tuple]:
+    if not watch_history:
+        print(f"No watch history found for user {user_id}")
+        return None
+
+    history_details = get_anime_details(watch_history)
+    if not history_details:
+        print(f"Could not fetch anime details for watch history")
+        return None
+
+    query_parts = [
+        f"{anime.get('title', '')} {' '.join(extract_genres_from_string(anime.get('genres', '[]')))}"
+        for anime in history_details if anime.get('title', '').strip()
+    ]
+
+    if not query_parts:
+        print("No valid anime data found in history")
+        return None
+
+    watched_titles = set(anime.get('title', '') for anime in history_details)
+    return watched_titles, " ".join(query_parts)
+
+def _taste_vector(user_id: str, watch_history: List[str]) -> Optional[List[float]]:
+    taste_vector = get_taste_vector(user_id, watch_history, get_vector_index().fetch)
+    return None if taste_vector is None else taste_vector.tolist()
+
+def _neighbour_candidates(watch_history: List[str], n_results: int) -> Optional[List[Any]]:
+    """Merge the precomputed neighbour lists of the watched items; None if the table is unavailable."""
+    table = get_neighbour_table()
+    if table is None:
+        return None
+    neighbours = table.recommend(watch_history, n_results * PUSHDOWN_OVERFETCH, recency_decay=NEIGHBOUR_RECENCY_DECAY)
+    if not neighbours:
+        return None
+    metadata = _candidate_metadata([anime_id for anime_id, _ in neighbours])
+    return [
+        VectorMatch(id=anime_id, score=score, metadata=metadata[anime_id])
+        for anime_id, score in neighbours if anime_id in metadata
+    ]
+
+async def _async_history_candidates(user_id: str, watch_history: List[str], n_results: int,
+                                    mode: str) -> Optional[Tuple[List[Any], FetchMore]]:
+    """
+    Candidates from the precomputed history modes, with the function that
+    extends them; None if the request needs the text path.
+    """
+    if not watch_history:
+        return None
+    loop = asyncio.get_running_loop()
+    if mode == "neighbours":
+        candidates = await loop.run_in_executor(executor, _neighbour_candidates, watch_history, n_results)
+        if candidates is not None:
+            return candidates, _neighbour_fetch_more(watch_history)
+    if mode in ("profile", "neighbours"):
+        # Search with the user's stored taste vector, unless no watched item has a stored vector
+        taste_vector = await loop.run_in_executor(executor, _taste_vector, user_id, watch_history)
+        if taste_vector is not None:
+            watched_ids = frozenset(str(anime_id) for anime_id in watch_history)
+            fetch_more = _vector_fetch_more(taste_vector, QueryFilter(), watched_ids)
+            return await fetch_more(n_results, frozenset()), fetch_more
+    return None
+
+async def _async_history_result_set(user_id: str, watch_history: List[str], n_results: int,
+                                    weights: Optional[ScoreWeights], mode: str) -> Optional[ResultSet]:
+    loop = asyncio.get_running_loop()
+    precomputed = await _async_history_candidates(user_id, watch_history, n_results, mode)
+    if precomputed is not None:
+        candidates, fetch_more = precomputed
+        result_set = ResultSet(fetch_more, _ranker(weights), _build_page)
+        await result_set.add(candidates)
+        return result_set
+
+    history = await loop.run_in_executor(executor, _history_titles_and_query, user_id, watch_history)
+    if history is None:
+        return None
+    watched_titles, combined_query = history
+    return await _async_query_result_set(
+        combined_query, n_results, weights, keep=lambda metadata: metadata.get('title', '') not in watched_titles
+    )
+
+async def async_history_recommendation_page(user_id: str, n_results: int = 5, weights: Optional[ScoreWeights] = None,
+                                            mode: str = "profile", cursor: Optional[str] = None) -> Page:
+    """Watch-history recommendations as served by the API, paginated like the query endpoint."""
+    try:
+        watch_history = await async_get_user_history(user_id)
+        set_key = history_set_key(user_id, mode, weights, watch_history)
+        offset = decode_cursor(cursor, set_key) if cursor else 0
+        result_set = None
+
+        async def compute():
+            nonlocal result_set
+            page, result_set = await _result_page(
+                set_key, offset, n_results,
+                lambda: _async_history_result_set(user_id, watch_history, n_results, weights, mode)
+            )
+            return page
+
+        if offset == 0:
+            key = response_cache.history_key(n_results, mode, weights, watch_history)
+            recommendations = await response_cache.aget_or_compute(key, compute)
+        else:
+            recommendations = await compute()
+        return Page(recommendations, next_cursor(set_key, offset, recommendations, n_results, result_set))
+
+    except InvalidCursor:
+        raise
     except Exception as e:
-        print(f"Error in history_based_recommendation: {e}")
-        return []
+        print(f"Error in history recommendation: {e}")
+        return Page([], None)
+
+async def async_history_based_recommendation(user_id: str, n_results: int = 5, weights: Optional[ScoreWeights] = None, mode: str = "profile") -> List[AnimeRecommendation]:
+    page = await async_history_recommendation_page(user_id, n_results, weights, mode)
+    return page.recommendations
+
+BatchResult = Union[List[AnimeRecommendation], Exception]
+
+def _rank_batch(candidate_lists: Sequence[Union[List[Any], Exception]], n_results: Sequence[int], weights: Sequence[Optional[ScoreWeights]]) -> List[BatchResult]:
+    """Rank every item of a batch against one shared enrichment lookup; failed items keep their error."""
+    ids = [
+        str(match.metadata['id'])
+        for candidates in candidate_lists if not isinstance(candidates, Exception)
+        for match in candidates
+    ]
+    enrichment = get_anime_enrichment(ids)
+    results: List[BatchResult] = []
+    for candidates, n, w in zip(candidate_lists, n_results, weights):
+        if isinstance(candidates, Exception):
+            results.append(candidates)
+            continue
+        try:
+            results.append(rank_candidates(candidates, n, w, enrichment=enrichment))
+        except Exception as e:
+            results.append(e)
+    return results
+
+async def _async_batch_candidates(queries: Sequence[str], search_texts: Sequence[Union[str, Exception]], n_results: Sequence[int]) -> List[Union[List[Any], Exception]]:
+    """
+    Candidates for many queries at once.
+
+    Filters are parsed concurrently, all search texts are encoded with one
+    model call and the vector searches run concurrently on `executor`, each
+    fused with the keyword matches of its query.
+    """
+    filters = await asyncio.gather(*(async_parse_query(query) for query in queries), return_exceptions=True)
+    texts = [text for text in search_texts if not isinstance(text, Exception)]
+    vectors = dict(zip(texts, await get_embedding_service().embed_many(texts))) if texts else {}
+
+    async def search(query, item_filters, text, n):
+        for value in (item_filters, text):
+            if isinstance(value, Exception):
+                raise value
+        return await async_hybrid_candidates(vectors[text], query, item_filters, n)
+
+    return await asyncio.gather(
+        *(search(query, f, text, n) for query, f, text, n in zip(queries, filters, search_texts, n_results)),
+        return_exceptions=True,
+    )
+
+async def async_batch_query_recommendation(requests: Sequence[RecommendationRequest]) -> List[BatchResult]:
+    """
+    Batch form of `async_query_based_recommendation`.
+
+    Returns one entry per request, in order: its recommendations, or the
+    exception that item failed with. One item failing does not fail the rest.
+    """
+    loop = asyncio.get_running_loop()
+
+    async def search_text(request: RecommendationRequest) -> str:
+        if request.personalized and request.user_id is not None:
+            watch_history = await async_get_user_history(request.user_id)
+            return await loop.run_in_executor(executor, build_history_query, request.query, watch_history)
+        return request.query
+
+    search_texts = await asyncio.gather(*(search_text(request) for request in requests), return_exceptions=True)
+    candidate_lists = await _async_batch_candidates(
+        [request.query for request in requests], search_texts, [request.n_results for request in requests]
+    )
+    return await loop.run_in_executor(
+        executor, _rank_batch, candidate_lists,
+        [request.n_results for request in requests], [request.weights for request in requests]
+    )
+
+async def async_batch_history_recommendation(requests: Sequence[HistoryRecommendationRequest]) -> List[BatchResult]:
+    """
+    Batch form of `async_history_based_recommendation`.
+
+    Profile and neighbour items are served concurrently; items that need the
+    text path share one batched parse / encode / search round.
+    """
+    loop = asyncio.get_running_loop()
+    histories = await asyncio.gather(
+        *(async_get_user_history(request.user_id) for request in requests), return_exceptions=True
+    )
+
+    async def precomputed(request, watch_history):
+        if isinstance(watch_history, Exception):
+            return watch_history
+        found = await _async_history_candidates(request.user_id, watch_history, request.n_results, request.mode)
+        return None if found is None else found[0]
+
+    candidate_lists = list(await asyncio.gather(
+        *(precomputed(request, history) for request, history in zip(requests, histories)), return_exceptions=True
+    ))
+
+    # Items without precomputed candidates fall back to a query built from their watched titles
+    text_items = [i for i, candidates in enumerate(candidate_lists) if candidates is None]
+    text_queries = await asyncio.gather(*(
+        loop.run_in_executor(executor, _history_titles_and_query, requests[i].user_id, histories[i])
+        for i in text_items
+    ), return_exceptions=True)
+    watched_titles: Dict[int, set] = {}
+    queries, batch_items = [], []
+    for i, history in zip(text_items, text_queries):
+        if isinstance(history, Exception):
+            candidate_lists[i] = history
+        elif history is None:
+            candidate_lists[i] = []
+        else:
+            watched_titles[i], combined_query = history
+            queries.append(combined_query)
+            batch_items.append(i)
+    if batch_items:
+        text_candidates = await _async_batch_candidates(queries, queries, [requests[i].n_results for i in batch_items])
+        for i, candidates in zip(batch_items, text_candidates):
+            candidate_lists[i] = candidates
 
+    results = await loop.run_in_executor(
+        executor, _rank_batch, candidate_lists,
+        [request.n_results for request in requests], [request.weights for request in requests]
+    )
+    for i, titles in watched_titles.items():
+        if not isinstance(results[i], Exception):
+            results[i] = [rec for rec in results[i] if rec.title not in titles]
+    return results
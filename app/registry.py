@@ -0,0 +1,168 @@
+"""
+Lazily constructed service dependencies.
+
+Importing the app no longer connects to anything. The Supabase clients,
+the vector store, the sentence-transformer and the Gemini LLM are
+registered here as factories and built on first use, at most once, even
+under concurrent first requests. The FastAPI lifespan starts `warmup()` in
+the background, which builds them ahead of traffic and runs a dummy
+encode; `/readyz` reports ready once it has finished. `override()` swaps
+in a ready-made instance, which is how the benchmarks install their fakes.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+WARMUP_RETRY_SECONDS = float(os.getenv('WARMUP_RETRY_SECONDS', '5'))
+
+
+class Registry:
+    def __init__(self):
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._instances: Dict[str, Any] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._async_locks: Dict[str, asyncio.Lock] = {}
+        self._guard = threading.Lock()
+        self.ready = False
+        self.warmup_error: Optional[str] = None
+        self.warmup_seconds: Optional[float] = None
+
+    def register(self, name: str, factory: Callable[[], Any]) -> None:
+        """Register how to build `name`; async factories are built with `aget`."""
+        with self._guard:
+            self._factories[name] = factory
+            self._locks[name] = threading.Lock()
+
+    def override(self, name: str, instance: Any) -> None:
+        with self._guard:
+            self._instances[name] = instance
+
+    def discard(self, name: str) -> None:
+        """Drop a built instance so the next `get` builds a new one (e.g. a client that must not cross a fork)."""
+        with self._guard:
+            self._instances.pop(name, None)
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._instances
+
+    def get(self, name: str) -> Any:
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        with self._locks[name]:
+            if name not in self._instances:
+                self._instances[name] = self._factories[name]()
+            return self._instances[name]
+
+    async def aget(self, name: str) -> Any:
+        """`get` for async factories, which must run inside the event loop."""
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        lock = self._async_locks.setdefault(name, asyncio.Lock())
+        async with lock:
+            if name not in self._instances:
+                self._instances[name] = await self._factories[name]()
+            return self._instances[name]
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            'ready': self.ready,
+            'loaded': sorted(self._instances),
+            'warmup_seconds': self.warmup_seconds,
+            'warmup_error': self.warmup_error,
+        }
+
+
+registry = Registry()
+
+
+def _create_supabase():
+    from supabase import create_client
+    return create_client(os.getenv('NEXT_PUBLIC_SUPABASE_URL'), os.getenv('NEXT_PUBLIC_SUPABASE_ANON_KEY'))
+
+
+async def _create_async_supabase():
+    from supabase import acreate_client
+    # Its httpx client pools connections across requests
+    return await acreate_client(os.getenv('NEXT_PUBLIC_SUPABASE_URL'), os.getenv('NEXT_PUBLIC_SUPABASE_ANON_KEY'))
+
+
+def _create_vector_store():
+    from app.vector_store import get_vector_store
+    return get_vector_store()
+
+
+def _create_embeddings():
+    from app.embedding_backends import create_embeddings
+    return create_embeddings()
+
+
+def _create_llm():
+    from langchain_google_genai import GoogleGenerativeAI
+    return GoogleGenerativeAI(model="gemini-pro", google_api_key=os.getenv("GOOGLE_API_KEY"))
+
+
+registry.register('supabase', _create_supabase)
+registry.register('async_supabase', _create_async_supabase)
+registry.register('vector_store', _create_vector_store)
+registry.register('embeddings', _create_embeddings)
+registry.register('llm', _create_llm)
+
+
+def get_supabase():
+    return registry.get('supabase')
+
+
+def get_vector_index():
+    return registry.get('vector_store')
+
+
+def get_embeddings():
+    return registry.get('embeddings')
+
+
+def get_llm():
+    return registry.get('llm')
+
+
+def _warm() -> None:
+    from app.database import get_catalog, start_catalog_refresher
+    from app.item_neighbours import get_neighbour_table
+    from app.keyword_index import get_keyword_index
+
+    get_supabase()
+    start_catalog_refresher()
+    store = get_vector_index()
+    catalog = get_catalog()
+    # In-process stores filter with their own attribute index and never see a metadata filter
+    if store.attribute_index is None and catalog is not None:
+        if not store.probe_typed_metadata(catalog.ids):
+            print("Vector index metadata predates typed filter fields; query filters are applied after "
+                  "the vector query until the index is re-ingested and the service restarted")
+    # The first forward pass is much slower than the rest; pay for it before traffic arrives
+    get_embeddings().embed_documents(["warmup"])
+    get_llm()
+    get_neighbour_table()
+    get_keyword_index()
+
+
+async def warmup() -> None:
+    """Build every dependency in a worker thread, retrying until it succeeds, then mark the app ready."""
+    start = time.perf_counter()
+    while True:
+        try:
+            await asyncio.to_thread(_warm)
+            await registry.aget('async_supabase')
+            break
+        except Exception as e:
+            registry.warmup_error = f"{type(e).__name__}: {e}"
+            print(f"Warmup failed, retrying in {WARMUP_RETRY_SECONDS}s: {e}")
+            await asyncio.sleep(WARMUP_RETRY_SECONDS)
+    registry.warmup_error = None
+    registry.warmup_seconds = round(time.perf_counter() - start, 3)
+    registry.ready = True
+    print(f"Warmup finished in {registry.warmup_seconds}s")
@@ -0,0 +1,146 @@
+"""
+Request latency budgets and a circuit breaker for slow dependencies.
+
+Every API request runs inside `request_budget(seconds)`, which puts a
+`RequestBudget` in a context variable (like the stage timings in
+`app.metrics`). Pipeline stages read `remaining_budget()` to cap their own
+waits, and record which query-parse path served the request so the API can
+report it in the `X-Query-Parse-Path` header. Responses served from the
+response cache or a kept result set replay the paths of their original parse. A request that had to fall
+back (the LLM timed out, failed or was skipped) is marked degraded and its
+response is not put in the response cache.
+
+`CircuitBreaker` stops calling a dependency after repeated failures: it
+opens for `reset_seconds`, then lets a single probe call through
+(half-open) and closes again if the probe succeeds.
+"""
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+
+# Parse paths that mean the LLM's filter was wanted but not used
+FALLBACK_PATHS = frozenset({'llm_timeout', 'llm_error', 'circuit_open'})
+
+
+@dataclass
+class RequestBudget:
+    deadline: float  # time.monotonic() value
+    parse_paths: List[str] = field(default_factory=list)
+    degraded: bool = False
+
+    def remaining(self) -> float:
+        return max(0.0, self.deadline - time.monotonic())
+
+
+_current_budget: contextvars.ContextVar[Optional[RequestBudget]] = contextvars.ContextVar(
+    'request_budget', default=None
+)
+
+
+@contextmanager
+def request_budget(seconds: float) -> Iterator[Optional[RequestBudget]]:
+    """Run a request under a latency budget; `seconds <= 0` means no budget."""
+    budget = RequestBudget(deadline=time.monotonic() + seconds) if seconds > 0 else None
+    token = _current_budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _current_budget.reset(token)
+
+
+def remaining_budget() -> Optional[float]:
+    """Seconds left for the current request, or None outside a budget."""
+    budget = _current_budget.get()
+    return None if budget is None else budget.remaining()
+
+
+def budget_exhausted() -> bool:
+    remaining = remaining_budget()
+    return remaining is not None and remaining <= 0
+
+
+def note_parse_path(path: str) -> None:
+    budget = _current_budget.get()
+    if budget is not None:
+        if path not in budget.parse_paths:
+            budget.parse_paths.append(path)
+        if path in FALLBACK_PATHS:
+            budget.degraded = True
+
+
+def current_parse_paths() -> List[str]:
+    """Parse paths noted so far in the current request."""
+    budget = _current_budget.get()
+    return [] if budget is None else list(budget.parse_paths)
+
+
+def replay_parse_paths(source: str, paths: List[str]) -> None:
+    """Note that the response was served from `source` (e.g. a cache), then the paths of its original parse."""
+    for path in [source, *paths]:
+        note_parse_path(path)
+
+
+def request_degraded() -> bool:
+    budget = _current_budget.get()
+    return budget is not None and budget.degraded
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_started: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open(time.monotonic())
+            return self._state
+
+    def _maybe_half_open(self, now: float) -> None:
+        if self._state == self.OPEN and now - self._opened_at >= self.reset_seconds:
+            self._state = self.HALF_OPEN
+            self._probe_started = None
+
+    def allow(self) -> bool:
+        """Whether to call the dependency now; in half-open state only one probe at a time is allowed."""
+        now = time.monotonic()
+        with self._lock:
+            self._maybe_half_open(now)
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN:
+                # A probe whose outcome was never recorded must not hold the breaker half-open forever
+                if self._probe_started is None or now - self._probe_started >= self.reset_seconds:
+                    self._probe_started = now
+                    return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_started = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_started = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {'state': self.state, 'consecutive_failures': self._failures}
@@ -0,0 +1,227 @@
+"""
+Full-response cache for query and history recommendations.
+
+Entries are keyed on everything that determines a response: the normalised
+query, `n_results`, `personalized`, the score weights, the history mode and,
+for personalised and history requests, a hash of the user's watch list. A
+watch-list change therefore produces a new key and old entries simply age
+out; two users with the same watch list share entries. Empty responses are
+not stored, since they usually mean an upstream call failed, and neither are
+responses built with the rule-based fallback after Gemini timed out or failed.
+
+The storage backend is pluggable. By default entries live in an in-process
+LRU (`TTLCache`); with `RESPONSE_CACHE_URL` set, any Redis-compatible client
+is used instead, so workers share one cache. `RedisBackend` takes the client
+object, so a local fake (e.g. `fakeredis.FakeRedis()`) works in tests.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+from app.cache import TTLCache
+from app.metrics import increment, cache_hits, cache_misses
+from app.models import AnimeRecommendation, ScoreWeights
+from app.resilience import current_parse_paths, replay_parse_paths, request_degraded
+from app.utils import normalize_query
+
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', '4096'))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv('RESPONSE_CACHE_TTL_SECONDS', '300'))
+RESPONSE_CACHE_PREFIX = 'recommendation:'
+
+
+class CacheBackend(ABC):
+    # Whether get/set do network I/O and should be kept off the event loop
+    blocking = False
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: str, ttl_seconds: float) -> None:
+        ...
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+
+class InProcessBackend(CacheBackend):
+    def __init__(self, max_size: int = RESPONSE_CACHE_SIZE):
+        self.cache = TTLCache(max_size=max_size)
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value, ttl_seconds):
+        self.cache.set(key, value, ttl_seconds=ttl_seconds)
+
+    def stats(self):
+        return {'size': len(self.cache), 'max_size': self.cache.max_size}
+
+
+class RedisBackend(CacheBackend):
+    """Any client with Redis' `get` / `set(key, value, ex=...)`; size bounds come from the server's maxmemory policy."""
+    blocking = True
+
+    def __init__(self, client, prefix: str = RESPONSE_CACHE_PREFIX):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+
+    def set(self, key, value, ttl_seconds):
+        self.client.set(self.prefix + key, value, ex=max(1, int(ttl_seconds)))
+
+
+def watch_list_hash(watch_history: Optional[Sequence[str]]) -> Optional[str]:
+    """Version of a watch list; order is kept since recency can affect results."""
+    if watch_history is None:
+        return None
+    return hashlib.sha1('\x1f'.join(str(anime_id) for anime_id in watch_history).encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, backend: CacheBackend, ttl_seconds: float = RESPONSE_CACHE_TTL_SECONDS):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.latency_saved = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0
+
+    @staticmethod
+    def make_key(kind: str, **parts: Any) -> str:
+        return kind + ':' + hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def query_key(self, query: str, n_results: int, personalized: bool,
+                  weights: Optional[ScoreWeights], watch_history: Optional[Sequence[str]]) -> str:
+        return self.make_key(
+            'query',
+            query=normalize_query(query),
+            n_results=n_results,
+            personalized=personalized,
+            weights=weights.model_dump() if weights else None,
+            watch_list=watch_list_hash(watch_history),
+        )
+
+    def history_key(self, n_results: int, mode: str,
+                    weights: Optional[ScoreWeights], watch_history: Sequence[str]) -> str:
+        return self.make_key(
+            'history',
+            n_results=n_results,
+            mode=mode,
+            weights=weights.model_dump() if weights else None,
+            watch_list=watch_list_hash(watch_history),
+        )
+
+    def _load(self, key: str, raw: Optional[str]) -> Optional[List[AnimeRecommendation]]:
+        if raw is None:
+            with self._lock:
+                self.misses += 1
+            increment(cache_misses, 'response')
+            return None
+        entry = json.loads(raw)
+        increment(cache_hits, 'response')
+        with self._lock:
+            self.hits += 1
+            self.latency_saved += entry['compute_seconds']
+        replay_parse_paths('cached-response', entry.get('parse_paths', []))
+        return [AnimeRecommendation(**recommendation) for recommendation in entry['recommendations']]
+
+    def _dump(self, recommendations: List[AnimeRecommendation], compute_seconds: float) -> str:
+        return json.dumps({
+            'compute_seconds': compute_seconds,
+            'parse_paths': current_parse_paths(),
+            'recommendations': [recommendation.model_dump() for recommendation in recommendations],
+        })
+
+    def _backend_error(self, e: Exception) -> None:
+        # A broken cache must never fail the request; it only costs the hit
+        with self._lock:
+            self.errors += 1
+        print(f"Error accessing response cache: {e}")
+
+    def get_or_compute(self, key: str, compute: Callable[[], List[AnimeRecommendation]]) -> List[AnimeRecommendation]:
+        if not self.enabled:
+            return compute()
+        try:
+            cached = self._load(key, self.backend.get(key))
+            if cached is not None:
+                return cached
+        except Exception as e:
+            self._backend_error(e)
+
+        start = time.perf_counter()
+        recommendations = compute()
+        if not recommendations or request_degraded():
+            return recommendations
+        try:
+            self.backend.set(key, self._dump(recommendations, time.perf_counter() - start), self.ttl_seconds)
+        except Exception as e:
+            self._backend_error(e)
+        return recommendations
+
+    async def aget_or_compute(self, key: str, compute: Callable[[], Awaitable[List[AnimeRecommendation]]]) -> List[AnimeRecommendation]:
+        if not self.enabled:
+            return await compute()
+
+        async def call(method, *args):
+            if self.backend.blocking:
+                return await asyncio.to_thread(method, *args)
+            return method(*args)
+
+        try:
+            cached = self._load(key, await call(self.backend.get, key))
+            if cached is not None:
+                return cached
+        except Exception as e:
+            self._backend_error(e)
+
+        start = time.perf_counter()
+        recommendations = await compute()
+        if not recommendations or request_degraded():
+            return recommendations
+        try:
+            await call(self.backend.set, key, self._dump(recommendations, time.perf_counter() - start), self.ttl_seconds)
+        except Exception as e:
+            self._backend_error(e)
+        return recommendations
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            **self.backend.stats(),
+            'hits': self.hits,
+            'misses': self.misses,
+            'errors': self.errors,
+            'hit_ratio': self.hits / total if total else 0.0,
+            'latency_saved_seconds': round(self.latency_saved, 3),
+        }
+
+
+def create_response_cache() -> ResponseCache:
+    """In-process cache, or a shared Redis-compatible one when RESPONSE_CACHE_URL is set."""
+    url = os.getenv('RESPONSE_CACHE_URL')
+    if url:
+        try:
+            import redis
+            return ResponseCache(RedisBackend(redis.Redis.from_url(url)))
+        except Exception as e:
+            print(f"Error connecting to response cache at {url}, using in-process cache: {e}")
+    return ResponseCache(InProcessBackend())
+
+
+response_cache = create_response_cache()
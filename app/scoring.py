@@ -0,0 +1,33 @@
+"""
+Vectorised, query-independent quality scores.
+
+These are the array forms of `feedback / normalized rank` in `app.database`
+and `utils.calculate_normalized_evaluation`. They only depend on catalog
+attributes, so they are computed once at ingestion / catalog load and
+ranking just reads the resulting float. This module only needs NumPy so the
+ingestion scripts can use it without the API's service clients.
+"""
+
+import numpy as np
+
+
+def compute_feedback_scores(num_favorites, num_list_users, feedback) -> np.ndarray:
+    """favorites / list users + user feedback, with empty lists counted as one user."""
+    num_favorites = np.nan_to_num(np.asarray(num_favorites, dtype=np.float64), nan=0.0)
+    num_lists = np.nan_to_num(np.asarray(num_list_users, dtype=np.float64), nan=1.0)
+    num_lists = np.where(num_lists == 0, 1.0, num_lists)
+    feedback = np.nan_to_num(np.asarray(feedback, dtype=np.float64), nan=1.0)
+    return num_favorites / num_lists + feedback
+
+
+def compute_normalized_ranks(rank, total_docs: int) -> np.ndarray:
+    rank = np.nan_to_num(np.asarray(rank, dtype=np.float64), nan=0.0)
+    total_docs = max(int(total_docs), 1)
+    return (total_docs - rank) / total_docs
+
+
+def compute_normalized_scores(rating, feedback_scores, normalized_ranks, total_docs: int) -> np.ndarray:
+    """feedback * rating * normalized rank, scaled by the catalog size (see calculate_normalized_evaluation)."""
+    rating = np.nan_to_num(np.asarray(rating, dtype=np.float64), nan=0.0)
+    total_docs = max(int(total_docs), 1)
+    return feedback_scores * rating * normalized_ranks / total_docs * 100
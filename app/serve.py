@@ -0,0 +1,192 @@
+"""
+Pre-fork multi-worker server.
+
+`uvicorn --workers N` spawns fresh interpreters, so every worker loads its
+own copy of the sentence-transformer, the catalog arrays and the neighbour
+table. This entry point loads them once in a parent process, freezes the
+garbage collector (so collections in the workers do not write to the
+shared objects' headers) and then forks the workers, which share those
+pages copy-on-write. A local vector snapshot is memory-mapped and shared
+through the page cache either way.
+
+Network clients (Supabase, Pinecone, Gemini) are not fork-safe and are
+built in each worker after the fork. A catalog refresh replaces the shared
+arrays with a private copy in the worker that refreshes.
+
+Usage:
+    python -m app.serve [--host 0.0.0.0] [--port 8000] [--workers 4]
+    python -m app.serve --memory <parent pid>    # RSS / PSS per process
+"""
+
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from app.embedding_backends import available_cores
+
+load_dotenv(dotenv_path=".env.local", override=True)
+
+
+def preload() -> None:
+    """Load the read-only state the workers will share."""
+    from app import main  # noqa: F401  (routes, models and module-level state)
+    from app.database import load_catalog
+    from app.item_neighbours import get_neighbour_table
+    from app.keyword_index import get_keyword_index
+    from app.registry import registry, get_embeddings, get_vector_index
+
+    # Only load the weights here: running a forward pass would start torch's
+    # thread pool, which does not survive fork. Workers do the warmup encode.
+    # An onnxruntime session starts its pool on creation, so each worker builds its own.
+    if os.getenv('EMBEDDING_BACKEND', 'torch').lower() != 'onnx':
+        get_embeddings()
+    if os.getenv('VECTOR_STORE_BACKEND', 'pinecone').lower() == 'local':
+        get_vector_index()
+    load_catalog()
+    get_neighbour_table()
+    get_keyword_index()
+    registry.discard('supabase')
+
+    gc.collect()
+    gc.freeze()
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(sock: socket.socket, args: argparse.Namespace) -> None:
+    import uvicorn
+    from app.main import app
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    if 'torch' in sys.modules:
+        sys.modules['torch'].set_num_threads(int(os.environ['EMBEDDING_THREADS']))
+    config = uvicorn.Config(app, log_level=args.log_level, lifespan='on')
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def spawn_worker(sock: socket.socket, args: argparse.Namespace) -> int:
+    pid = os.fork()
+    if pid == 0:
+        status = 0
+        try:
+            run_worker(sock, args)
+        except BaseException:
+            import traceback
+            traceback.print_exc()
+            status = 1
+        finally:
+            # Never fall back into the parent's supervision loop
+            os._exit(status)
+    return pid
+
+
+def serve(args: argparse.Namespace) -> None:
+    # Split the cores between workers instead of every worker using all of them
+    os.environ.setdefault('EMBEDDING_THREADS', str(max(1, available_cores() // args.workers)))
+    start = time.perf_counter()
+    preload()
+    print(f"Preloaded shared state in {time.perf_counter() - start:.1f}s; forking {args.workers} workers")
+
+    sock = bind_socket(args.host, args.port)
+    workers = {spawn_worker(sock, args) for _ in range(args.workers)}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        workers.discard(pid)
+        if not stopping:
+            print(f"Worker {pid} exited with status {status}; restarting")
+            time.sleep(1)  # don't spin if workers crash on startup
+            workers.add(spawn_worker(sock, args))
+    sock.close()
+
+
+def read_memory(pid: int) -> Dict[str, int]:
+    """Rss / Pss / shared and private pages of a process, in kB, from /proc/<pid>/smaps_rollup."""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                values[parts[0].rstrip(':')] = int(parts[1])
+    return values
+
+
+def child_pids(pid: int) -> List[int]:
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+def memory_report(parent_pid: int) -> None:
+    print(f"{'pid':>8} {'role':<7} {'rss MB':>9} {'pss MB':>9} {'shared MB':>10} {'private MB':>11}")
+    total_pss = 0
+    for pid in [parent_pid] + child_pids(parent_pid):
+        memory = read_memory(pid)
+        shared = memory.get('Shared_Clean', 0) + memory.get('Shared_Dirty', 0)
+        private = memory.get('Private_Clean', 0) + memory.get('Private_Dirty', 0)
+        total_pss += memory.get('Pss', 0)
+        print(
+            f"{pid:>8} {'parent' if pid == parent_pid else 'worker':<7} "
+            f"{memory.get('Rss', 0) / 1024:>9.1f} {memory.get('Pss', 0) / 1024:>9.1f} "
+            f"{shared / 1024:>10.1f} {private / 1024:>11.1f}"
+        )
+    # PSS splits shared pages between their users, so the sum is the real footprint
+    print(f"total PSS: {total_pss / 1024:.1f} MB")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Serve the API from pre-forked workers sharing the loaded model")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=int(os.getenv('WEB_CONCURRENCY', '0')) or available_cores())
+    parser.add_argument('--log-level', default='info')
+    parser.add_argument('--memory', type=int, metavar='PID', help="Print per-process memory of a running server and exit")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    if args.memory:
+        memory_report(args.memory)
+        return
+    serve(args)
+
+
+if __name__ == "__main__":
+    main()
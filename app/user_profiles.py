@@ -0,0 +1,146 @@
+"""
+Per-user taste vectors.
+
+A user's taste vector is the mean of the stored item embeddings of the
+anime they have watched. It is kept as a running sum plus count, so when
+the watch list changes only the added and removed items are fetched from
+the vector store. History recommendations then search with this vector
+directly, with no prompt building, LLM parse or encode at request time.
+
+Profiles live in a bounded in-process cache. If `USER_PROFILE_DIR` is set,
+they are also persisted there (one `.npz` per user) and survive restarts.
+"""
+
+import hashlib
+import os
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, FrozenSet, List, Optional, Sequence
+
+import numpy as np
+
+from app.cache import TTLCache
+
+FetchVectors = Callable[[Sequence[str]], Dict[str, np.ndarray]]
+
+
+@dataclass
+class UserProfile:
+    watched: FrozenSet[str]
+    # Watched ids whose vectors are in `vector_sum`; ids without a stored vector are skipped
+    counted: FrozenSet[str]
+    vector_sum: np.ndarray
+
+    @property
+    def taste_vector(self) -> Optional[np.ndarray]:
+        if not self.counted:
+            return None
+        vector = self.vector_sum / len(self.counted)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+
+class UserProfileStore:
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        max_size: int = int(os.getenv('USER_PROFILE_CACHE_SIZE', '10000')),
+    ):
+        self.directory = directory
+        self.cache = TTLCache(max_size=max_size, ttl_seconds=float('inf'))
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, user_id: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(user_id.encode('utf-8')).hexdigest() + '.npz')
+
+    def get(self, user_id: str) -> Optional[UserProfile]:
+        profile = self.cache.get(user_id)
+        if profile is None and self.directory and os.path.exists(self._path(user_id)):
+            try:
+                with np.load(self._path(user_id)) as data:
+                    profile = UserProfile(
+                        watched=frozenset(str(anime_id) for anime_id in data['watched']),
+                        counted=frozenset(str(anime_id) for anime_id in data['counted']),
+                        vector_sum=data['vector_sum'],
+                    )
+                self.cache.set(user_id, profile)
+            except Exception as e:
+                print(f"Error loading profile for user {user_id}: {e}")
+        return profile
+
+    def put(self, user_id: str, profile: UserProfile) -> None:
+        self.cache.set(user_id, profile)
+        if self.directory:
+            try:
+                path = self._path(user_id)
+                np.savez(
+                    path + '.tmp.npz',
+                    watched=np.array(sorted(profile.watched)),
+                    counted=np.array(sorted(profile.counted)),
+                    vector_sum=profile.vector_sum,
+                )
+                os.replace(path + '.tmp.npz', path)
+            except Exception as e:
+                print(f"Error saving profile for user {user_id}: {e}")
+
+    def update(self, user_id: str, watch_history: Sequence[str], fetch_vectors: FetchVectors) -> Optional[UserProfile]:
+        """
+        Bring a user's profile in line with their current watch list.
+
+        Only the items added or removed since the stored profile are fetched;
+        an unchanged list costs nothing. Returns None if no watched item has a
+        stored vector.
+        """
+        watched = frozenset(str(anime_id) for anime_id in watch_history)
+        with self._lock:
+            profile = self.get(user_id)
+        if profile is not None and profile.watched == watched:
+            return profile if profile.counted else None
+
+        if profile is None:
+            added, removed = watched, frozenset()
+            vector_sum, counted = None, set()
+        else:
+            added, removed = watched - profile.watched, profile.counted - watched
+            vector_sum, counted = profile.vector_sum.copy(), set(profile.counted)
+
+        vectors = fetch_vectors(sorted(added | removed))
+        for anime_id in removed:
+            vector = vectors.get(anime_id)
+            if vector is None:
+                # Vector no longer stored; rebuild from scratch rather than drift
+                return self._rebuild(user_id, watched, fetch_vectors)
+            vector_sum = vector_sum - vector
+            counted.discard(anime_id)
+        for anime_id in added:
+            vector = vectors.get(anime_id)
+            if vector is not None:
+                vector_sum = vector.astype(np.float64) if vector_sum is None else vector_sum + vector
+                counted.add(anime_id)
+
+        return self._store(user_id, watched, counted, vector_sum)
+
+    def _rebuild(self, user_id: str, watched: FrozenSet[str], fetch_vectors: FetchVectors) -> Optional[UserProfile]:
+        vectors = fetch_vectors(sorted(watched))
+        if not vectors:
+            return self._store(user_id, watched, set(), None)
+        vector_sum = np.sum([vector.astype(np.float64) for vector in vectors.values()], axis=0)
+        return self._store(user_id, watched, set(vectors), vector_sum)
+
+    def _store(self, user_id: str, watched: FrozenSet[str], counted, vector_sum) -> Optional[UserProfile]:
+        if vector_sum is None or not counted:
+            return None
+        profile = UserProfile(watched=watched, counted=frozenset(counted), vector_sum=vector_sum)
+        with self._lock:
+            self.put(user_id, profile)
+        return profile
+
+
+profile_store = UserProfileStore(os.getenv('USER_PROFILE_DIR'))
+
+
+def get_taste_vector(user_id: str, watch_history: List[str], fetch_vectors: FetchVectors) -> Optional[np.ndarray]:
+    profile = profile_store.update(user_id, watch_history, fetch_vectors)
+    return profile.taste_vector if profile is not None else None
@@ -1,13 +1,17 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Union, Tuple, Optional
 from app.models import QueryFilter
-from langchain_google_genai import GoogleGenerativeAI
+from app.cache import TTLCache
+from app.metrics import timed, increment, cache_hits, cache_misses, llm_fallbacks, query_parse_paths
+from app.registry import registry, get_llm
+from app.resilience import CircuitBreaker, note_parse_path, remaining_budget
 from langchain.prompts import PromptTemplate
 from langchain.schema.runnable import RunnableSequence
+import asyncio
 import json
 import os
-
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-llm = GoogleGenerativeAI(model="gemini-pro", google_api_key=GOOGLE_API_KEY)
+import re
+import threading
+import time
 
 
 def create_structured_prompt() -> str:
@@ -41,45 +45,340 @@ Notes:
 Response:"""
 
 
-def parse_query(query: str) -> QueryFilter:
-    try:
-        prompt = PromptTemplate(
-            template=create_structured_prompt(), input_variables=["query"]
-        )
-        # Create a runnable sequence instead of LLMChain
-        chain = prompt | llm
+# Built once; PromptTemplate and the runnable are immutable and safe to share
+query_prompt = PromptTemplate(template=create_structured_prompt(), input_variables=["query"])
+registry.register('query_chain', lambda: query_prompt | get_llm())
 
-        # Use invoke instead of run
-        response = chain.invoke({"query": query})
 
-        # Extract the content from the response
-        response_text = (
-            response.content if hasattr(response, "content") else str(response)
-        )
-        response_text = response_text.strip()
+def get_query_chain():
+    return registry.get('query_chain')
 
-        if response_text.startswith("```json"):
-            response_text = response_text[7:]
-        if response_text.endswith("```"):
-            response_text = response_text[:-3]
-        response_text = response_text.strip()
+PARSE_CACHE_SIZE = int(os.getenv("PARSE_CACHE_SIZE", "2048"))
+PARSE_CACHE_TTL_SECONDS = float(os.getenv("PARSE_CACHE_TTL_SECONDS", "3600"))
+parse_cache = TTLCache(max_size=PARSE_CACHE_SIZE, ttl_seconds=PARSE_CACHE_TTL_SECONDS)
+parse_stats = {"rule_based": 0, "llm_calls": 0, "llm_errors": 0, "llm_timeouts": 0, "llm_skipped": 0}
+# parse_stats may be updated from several threads; += on a dict entry is not atomic
+_parse_stats_lock = threading.Lock()
+
+
+def _count(stat: str) -> None:
+    with _parse_stats_lock:
+        parse_stats[stat] += 1
+
+# Longest a request waits for Gemini before continuing with the rule-based filter
+LLM_PARSE_BUDGET_SECONDS = float(os.getenv("LLM_PARSE_BUDGET_MS", "1500")) / 1000
+llm_breaker = CircuitBreaker(
+    failure_threshold=int(os.getenv("LLM_BREAKER_FAILURES", "5")),
+    reset_seconds=float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30")),
+)
+
+KNOWN_GENRES = [
+    "action", "adventure", "avant garde", "award winning", "boys love", "comedy",
+    "drama", "ecchi", "fantasy", "girls love", "gourmet", "horror", "mystery",
+    "romance", "sci-fi", "slice of life", "sports", "supernatural", "suspense",
+    "adult cast", "anthropomorphic", "cgdct", "childcare", "combat sports",
+    "crossdressing", "delinquents", "detective", "educational", "gag humor", "gore",
+    "harem", "high stakes game", "historical", "idols", "isekai", "iyashikei",
+    "love polygon", "mahou shoujo", "martial arts", "mecha", "medical", "military",
+    "music", "mythology", "organized crime", "otaku culture", "parody",
+    "performing arts", "pets", "psychological", "racing", "reincarnation",
+    "reverse harem", "samurai", "school", "showbiz", "space", "strategy game",
+    "super power", "survival", "team sports", "time travel", "vampire",
+    "video game", "visual arts", "workplace", "shounen", "shoujo", "seinen", "josei", "kids",
+]
+GENRE_ALIASES = {
+    "scifi": "sci-fi", "sci fi": "sci-fi", "science fiction": "sci-fi",
+    "romantic": "romance", "comedies": "comedy", "funny": "comedy",
+    "slice-of-life": "slice of life", "sport": "sports", "vampires": "vampire",
+    "shonen": "shounen", "shojo": "shoujo", "magical girl": "mahou shoujo",
+    "superpower": "super power", "superpowers": "super power",
+    "thriller": "suspense", "idol": "idols",
+}
+SEASON_ALIASES = {"spring": "spring", "summer": "summer", "fall": "fall", "autumn": "fall", "winter": "winter"}
+
+# Words that carry no filter information; a query made only of these plus
+# recognised criteria is fully handled by the rule-based extractor.
+FILLER_WORDS = {
+    "a", "an", "the", "and", "or", "of", "in", "on", "from", "with", "to", "for",
+    "anime", "animes", "show", "shows", "series", "genre", "genres", "season",
+    "seasons", "year", "years", "released", "aired", "airing", "between", "some",
+    "me", "i", "want", "like", "give", "find", "recommend", "recommendations",
+    "please", "good", "best", "top", "great", "that", "are", "is", "was", "were",
+    "rated", "rating", "score", "scored", "any", "all", "s",
+}
+
+_GENRE_TERMS = sorted(set(KNOWN_GENRES) | set(GENRE_ALIASES), key=len, reverse=True)
+_GENRE_PATTERN = re.compile(r"\b(" + "|".join(re.escape(g) for g in _GENRE_TERMS) + r")\b")
+_YEAR = r"(19[5-9]\d|20\d\d)"
+_YEAR_RANGE_PATTERN = re.compile(
+    r"\b(?:between|from)?\s*" + _YEAR + r"\s*(?:-|–|to|and|through|until)\s*" + _YEAR + r"\b"
+)
+_YEAR_AFTER_PATTERN = re.compile(r"\b(after|since|post|newer than)\s+" + _YEAR + r"\b")
+_YEAR_BEFORE_PATTERN = re.compile(r"\b(before|pre|older than)\s+" + _YEAR + r"\b")
+_DECADE_PATTERN = re.compile(r"\b(?:(19|20)?(\d)0)'?s\b")
+_SINGLE_YEAR_PATTERN = re.compile(r"\b" + _YEAR + r"\b")
+_SEASON_PATTERN = re.compile(r"\b(spring|summer|fall|autumn|winter)\b")
+_NUMBER = r"(\d{1,2}(?:\.\d+)?)"
+_RATING_MIN_PATTERN = re.compile(
+    r"\b(?:rated|rating|score|scored)?\s*(?:above|over|at least|more than|higher than|>=|>)\s*" + _NUMBER + r"\b"
+    r"|\b" + _NUMBER + r"\s*\+"
+)
+_RATING_MAX_PATTERN = re.compile(
+    r"\b(?:rated|rating|score|scored)?\s*(?:below|under|at most|less than|lower than|<=|<)\s*" + _NUMBER + r"\b"
+)
+
+
+_RATING_WORD_PATTERN = re.compile(r"\b(?:rated|rating|score|scored)\b")
+
+
+def _bare_comparison(match: re.Match, number: str) -> bool:
+    """A threshold with neither a rating word nor a decimal, e.g. "over 7"; it may count something else."""
+    return not _RATING_WORD_PATTERN.search(match.group(0)) and "." not in number
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split()).strip(" .,!?")
+
+
+def rule_based_parse(query: str) -> Tuple[QueryFilter, bool]:
+    """
+    Deterministically extract genres, years, year ranges, seasons and rating
+    thresholds from a query.
+
+    Returns the extracted filter and whether the query was fully explained by
+    the rules (only recognised criteria and filler words), in which case the
+    LLM has nothing to add.
+    """
+    text = normalize_query(query)
+    remaining = text
+
+    def consume(match: re.Match) -> None:
+        nonlocal remaining
+        remaining = remaining.replace(match.group(0), " ", 1)
+
+    # "under 12 episodes" or "at least 2 seasons" are not ratings: values above 10
+    # are left in the text, and a bare integer comparison is kept but left to the LLM
+    rating_min = rating_max = None
+    ambiguous = False
+    for match in _RATING_MAX_PATTERN.finditer(text):
+        value = float(match.group(1))
+        if value <= 10:
+            rating_max = value
+            ambiguous |= _bare_comparison(match, match.group(1))
+            consume(match)
+    for match in _RATING_MIN_PATTERN.finditer(remaining):
+        number = match.group(1) or match.group(2)
+        value = float(number)
+        if value <= 10:
+            rating_min = value
+            ambiguous |= _bare_comparison(match, number)
+            consume(match)
+
+    year_start = year_end = None
+    range_match = _YEAR_RANGE_PATTERN.search(remaining)
+    if range_match:
+        year_start, year_end = sorted((int(range_match.group(1)), int(range_match.group(2))))
+        consume(range_match)
+    for match in _YEAR_AFTER_PATTERN.finditer(remaining):
+        year_start = int(match.group(2)) + (0 if match.group(1) == "since" else 1)
+        consume(match)
+    for match in _YEAR_BEFORE_PATTERN.finditer(remaining):
+        year_end = int(match.group(2)) - 1
+        consume(match)
+    decade_match = _DECADE_PATTERN.search(remaining)
+    if decade_match and year_start is None and year_end is None:
+        century = decade_match.group(1) or ("20" if decade_match.group(2) in "012" else "19")
+        year_start = int(century + decade_match.group(2) + "0")
+        year_end = year_start + 9
+        consume(decade_match)
+    if year_start is None and year_end is None:
+        years = [int(m.group(1)) for m in _SINGLE_YEAR_PATTERN.finditer(remaining)]
+        if years:
+            year_start, year_end = min(years), max(years)
+            for match in list(_SINGLE_YEAR_PATTERN.finditer(remaining)):
+                consume(match)
+
+    seasons = []
+    for match in _SEASON_PATTERN.finditer(remaining):
+        season = SEASON_ALIASES[match.group(1)]
+        if season not in seasons:
+            seasons.append(season)
+    remaining = _SEASON_PATTERN.sub(" ", remaining)
+
+    genres = []
+    for match in _GENRE_PATTERN.finditer(remaining):
+        genre = GENRE_ALIASES.get(match.group(1), match.group(1))
+        if genre not in genres:
+            genres.append(genre)
+    remaining = _GENRE_PATTERN.sub(" ", remaining)
+
+    leftover = [word for word in re.split(r"[^a-z0-9']+", remaining) if word and word not in FILLER_WORDS]
+    found_any = bool(genres or seasons or year_start or year_end or rating_min or rating_max)
+
+    filters = QueryFilter(
+        genres=genres or None,
+        year_start=year_start,
+        year_end=year_end,
+        seasons=seasons or None,
+        rating_min=rating_min,
+        rating_max=rating_max,
+    )
+    return filters, found_any and not leftover and not ambiguous
+
+
+def _filter_from_llm_response(response: Any) -> QueryFilter:
+    # Extract the content from the response
+    response_text = (
+        response.content if hasattr(response, "content") else str(response)
+    )
+    response_text = response_text.strip()
+
+    if response_text.startswith("```json"):
+        response_text = response_text[7:]
+    if response_text.endswith("```"):
+        response_text = response_text[:-3]
+    response_text = response_text.strip()
+
+    result_dict = json.loads(response_text)
+    return QueryFilter(**result_dict)
+
+
+@timed('parse_query_llm')
+async def async_parse_query_with_llm(query: str) -> QueryFilter:
+    _count("llm_calls")
+    return _filter_from_llm_response(await get_query_chain().ainvoke({"query": query}))
+
+
+def _parse_without_llm(query: str) -> Tuple[str, Optional[QueryFilter], QueryFilter]:
+    """Return the cache key, a filter if cache or rules settle the query, and the rule-based fallback."""
+    key = normalize_query(query)
+    cached = parse_cache.get(key)
+    if cached is not None:
+        increment(cache_hits, 'query_parse')
+        _record_path("cache")
+        return key, cached.model_copy(deep=True), cached
+    increment(cache_misses, 'query_parse')
+
+    rule_filters, complete = rule_based_parse(query)
+    if complete:
+        _count("rule_based")
+        parse_cache.set(key, rule_filters)
+        _record_path("rules")
+        return key, rule_filters.model_copy(deep=True), rule_filters
+    return key, None, rule_filters
+
+
+def _record_path(path: str) -> None:
+    note_parse_path(path)
+    increment(query_parse_paths, path)
+
+
+def _llm_timeout(started: float) -> float:
+    """What is left of the LLM sub-budget (and of the request's budget) since `started`."""
+    timeout = LLM_PARSE_BUDGET_SECONDS - (time.monotonic() - started)
+    remaining = remaining_budget()
+    if remaining is not None:
+        timeout = min(timeout, remaining)
+    return max(0.0, timeout)
+
+
+def _fallback(path: str, rule_filters: QueryFilter, error: Optional[Exception] = None) -> QueryFilter:
+    if path == "llm_timeout":
+        _count("llm_timeouts")
+    elif path == "llm_error":
+        _count("llm_errors")
+        print(f"Error parsing query: {error}")
+    else:
+        _count("llm_skipped")
+    increment(llm_fallbacks)
+    _record_path(path)
+    # Not cached, so the next identical query gets another chance at the LLM
+    return rule_filters.model_copy(deep=True)
+
+
+async def _async_parse_and_cache(key: str, query: str) -> QueryFilter:
+    filters = await async_parse_query_with_llm(query)
+    parse_cache.set(key, filters)
+    return filters
+
+
+def _consume_result(future) -> None:
+    # Abandoned calls may fail after nobody is waiting; don't log them as unretrieved
+    if not future.cancelled():
+        future.exception()
+
+
+class PendingParse:
+    """
+    A query parse whose LLM refinement may still be running.
+
+    `filters` is usable right away (cached, rule-based, or the rule-based
+    fallback while Gemini works); `result()` waits for Gemini within its
+    budget and falls back to `filters` if it is late or fails.
+    """
+
+    def __init__(self, filters: QueryFilter, rule_filters: Optional[QueryFilter] = None,
+                 task: Optional[asyncio.Future] = None, started: float = 0.0):
+        self.filters = filters
+        self._rule_filters = rule_filters
+        self._task = task
+        self._started = started
+
+    @property
+    def settled(self) -> bool:
+        return self._task is None
+
+    async def result(self) -> QueryFilter:
+        if self._task is None:
+            return self.filters
+        task, self._task = self._task, None
+        try:
+            filters = await asyncio.wait_for(asyncio.shield(task), timeout=_llm_timeout(self._started))
+        except asyncio.TimeoutError:
+            llm_breaker.record_failure()
+            self.filters = _fallback("llm_timeout", self._rule_filters)
+            return self.filters
+        except Exception as e:
+            llm_breaker.record_failure()
+            self.filters = _fallback("llm_error", self._rule_filters, e)
+            return self.filters
+
+        llm_breaker.record_success()
+        _record_path("llm")
+        self.filters = filters.model_copy(deep=True)
+        return self.filters
+
+
+def begin_parse_query(query: str) -> PendingParse:
+    """Start parsing `query` without waiting for Gemini; must be called inside the event loop."""
+    key, filters, rule_filters = _parse_without_llm(query)
+    if filters is not None:
+        return PendingParse(filters)
+    if not llm_breaker.allow():
+        return PendingParse(_fallback("circuit_open", rule_filters))
+
+    task = asyncio.ensure_future(_async_parse_and_cache(key, query))
+    task.add_done_callback(_consume_result)
+    return PendingParse(rule_filters.model_copy(deep=True), rule_filters, task, time.monotonic())
+
+
+@timed('parse_query')
+async def async_parse_query(query: str) -> QueryFilter:
+    """
+    Filter for `query` from the cache, the rules or Gemini.
+
+    Gemini gets at most `LLM_PARSE_BUDGET_MS` (less if the request budget
+    runs out first) and is skipped while its circuit breaker is open; in
+    both cases the rule-based filter is used.
+    """
+    return await begin_parse_query(query).result()
+
+
+def get_parse_stats() -> Dict[str, Any]:
+    with _parse_stats_lock:
+        counts = dict(parse_stats)
+    return {**parse_cache.stats(), **counts, "llm_circuit": llm_breaker.stats()}
 
-        result_dict = json.loads(response_text)
-        return QueryFilter(**result_dict)
-    except Exception as e:
-        print(f"Error parsing query: {e}")
-        return QueryFilter(
-            genres=["action"] if "action" in query.lower() else None,
-            year_start=2020 if "2020" in query else None,
-            year_end=2021 if "2021" in query else None,
-            seasons=(
-                ["summer", "fall"]
-                if "summer" in query.lower() or "fall" in query.lower()
-                else None
-            ),
-            rating_min=7.5 if "7.5" in query else None,
-            rating_max=9.5 if "8.5" in query else None,
-        )
 
 
 # Rest of the functions remain unchanged
@@ -119,8 +418,46 @@ def filter_metadata(metadata: Dict[str, Any], filters: QueryFilter) -> bool:
         return False
 
 
-def extract_genres_from_string(genres_str: str) -> List[str]:
+def build_vector_filter(filters: QueryFilter) -> Optional[Dict[str, Any]]:
+    """
+    Translate a QueryFilter into a Pinecone-style metadata filter.
+
+    Mirrors `filter_metadata` against the typed metadata written by
+    `anime_embeddings.build_metadata` (numeric `year`/`rating`, lower-cased
+    `genre_keys` list and `season_key`). Returns None when nothing is constrained.
+    """
+    clauses = []
+    if filters.genres:
+        clauses.append({"genre_keys": {"$in": [genre.lower() for genre in filters.genres]}})
+
+    year_range = {}
+    if filters.year_start:
+        year_range["$gte"] = filters.year_start
+    if filters.year_end:
+        year_range["$lte"] = filters.year_end
+    if year_range:
+        clauses.append({"year": year_range})
+
+    if filters.seasons:
+        clauses.append({"season_key": {"$in": [season.lower() for season in filters.seasons]}})
+
+    rating_range = {}
+    if filters.rating_min:
+        rating_range["$gte"] = filters.rating_min
+    if filters.rating_max:
+        rating_range["$lte"] = filters.rating_max
+    if rating_range:
+        clauses.append({"rating": rating_range})
+
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def extract_genres_from_string(genres_str: Union[str, List[str]]) -> List[str]:
     try:
+        if isinstance(genres_str, (list, tuple)):
+            return [str(genre).strip() for genre in genres_str if str(genre).strip()]
         cleaned_str = genres_str.strip().strip("\"'")
         if not cleaned_str or cleaned_str == "[]":
             return []
@@ -0,0 +1,521 @@
+"""
+Vector store backends for the recommendation pipeline.
+
+`PineconeVectorStore` forwards to the hosted `embeddings-animes` index.
+`LocalVectorStore` answers the same queries in-process from a snapshot
+written by `app.anime_embeddings` (`embeddings.npy` + `metadata.json`),
+which removes the network hop and lets the service run without Pinecone.
+
+Select the backend with `VECTOR_STORE_BACKEND=pinecone|local`; the local
+backend reads its snapshot from `VECTOR_SNAPSHOT_DIR`.
+"""
+
+import asyncio
+import json
+import os
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Set
+
+import numpy as np
+
+from app.attribute_index import AttributeIndex
+
+SNAPSHOT_VECTORS_FILE = 'embeddings.npy'
+SNAPSHOT_METADATA_FILE = 'metadata.json'
+DEFAULT_SNAPSHOT_DIR = 'data/embeddings'
+PINECONE_INDEX_NAME = 'embeddings-animes'
+TYPED_METADATA_PROBE_SIZE = 20
+
+
+@dataclass
+class VectorMatch:
+    id: str
+    score: float
+    metadata: Dict[str, Any] = field(default_factory=dict)
+    # Ranking signal when it differs from the cosine `score` (hybrid retrieval); None means `score`
+    relevance: Optional[float] = None
+
+
+@dataclass
+class VectorQueryResult:
+    matches: List[VectorMatch]
+
+
+class VectorStore(ABC):
+    """Minimal interface shared by every backend; mirrors `pinecone.Index.query`."""
+
+    # Backends that search in-process expose an `AttributeIndex` over their rows;
+    # `query` then also accepts a boolean row mask compiled from it as `filter`
+    attribute_index: Optional[AttributeIndex] = None
+    # Whether the stored metadata has the typed fields pushed-down filters target; see `probe_typed_metadata`
+    typed_metadata: bool = True
+
+    @abstractmethod
+    def query(
+        self,
+        vector: Sequence[float],
+        top_k: int,
+        filter: Optional[Dict[str, Any]] = None,
+        include_metadata: bool = True,
+    ) -> VectorQueryResult:
+        ...
+
+    @abstractmethod
+    def fetch(self, ids: Sequence[str]) -> Dict[str, np.ndarray]:
+        """Stored vectors for `ids`; ids that are not in the store are left out."""
+        ...
+
+    @abstractmethod
+    def fetch_metadata(self, ids: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+        """Stored metadata for `ids`, by id lookup rather than similarity search."""
+        ...
+
+    def score(self, vector: Sequence[float], ids: Sequence[str]) -> List[VectorMatch]:
+        """Cosine similarity of `vector` to the stored vectors of `ids`, with their metadata; unknown ids are left out."""
+        vectors = self.fetch(ids)
+        metadata = self.fetch_metadata(list(vectors))
+        return [
+            VectorMatch(id=anime_id, score=_cosine(vector, stored), metadata=metadata.get(anime_id, {}))
+            for anime_id, stored in vectors.items()
+        ]
+
+    async def aquery(
+        self,
+        vector: Sequence[float],
+        top_k: int,
+        filter: Optional[Dict[str, Any]] = None,
+        include_metadata: bool = True,
+        executor=None,
+    ) -> VectorQueryResult:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            executor, lambda: self.query(vector, top_k, filter=filter, include_metadata=include_metadata)
+        )
+
+
+    def probe_typed_metadata(self, catalog_ids: Sequence[str]) -> bool:
+        """
+        Check once, at warmup, whether stored metadata has the typed fields
+        (`genre_keys`, `season_key`, numeric `year` and `rating`) that
+        `build_vector_filter` targets, on a sample spread over `catalog_ids`.
+        An index written before them matches nothing on those fields, so the
+        result decides whether filters are pushed down. Unknown ids are ignored.
+        """
+        step = max(1, len(catalog_ids) // TYPED_METADATA_PROBE_SIZE)
+        sample = [str(anime_id) for anime_id in list(catalog_ids)[::step][:TYPED_METADATA_PROBE_SIZE]]
+        metadata = self.fetch_metadata(sample) if sample else {}
+        if metadata:
+            self.typed_metadata = all(_has_typed_fields(meta) for meta in metadata.values())
+        return self.typed_metadata
+
+
+class PineconeVectorStore(VectorStore):
+    def __init__(
+        self,
+        index_name: str = PINECONE_INDEX_NAME,
+        api_key: Optional[str] = None,
+        pool_threads: int = int(os.getenv('PINECONE_POOL_THREADS', '8')),
+    ):
+        from pinecone import Pinecone
+
+        client = Pinecone(api_key=api_key or os.getenv('PINECONE_API_KEY'))
+        # pool_threads sizes the urllib3 connection pool so concurrent queries reuse connections
+        self.index = client.Index(index_name, pool_threads=pool_threads)
+
+    def query(self, vector, top_k, filter=None, include_metadata=True):
+        kwargs = {'vector': list(vector), 'top_k': top_k, 'include_metadata': include_metadata}
+        if filter:
+            kwargs['filter'] = filter
+        return self.index.query(**kwargs)
+
+    def fetch(self, ids):
+        vectors = {}
+        ids = [str(anime_id) for anime_id in ids]
+        for start in range(0, len(ids), 1000):
+            response = self.index.fetch(ids=ids[start:start + 1000])
+            for anime_id, vector in response.vectors.items():
+                vectors[anime_id] = np.asarray(vector.values, dtype=np.float32)
+        return vectors
+
+    def fetch_metadata(self, ids):
+        metadata = {}
+        ids = [str(anime_id) for anime_id in ids]
+        for start in range(0, len(ids), 1000):
+            response = self.index.fetch(ids=ids[start:start + 1000])
+            for anime_id, vector in response.vectors.items():
+                metadata[anime_id] = vector.metadata or {}
+        return metadata
+
+    def score(self, vector, ids):
+        # One fetch returns both the values and the metadata
+        matches = []
+        ids = [str(anime_id) for anime_id in ids]
+        for start in range(0, len(ids), 1000):
+            response = self.index.fetch(ids=ids[start:start + 1000])
+            for anime_id, stored in response.vectors.items():
+                matches.append(VectorMatch(
+                    id=anime_id,
+                    score=_cosine(vector, np.asarray(stored.values, dtype=np.float32)),
+                    metadata=stored.metadata or {},
+                ))
+        return matches
+
+
+class LocalVectorStore(VectorStore):
+    """
+    Exact cosine search over an in-memory (memory-mapped) embedding matrix.
+
+    The snapshot matrix is stored L2-normalised, so cosine similarity is a
+    single matrix-vector product; top-k uses `argpartition` so only the
+    winners are sorted.
+    """
+
+    def __init__(self, snapshot_dir: str = DEFAULT_SNAPSHOT_DIR, mmap: bool = True):
+        self.snapshot_dir = snapshot_dir
+        self.vectors = np.load(
+            os.path.join(snapshot_dir, SNAPSHOT_VECTORS_FILE), mmap_mode='r' if mmap else None
+        )
+        with open(os.path.join(snapshot_dir, SNAPSHOT_METADATA_FILE), 'r', encoding='utf-8') as f:
+            self.metadata: List[Dict[str, Any]] = json.load(f)
+        if len(self.metadata) != self.vectors.shape[0]:
+            raise ValueError(
+                f"Snapshot in {snapshot_dir} is inconsistent: "
+                f"{self.vectors.shape[0]} vectors but {len(self.metadata)} metadata rows"
+            )
+        self.ids: List[str] = [str(meta['id']) for meta in self.metadata]
+        self.position: Dict[str, int] = {anime_id: i for i, anime_id in enumerate(self.ids)}
+        self._columns: Dict[str, Any] = {}
+        self.attribute_index = AttributeIndex.from_metadata(self.metadata)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def fetch(self, ids):
+        vectors = {}
+        for anime_id in ids:
+            row = self.position.get(str(anime_id))
+            if row is not None:
+                vectors[str(anime_id)] = np.asarray(self.vectors[row], dtype=np.float32)
+        return vectors
+
+    def fetch_metadata(self, ids):
+        return {
+            str(anime_id): self.metadata[self.position[str(anime_id)]]
+            for anime_id in ids if str(anime_id) in self.position
+        }
+
+    def score(self, vector, ids):
+        rows = [self.position[str(anime_id)] for anime_id in ids if str(anime_id) in self.position]
+        if not rows:
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        scores = self.vectors[rows] @ (query / norm if norm > 0 else query)
+        return [
+            VectorMatch(id=self.ids[row], score=float(score), metadata=self.metadata[row])
+            for row, score in zip(rows, scores)
+        ]
+
+    def query(self, vector, top_k, filter=None, include_metadata=True):
+        if isinstance(filter, np.ndarray):
+            mask = filter
+        else:
+            mask = self.filter_mask(filter) if filter else None
+        return self.search(vector, top_k, mask=mask, include_metadata=include_metadata)
+
+    def search(
+        self,
+        vector: Sequence[float],
+        top_k: int,
+        mask: Optional[np.ndarray] = None,
+        include_metadata: bool = True,
+    ) -> VectorQueryResult:
+        """Top-k cosine search, optionally restricted to the rows where `mask` is true."""
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+
+        if mask is None:
+            rows = None
+            scores = self.vectors @ query
+        elif np.count_nonzero(mask) * 2 > mask.shape[0]:
+            # Gathering most of the matrix costs more than scoring all of it and discarding the rest
+            rows = None
+            scores = self.vectors @ query
+            scores[~mask] = -np.inf
+            top_k = min(top_k, int(np.count_nonzero(mask)))
+        else:
+            rows = np.flatnonzero(mask)
+            if rows.size == 0:
+                return VectorQueryResult(matches=[])
+            scores = self.vectors[rows] @ query
+
+        top_k = min(top_k, scores.shape[0])
+        if top_k <= 0:
+            return VectorQueryResult(matches=[])
+        if top_k < scores.shape[0]:
+            best = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            best = np.arange(scores.shape[0])
+        best = best[np.argsort(-scores[best], kind='stable')]
+
+        matches = []
+        for i in best:
+            row = int(i) if rows is None else int(rows[i])
+            matches.append(VectorMatch(
+                id=self.ids[row],
+                score=float(scores[i]),
+                metadata=self.metadata[row] if include_metadata else {},
+            ))
+        return VectorQueryResult(matches=matches)
+
+    def filter_mask(self, filter: Dict[str, Any]) -> np.ndarray:
+        """
+        Evaluate a Pinecone-style metadata filter into a boolean row mask.
+
+        Supports `$and`, `$or`, `$eq`, `$ne`, `$in`, `$nin`, `$gt`, `$gte`,
+        `$lt` and `$lte`. As in Pinecone, `$eq`/`$in` on a list field match
+        when any element of the list matches.
+        """
+        mask = np.ones(len(self.ids), dtype=bool)
+        for key, condition in filter.items():
+            if key == '$and':
+                for clause in condition:
+                    mask &= self.filter_mask(clause)
+            elif key == '$or':
+                any_mask = np.zeros(len(self.ids), dtype=bool)
+                for clause in condition:
+                    any_mask |= self.filter_mask(clause)
+                mask &= any_mask
+            else:
+                if not isinstance(condition, dict):
+                    condition = {'$eq': condition}
+                for operator, operand in condition.items():
+                    mask &= self._field_mask(key, operator, operand)
+        return mask
+
+    def _column(self, name: str):
+        if name not in self._columns:
+            values = [meta.get(name) for meta in self.metadata]
+            if all(value is None or isinstance(value, (int, float)) and not isinstance(value, bool) for value in values):
+                column = np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+            else:
+                column = values
+            self._columns[name] = column
+        return self._columns[name]
+
+    def _field_mask(self, name: str, operator: str, operand: Any) -> np.ndarray:
+        column = self._column(name)
+        if isinstance(column, np.ndarray):
+            if operator == '$gt':
+                return column > operand
+            if operator == '$gte':
+                return column >= operand
+            if operator == '$lt':
+                return column < operand
+            if operator == '$lte':
+                return column <= operand
+            if operator == '$eq':
+                return column == operand
+            if operator == '$ne':
+                return column != operand
+            if operator == '$in':
+                return np.isin(column, list(operand))
+            if operator == '$nin':
+                return ~np.isin(column, list(operand))
+            raise ValueError(f"Unsupported filter operator: {operator}")
+
+        def matches(value: Any) -> bool:
+            values = value if isinstance(value, list) else [value]
+            if operator == '$eq':
+                return operand in values
+            if operator == '$ne':
+                return operand not in values
+            if operator == '$in':
+                return any(v in operand for v in values)
+            if operator == '$nin':
+                return not any(v in operand for v in values)
+            raise ValueError(f"Unsupported filter operator for non-numeric field {name}: {operator}")
+
+        return np.fromiter((matches(value) for value in column), dtype=bool, count=len(column))
+
+
+def _has_typed_fields(meta: Dict[str, Any]) -> bool:
+    # Null values are left out of the metadata, so only present fields are type-checked
+    return (
+        'genre_keys' in meta
+        and ('season' not in meta or 'season_key' in meta)
+        and all(isinstance(meta[key], (int, float)) for key in ('year', 'rating') if key in meta)
+    )
+
+
+def _cosine(a: Sequence[float], b: np.ndarray) -> float:
+    a = np.asarray(a, dtype=np.float32)
+    norms = float(np.linalg.norm(a) * np.linalg.norm(b))
+    return float(a @ b) / norms if norms > 0 else 0.0
+
+
+def write_snapshot(
+    snapshot_dir: str,
+    vectors: Sequence[Sequence[float]],
+    metadata: List[Dict[str, Any]],
+) -> None:
+    """Write an L2-normalised embedding matrix and its metadata sidecar for `LocalVectorStore`."""
+    os.makedirs(snapshot_dir, exist_ok=True)
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix = matrix / norms
+
+    # Write to temporary names first so a running service never mmaps a half-written file
+    vectors_path = os.path.join(snapshot_dir, SNAPSHOT_VECTORS_FILE)
+    metadata_path = os.path.join(snapshot_dir, SNAPSHOT_METADATA_FILE)
+    np.save(vectors_path + '.tmp.npy', matrix)
+    with open(metadata_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, ensure_ascii=False)
+    os.replace(vectors_path + '.tmp.npy', vectors_path)
+    os.replace(metadata_path + '.tmp', metadata_path)
+
+
+class SnapshotWriter:
+    """
+    Stream rows into a snapshot without holding the catalog in memory.
+
+    Vectors are L2-normalised per batch and written into a memory-mapped
+    `.npy` preallocated for `capacity` rows; metadata records are appended
+    to the JSON sidecar as they come. `close()` trims the matrix to the rows
+    actually written and moves both files into place. If more than
+    `capacity` rows arrive (the catalog grew during the run), the matrix is
+    reallocated at twice the size.
+    """
+
+    def __init__(self, snapshot_dir: str, capacity: int):
+        os.makedirs(snapshot_dir, exist_ok=True)
+        self.vectors_path = os.path.join(snapshot_dir, SNAPSHOT_VECTORS_FILE)
+        self.metadata_path = os.path.join(snapshot_dir, SNAPSHOT_METADATA_FILE)
+        self.capacity = max(1, capacity)
+        self.rows = 0
+        self.matrix: Optional[np.ndarray] = None
+        self.metadata_file = open(self.metadata_path + '.tmp', 'w', encoding='utf-8')
+        self.metadata_file.write('[')
+
+    def _allocate(self, path: str, rows: int, dim: int) -> np.ndarray:
+        return np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(rows, dim))
+
+    def append(self, vectors: Sequence[Sequence[float]], metadata: List[Dict[str, Any]]) -> None:
+        if not len(vectors):
+            return
+        batch = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(batch, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        if self.matrix is None:
+            self.matrix = self._allocate(self.vectors_path + '.tmp.npy', self.capacity, batch.shape[1])
+        elif self.rows + len(batch) > self.matrix.shape[0]:
+            self._resize(max(2 * self.matrix.shape[0], self.rows + len(batch)))
+        self.matrix[self.rows:self.rows + len(batch)] = batch / norms
+        for meta in metadata:
+            self.metadata_file.write((',' if self.rows else '') + json.dumps(meta, ensure_ascii=False))
+            self.rows += 1
+
+    def _resize(self, rows: int, block: int = 8192) -> None:
+        # Copy block by block through a second memmap, then take its place
+        path = self.vectors_path + '.tmp.npy'
+        resized = self._allocate(path + '.resize.npy', rows, self.matrix.shape[1])
+        for start in range(0, min(self.rows, rows), block):
+            end = min(start + block, self.rows, rows)
+            resized[start:end] = self.matrix[start:end]
+        resized.flush()
+        del self.matrix, resized
+        os.replace(path + '.resize.npy', path)
+        self.matrix = np.load(path, mmap_mode='r+')
+
+    def close(self) -> None:
+        """Trim and publish the snapshot; a running service never mmaps a half-written file."""
+        self.metadata_file.write(']')
+        self.metadata_file.close()
+        if self.matrix is None:
+            np.save(self.vectors_path + '.tmp.npy', np.empty((0, 0), dtype=np.float32))
+        else:
+            if self.rows != self.matrix.shape[0]:
+                self._resize(self.rows)
+            self.matrix.flush()
+            self.matrix = None
+        os.replace(self.vectors_path + '.tmp.npy', self.vectors_path)
+        os.replace(self.metadata_path + '.tmp', self.metadata_path)
+
+
+def update_snapshot_metadata(snapshot_dir: str, updates: Dict[str, Dict[str, Any]]) -> Set[str]:
+    """
+    Merge per-id metadata updates into a snapshot's sidecar without touching the vectors.
+
+    Returns the ids that were in the snapshot; updates for other ids are ignored.
+    """
+    metadata_path = os.path.join(snapshot_dir, SNAPSHOT_METADATA_FILE)
+    with open(metadata_path, 'r', encoding='utf-8') as f:
+        metadata = json.load(f)
+    applied = set()
+    for meta in metadata:
+        update = updates.get(str(meta['id']))
+        if update:
+            meta.update(update)
+            applied.add(str(meta['id']))
+    with open(metadata_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, ensure_ascii=False)
+    os.replace(metadata_path + '.tmp', metadata_path)
+    return applied
+
+
+def apply_snapshot_changes(
+    snapshot_dir: str,
+    vectors: Dict[str, Sequence[float]],
+    metadata: Dict[str, Dict[str, Any]],
+    deleted: Sequence[str] = (),
+) -> None:
+    """
+    Rewrite a snapshot with upserted, metadata-only-updated and deleted ids applied.
+
+    `vectors` holds new embeddings (their metadata must be in `metadata`);
+    ids only in `metadata` keep their existing vector. The snapshot must
+    exist: a partial one would silently drop every unchanged row.
+    """
+    vectors_path = os.path.join(snapshot_dir, SNAPSHOT_VECTORS_FILE)
+    metadata_path = os.path.join(snapshot_dir, SNAPSHOT_METADATA_FILE)
+    if not os.path.exists(vectors_path):
+        raise FileNotFoundError(
+            f"No snapshot in {snapshot_dir}; build it with a full --snapshot-dir run before syncing incrementally"
+        )
+    matrix = np.load(vectors_path, mmap_mode='r')
+    with open(metadata_path, 'r', encoding='utf-8') as f:
+        rows = json.load(f)
+
+    # Rows getting a new vector are dropped here and appended with the new embeddings
+    removed = set(str(anime_id) for anime_id in deleted)
+    replaced = set(str(anime_id) for anime_id in vectors)
+    keep = np.fromiter(
+        (str(meta['id']) not in removed and str(meta['id']) not in replaced for meta in rows),
+        dtype=bool, count=len(rows),
+    )
+    kept_rows = []
+    for meta, kept in zip(rows, keep):
+        if kept:
+            kept_rows.append(metadata.get(str(meta['id']), meta))
+
+    new_ids = [anime_id for anime_id in vectors if str(anime_id) not in removed]
+    new_rows = [metadata[anime_id] for anime_id in new_ids]
+    new_matrix = np.asarray([vectors[anime_id] for anime_id in new_ids], dtype=np.float32)
+
+    blocks = [block for block in (matrix[keep], new_matrix) if len(block)]
+    combined = np.concatenate(blocks) if blocks else np.empty((0, 0), dtype=np.float32)
+    del matrix
+    write_snapshot(snapshot_dir, combined, kept_rows + new_rows)
+
+
+def get_vector_store(backend: Optional[str] = None) -> VectorStore:
+    backend = (backend or os.getenv('VECTOR_STORE_BACKEND', 'pinecone')).lower()
+    if backend == 'local':
+        return LocalVectorStore(os.getenv('VECTOR_SNAPSHOT_DIR', DEFAULT_SNAPSHOT_DIR))
+    if backend == 'pinecone':
+        return PineconeVectorStore()
+    raise ValueError(f"Unknown VECTOR_STORE_BACKEND: {backend}")
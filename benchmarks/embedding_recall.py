@@ -0,0 +1,143 @@
+"""
+Recall check for the reduced-precision embedding backends.
+
+Compares a candidate `EMBEDDING_BACKEND` (int8 or onnx) with the float32
+vectors of a local snapshot built by `app.anime_embeddings`:
+
+- query side: the candidate's query vectors are searched against the
+  snapshot and their top-k is compared with float32 queries' top-k. This
+  is the serving change when the index itself stays float32.
+- document side: a sample of catalog texts is re-encoded with the
+  candidate; the report has the cosine to the stored vector and the top-k
+  recall over that sample when both queries and documents use the
+  candidate (i.e. after re-indexing with it).
+
+Encode latency and the process RSS after loading each model are reported
+alongside. Needs the real model weights, so it is not part of `benchmarks.run`.
+
+Usage:
+    python -m benchmarks.embedding_recall --snapshot-dir data/vector_snapshot --backend int8 [--k 10]
+"""
+
+import argparse
+import json
+import os
+import resource
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.embedding_backends import BACKENDS, create_embeddings
+from app.vector_store import DEFAULT_SNAPSHOT_DIR, LocalVectorStore
+from benchmarks.fixtures import build_queries
+
+
+def document_text(meta: Dict[str, Any]) -> str:
+    """The `combined_text` the snapshot vector was embedded from (see `preprocess_data`)."""
+    return f"{meta.get('title', '')} {meta.get('description') or ''} {','.join(meta.get('genres', []))}"
+
+
+def normalize(vectors) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+
+
+def top_k(queries: np.ndarray, documents: np.ndarray, k: int) -> np.ndarray:
+    scores = queries @ documents.T
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(top, np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1), axis=1)
+
+
+def recall_at_k(reference: np.ndarray, candidate: np.ndarray) -> float:
+    k = reference.shape[1]
+    return float(np.mean([len(set(ref) & set(cand)) / k for ref, cand in zip(reference, candidate)]))
+
+
+def max_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def encode(embeddings, texts: List[str], batch_size: int) -> Dict[str, Any]:
+    start = time.perf_counter()
+    vectors = []
+    for i in range(0, len(texts), batch_size):
+        vectors.extend(embeddings.embed_documents(texts[i:i + batch_size]))
+    elapsed = time.perf_counter() - start
+    return {'vectors': normalize(vectors), 'ms_per_text': elapsed * 1000 / max(len(texts), 1)}
+
+
+def evaluate(args: argparse.Namespace) -> Dict[str, Any]:
+    store = LocalVectorStore(args.snapshot_dir, mmap=False)
+    catalog = normalize(store.vectors)
+    rng = np.random.default_rng(args.seed)
+    sample = np.sort(rng.choice(len(store), size=min(args.documents, len(store)), replace=False))
+    texts = [document_text(store.metadata[i]) for i in sample]
+    queries = build_queries(args.queries, args.seed)
+
+    reference = create_embeddings('torch')
+    reference_rss = max_rss_mb()
+    reference_queries = encode(reference, queries, args.batch_size)
+    reference_documents = encode(reference, texts, args.batch_size)
+    del reference
+
+    candidate = create_embeddings(args.backend)
+    candidate_rss = max_rss_mb()
+    candidate_queries = encode(candidate, queries, args.batch_size)
+    candidate_documents = encode(candidate, texts, args.batch_size)
+
+    k = min(args.k, len(sample))
+    stored = catalog[sample]
+    return {
+        'backend': args.backend,
+        'catalog_size': len(store),
+        'documents': len(sample),
+        'queries': len(queries),
+        'k': k,
+        'query_recall_vs_snapshot': round(recall_at_k(
+            top_k(reference_queries['vectors'], catalog, k), top_k(candidate_queries['vectors'], catalog, k)
+        ), 4),
+        'reindexed_recall': round(recall_at_k(
+            top_k(reference_queries['vectors'], stored, k),
+            top_k(candidate_queries['vectors'], candidate_documents['vectors'], k),
+        ), 4),
+        # The stored vectors are float32 encodings of the same texts
+        'float32_cosine_to_snapshot': round(float(np.mean(np.sum(reference_documents['vectors'] * stored, axis=1))), 5),
+        'candidate_cosine_to_snapshot': {
+            'mean': round(float(np.mean(np.sum(candidate_documents['vectors'] * stored, axis=1))), 5),
+            'min': round(float(np.min(np.sum(candidate_documents['vectors'] * stored, axis=1))), 5),
+        },
+        'ms_per_text': {
+            'float32': round(reference_documents['ms_per_text'], 3),
+            args.backend: round(candidate_documents['ms_per_text'], 3),
+        },
+        # ru_maxrss is a high-water mark, so the candidate figure includes the float32 peak
+        'max_rss_mb': {'float32': round(reference_rss, 1), args.backend: round(candidate_rss, 1)},
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Compare a reduced-precision embedding backend with float32")
+    parser.add_argument('--snapshot-dir', default=DEFAULT_SNAPSHOT_DIR)
+    parser.add_argument('--backend', choices=[backend for backend in BACKENDS if backend != 'torch'], default='int8')
+    parser.add_argument('--documents', type=int, default=2000, help="Catalog texts to re-encode")
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Also write the report to this JSON file")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    report = evaluate(args)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+In-process stand-ins for Supabase, the vector index, the embedding model and Gemini.
+
+Every fake sleeps for a configurable latency per call, so benchmarks can
+model a slow network or model without needing the real services.
+`install_fakes` puts them into the app's dependency registry, so the real
+clients are never constructed.
+"""
+
+import asyncio
+import hashlib
+import json
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.registry import registry
+from app.vector_store import LocalVectorStore, VectorStore
+from benchmarks.fixtures import EMBEDDING_DIM, Fixture
+
+
+@dataclass
+class Latencies:
+    """Simulated per-call latencies, in milliseconds."""
+    supabase_ms: float = 20.0
+    vector_ms: float = 30.0
+    embed_ms: float = 10.0
+    embed_per_text_ms: float = 2.0
+    llm_ms: float = 800.0
+
+
+class FakeResponse:
+    def __init__(self, data: List[Dict[str, Any]], count: Optional[int] = None):
+        self.data = data
+        self.count = count
+
+
+class FakeQuery:
+    """The subset of the PostgREST query builder the app uses, evaluated over a list of rows."""
+
+    def __init__(self, rows: List[Dict[str, Any]], latency: float):
+        self._rows = rows
+        self._latency = latency
+        self._columns: Optional[List[str]] = None
+        self._count = None
+        self._predicates = []
+        self._order = None
+        self._slice = None
+
+    def select(self, *columns, count=None):
+        self._columns = None if columns in ((), ('*',)) else list(columns)
+        self._count = count
+        return self
+
+    def eq(self, column, value):
+        self._predicates.append(lambda row: str(row.get(column)) == str(value))
+        return self
+
+    def in_(self, column, values):
+        wanted = {str(value) for value in values}
+        self._predicates.append(lambda row: str(row.get(column)) in wanted)
+        return self
+
+    def order(self, column, desc=False):
+        self._order = (column, desc)
+        return self
+
+    def range(self, start, end):
+        self._slice = (start, end + 1)
+        return self
+
+    def limit(self, n):
+        self._slice = (0, n)
+        return self
+
+    def _run(self) -> FakeResponse:
+        rows = [row for row in self._rows if all(predicate(row) for predicate in self._predicates)]
+        count = len(rows) if self._count else None
+        if self._order:
+            column, desc = self._order
+            rows = sorted(rows, key=lambda row: row.get(column), reverse=desc)
+        if self._slice:
+            rows = rows[self._slice[0]:self._slice[1]]
+        if self._columns is not None:
+            rows = [{column: row.get(column) for column in self._columns} for row in rows]
+        return FakeResponse(rows, count)
+
+    def execute(self) -> FakeResponse:
+        time.sleep(self._latency)
+        return self._run()
+
+
+class AsyncFakeQuery(FakeQuery):
+    async def execute(self) -> FakeResponse:
+        await asyncio.sleep(self._latency)
+        return self._run()
+
+
+class FakeSupabase:
+    def __init__(self, tables: Dict[str, List[Dict[str, Any]]], latencies: Latencies, asynchronous: bool = False):
+        self.tables = tables
+        self.latencies = latencies
+        self.asynchronous = asynchronous
+
+    def table(self, name: str) -> FakeQuery:
+        query_class = AsyncFakeQuery if self.asynchronous else FakeQuery
+        return query_class(self.tables.get(name, []), self.latencies.supabase_ms / 1000)
+
+
+class FakeEmbeddings:
+    """Deterministic pseudo-embeddings; each text always maps to the same unit vector."""
+
+    def __init__(self, latencies: Latencies, dim: int = EMBEDDING_DIM):
+        self.latencies = latencies
+        self.dim = dim
+        self.calls = 0
+
+    def _vector(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.sha1(text.encode('utf-8')).digest()[:8], 'little')
+        vector = np.random.default_rng(seed).standard_normal(self.dim)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        time.sleep((self.latencies.embed_ms + self.latencies.embed_per_text_ms * len(texts)) / 1000)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def fake_llm(latencies: Latencies, response: Optional[Dict[str, Any]] = None):
+    """A runnable that answers every prompt with the same filter JSON after `llm_ms`."""
+    from langchain_core.runnables import RunnableLambda
+
+    text = json.dumps(response or {"genres": [], "description_keywords": []})
+
+    def invoke(_prompt):
+        time.sleep(latencies.llm_ms / 1000)
+        return text
+
+    async def ainvoke(_prompt):
+        await asyncio.sleep(latencies.llm_ms / 1000)
+        return text
+
+    return RunnableLambda(invoke, afunc=ainvoke)
+
+
+class FakeVectorStore(VectorStore):
+    """Wraps a real store (normally `LocalVectorStore` over the fixture) and adds network-like latency."""
+
+    def __init__(self, store: VectorStore, latencies: Latencies):
+        self.store = store
+        self.latencies = latencies
+        self.attribute_index = store.attribute_index
+
+    def _wait(self):
+        time.sleep(self.latencies.vector_ms / 1000)
+
+    def query(self, vector, top_k, filter=None, include_metadata=True):
+        self._wait()
+        return self.store.query(vector, top_k, filter=filter, include_metadata=include_metadata)
+
+    def fetch(self, ids):
+        self._wait()
+        return self.store.fetch(ids)
+
+    def fetch_metadata(self, ids):
+        self._wait()
+        return self.store.fetch_metadata(ids)
+
+    def score(self, vector, ids):
+        self._wait()
+        return self.store.score(vector, ids)
+
+
+def install_fakes(fixture: Fixture, latencies: Latencies, snapshot_dir: str) -> None:
+    """Register the fakes in place of the service clients; `snapshot_dir` holds the fixture's vectors."""
+    tables = {'anime': fixture.anime, 'user': fixture.users}
+    registry.override('supabase', FakeSupabase(tables, latencies))
+    registry.override('async_supabase', FakeSupabase(tables, latencies, asynchronous=True))
+    registry.override('vector_store', FakeVectorStore(LocalVectorStore(snapshot_dir), latencies))
+    registry.override('embeddings', FakeEmbeddings(latencies))
+    registry.override('llm', fake_llm(latencies))
@@ -0,0 +1,123 @@
+"""
+Synthetic, deterministic data for the benchmark fakes.
+
+`build_fixture` produces an `anime` table shaped like the production one
+(24,012 rows by default), a `user` table with watch lists, one unit
+embedding per anime, and the matching vector metadata. The same seed
+always gives the same data, so runs on different commits are comparable.
+"""
+
+from dataclasses import dataclass
+from typing import Any, Dict, List
+
+import numpy as np
+
+from app.scoring import compute_feedback_scores, compute_normalized_ranks, compute_normalized_scores
+
+CATALOG_SIZE = 24012
+EMBEDDING_DIM = 384
+
+GENRES = [
+    'Action', 'Adventure', 'Comedy', 'Drama', 'Fantasy', 'Horror', 'Mystery', 'Romance',
+    'Sci-Fi', 'Slice of Life', 'Sports', 'Supernatural', 'Thriller', 'Mecha', 'Music', 'Psychological',
+]
+SEASONS = ['Spring', 'Summer', 'Fall', 'Winter']
+WORDS = [
+    'sword', 'school', 'dragon', 'space', 'detective', 'idol', 'magic', 'war', 'robot', 'friendship',
+    'revenge', 'family', 'island', 'train', 'demon', 'festival', 'tournament', 'city', 'ghost', 'summer',
+]
+
+
+@dataclass
+class Fixture:
+    anime: List[Dict[str, Any]]
+    users: List[Dict[str, Any]]
+    vectors: np.ndarray
+    metadata: List[Dict[str, Any]]
+
+    @property
+    def user_ids(self) -> List[str]:
+        return [user['user_id'] for user in self.users]
+
+
+def build_fixture(catalog_size: int = CATALOG_SIZE, n_users: int = 1000,
+                  watched_per_user: int = 20, seed: int = 0) -> Fixture:
+    rng = np.random.default_rng(seed)
+    ids = np.arange(1, catalog_size + 1)
+    ranks = rng.permutation(catalog_size) + 1
+    ratings = np.round(rng.uniform(4.0, 9.5, catalog_size), 2)
+    num_list_users = rng.integers(100, 2_000_000, catalog_size)
+    num_favorites = (num_list_users * rng.uniform(0.0, 0.05, catalog_size)).astype(np.int64)
+    feedback = np.round(rng.uniform(0.0, 1.0, catalog_size), 3)
+    years = rng.integers(1970, 2025, catalog_size)
+    seasons = rng.integers(0, len(SEASONS), catalog_size)
+    genre_counts = rng.integers(1, 4, catalog_size)
+
+    feedback_scores = compute_feedback_scores(num_favorites, num_list_users, feedback)
+    normalized_scores = compute_normalized_scores(
+        ratings, feedback_scores, compute_normalized_ranks(ranks, catalog_size), catalog_size
+    )
+
+    anime, metadata = [], []
+    for i in range(catalog_size):
+        genres = sorted(rng.choice(GENRES, size=genre_counts[i], replace=False).tolist())
+        words = rng.choice(WORDS, size=12).tolist()
+        title = f"{words[0].title()} {words[1].title()} {ids[i]}"
+        description = f"A story about {' '.join(words[2:])}."
+        season = SEASONS[seasons[i]]
+        anime.append({
+            'id': int(ids[i]),
+            'title': title,
+            'description': description,
+            'genres': genres,
+            'year': int(years[i]),
+            'season': season,
+            'rating': float(ratings[i]),
+            'rank': int(ranks[i]),
+            'num_favorites': int(num_favorites[i]),
+            'num_list_users': int(num_list_users[i]),
+            'feedback': float(feedback[i]),
+            'image_url': f"https://example.com/anime/{ids[i]}.jpg",
+        })
+        metadata.append({
+            'id': str(ids[i]),
+            'title': title,
+            'description': description,
+            'genres': genres,
+            'genre_keys': [genre.lower() for genre in genres],
+            'year': int(years[i]),
+            'season': season,
+            'season_key': season.lower(),
+            'rating': float(ratings[i]),
+            'feedback_score': float(feedback_scores[i]),
+            'normalized_score': float(normalized_scores[i]),
+        })
+
+    vectors = rng.standard_normal((catalog_size, EMBEDDING_DIM)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    users = [
+        {
+            'user_id': f"user-{u}",
+            # Stored as a Python-literal string, like the production column
+            'user_watched_list': repr([str(anime_id) for anime_id in rng.choice(ids, size=watched_per_user, replace=False)]),
+        }
+        for u in range(n_users)
+    ]
+    return Fixture(anime=anime, users=users, vectors=vectors, metadata=metadata)
+
+
+def build_queries(n_queries: int = 200, seed: int = 0) -> List[str]:
+    """A mix of queries the rule-based parser settles and free text that needs the LLM."""
+    rng = np.random.default_rng(seed + 1)
+    queries = []
+    for i in range(n_queries):
+        genre = GENRES[rng.integers(len(GENRES))].lower()
+        if i % 3 == 0:
+            queries.append(f"{genre} anime from {rng.integers(1980, 2024)}")
+        elif i % 3 == 1:
+            queries.append(f"{genre} {SEASONS[rng.integers(len(SEASONS))].lower()} anime rated above {rng.integers(5, 9)}")
+        else:
+            words = rng.choice(WORDS, size=3, replace=False)
+            queries.append(f"something {genre} about {words[0]} and {words[1]} with a {words[2]}")
+    return queries
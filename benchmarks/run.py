@@ -0,0 +1,228 @@
+"""
+Offline benchmark for the recommendation endpoints.
+
+Serves the FastAPI app in-process over `httpx.ASGITransport`, with
+Supabase, the vector index, the embedding model and Gemini replaced by the
+fakes in `benchmarks.fakes` (a synthetic 24k-anime fixture, configurable
+latencies). Each endpoint is driven at the requested concurrency; the
+report has throughput, latency percentiles and the mean time per pipeline
+stage, taken from the `Server-Timing` header. Results are written as JSON
+so runs on different commits can be compared.
+
+Usage:
+    python -m benchmarks.run [--requests 500] [--concurrency 16] [--llm-ms 800] [--output results.json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from benchmarks.fakes import Latencies, install_fakes
+from benchmarks.fixtures import build_fixture, build_queries
+
+ENDPOINTS = ('recommendation', 'history-recommendation')
+DEFAULT_OUTPUT_DIR = os.path.join('benchmarks', 'results')
+
+
+def parse_server_timing(header: str) -> Dict[str, float]:
+    timings = {}
+    for entry in filter(None, (part.strip() for part in header.split(','))):
+        name, _, params = entry.partition(';')
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'dur':
+                timings[name.strip()] = float(value)
+    return timings
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float, stages: Dict[str, List[float]]) -> Dict[str, Any]:
+    values = np.asarray(latencies) * 1000
+    completed = len(latencies)
+    return {
+        'requests': completed + errors,
+        'errors': errors,
+        'throughput_rps': round(completed / elapsed, 2) if elapsed > 0 else 0.0,
+        'latency_ms': {
+            'mean': round(float(values.mean()), 2) if completed else None,
+            'p50': round(float(np.percentile(values, 50)), 2) if completed else None,
+            'p95': round(float(np.percentile(values, 95)), 2) if completed else None,
+            'p99': round(float(np.percentile(values, 99)), 2) if completed else None,
+            'max': round(float(values.max()), 2) if completed else None,
+        },
+        # Mean per request; nested stages (e.g. parse_query_llm inside parse_query) overlap
+        'stages_ms': {
+            stage: round(sum(durations) / completed, 2) if completed else 0.0
+            for stage, durations in sorted(stages.items())
+        },
+    }
+
+
+async def drive(client, path: str, payloads: List[Dict[str, Any]], concurrency: int) -> Dict[str, Any]:
+    queue: asyncio.Queue = asyncio.Queue()
+    for payload in payloads:
+        queue.put_nowait(payload)
+    latencies: List[float] = []
+    stages: Dict[str, List[float]] = defaultdict(list)
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        while True:
+            try:
+                payload = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            start = time.perf_counter()
+            try:
+                response = await client.post(path, json=payload)
+                response.raise_for_status()
+            except Exception:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+            for stage, duration in parse_server_timing(response.headers.get('server-timing', '')).items():
+                stages[stage].append(duration)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - start, stages)
+
+
+def build_payloads(endpoint: str, n_requests: int, queries: List[str], user_ids: List[str],
+                   args: argparse.Namespace, rng: np.random.Generator) -> List[Dict[str, Any]]:
+    if endpoint == 'recommendation':
+        return [
+            {'query': queries[rng.integers(len(queries))], 'n_results': args.n_results}
+            for _ in range(n_requests)
+        ]
+    return [
+        {'user_id': user_ids[rng.integers(len(user_ids))], 'n_results': args.n_results, 'mode': args.history_mode}
+        for _ in range(n_requests)
+    ]
+
+
+async def run(args: argparse.Namespace, fixture) -> Dict[str, Any]:
+    import httpx
+    from app.main import app
+
+    rng = np.random.default_rng(args.seed)
+    queries = build_queries(args.query_pool, args.seed)
+    results = {}
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://benchmark', timeout=None) as client:
+            while (await client.get('/readyz')).status_code != 200:
+                await asyncio.sleep(0.1)
+            for endpoint in args.endpoints:
+                path = f"/{endpoint}"
+                warmup = build_payloads(endpoint, args.warmup, queries, fixture.user_ids, args, rng)
+                await drive(client, path, warmup, args.concurrency)
+                payloads = build_payloads(endpoint, args.requests, queries, fixture.user_ids, args, rng)
+                results[endpoint] = await drive(client, path, payloads, args.concurrency)
+                print_summary(endpoint, results[endpoint])
+    return results
+
+
+def print_summary(endpoint: str, result: Dict[str, Any]) -> None:
+    latency = result['latency_ms']
+    print(
+        f"{endpoint}: {result['throughput_rps']} req/s, "
+        f"p50 {latency['p50']} ms, p95 {latency['p95']} ms, p99 {latency['p99']} ms, "
+        f"{result['errors']} errors"
+    )
+    for stage, duration in result['stages_ms'].items():
+        print(f"    {stage:<28} {duration:>9.2f} ms")
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the recommendation endpoints against in-process fakes")
+    parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument('--requests', type=int, default=500, help="Measured requests per endpoint")
+    parser.add_argument('--warmup', type=int, default=20, help="Unmeasured requests per endpoint")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--n-results', type=int, default=5)
+    parser.add_argument('--history-mode', choices=['profile', 'text', 'neighbours'], default='profile')
+    parser.add_argument('--no-keyword-index', action='store_true', help="Vector retrieval only, without the BM25 index")
+    parser.add_argument('--catalog-size', type=int, default=24012)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--query-pool', type=int, default=200, help="Distinct queries to sample from")
+    parser.add_argument('--supabase-ms', type=float, default=Latencies.supabase_ms)
+    parser.add_argument('--vector-ms', type=float, default=Latencies.vector_ms)
+    parser.add_argument('--embed-ms', type=float, default=Latencies.embed_ms)
+    parser.add_argument('--embed-per-text-ms', type=float, default=Latencies.embed_per_text_ms)
+    parser.add_argument('--llm-ms', type=float, default=Latencies.llm_ms)
+    parser.add_argument('--response-cache', action='store_true', help="Keep the response cache on (off by default)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="JSON results path (default: benchmarks/results/<timestamp>.json)")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    latencies = Latencies(args.supabase_ms, args.vector_ms, args.embed_ms, args.embed_per_text_ms, args.llm_ms)
+
+    print(f"Building fixture with {args.catalog_size} anime and {args.users} users...")
+    fixture = build_fixture(args.catalog_size, args.users, seed=args.seed)
+
+    from app.vector_store import write_snapshot
+    snapshot_dir = tempfile.mkdtemp(prefix='anime-benchmark-')
+    write_snapshot(snapshot_dir, fixture.vectors, fixture.metadata)
+
+    # Read at import time by the app modules
+    os.environ.update({
+        'METRICS_ENABLED': 'true',
+        'NEIGHBOUR_TABLE_PATH': os.path.join(snapshot_dir, 'neighbours.npz'),
+        'KEYWORD_INDEX_PATH': os.path.join(snapshot_dir, 'keywords.npz'),
+        'HYBRID_RETRIEVAL': 'false' if args.no_keyword_index else 'true',
+        'RESPONSE_CACHE_TTL_SECONDS': os.environ.get('RESPONSE_CACHE_TTL_SECONDS', '300') if args.response_cache else '0',
+    })
+    os.environ.pop('RESPONSE_CACHE_URL', None)
+    os.environ.pop('USER_PROFILE_DIR', None)
+    install_fakes(fixture, latencies, snapshot_dir)
+
+    if args.history_mode == 'neighbours':
+        from app.item_neighbours import build_neighbour_table
+        build_neighbour_table(snapshot_dir)
+    if not args.no_keyword_index:
+        from app.keyword_index import build_keyword_index
+        build_keyword_index(snapshot_dir)
+
+    results = asyncio.run(run(args, fixture))
+
+    report = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'commit': git_commit(),
+        'python': sys.version.split()[0],
+        'config': {key: value for key, value in vars(args).items() if key != 'output'},
+        'results': results,
+    }
+    output = args.output or os.path.join(
+        DEFAULT_OUTPUT_DIR, datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ') + '.json'
+    )
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import random
+
+import numpy as np
+import pytest
+
+from app.attribute_index import AttributeIndex
+from app.models import QueryFilter
+from app.utils import filter_metadata
+
+GENRES = ['Action', 'Comedy', 'Drama', 'Mecha', 'Romance', 'Sci-Fi', 'Slice of Life']
+SEASONS = ['Spring', 'Summer', 'Fall', 'Winter']
+
+
+def random_metadata(rng, n):
+    metadata = []
+    for i in range(n):
+        meta = {'id': str(i), 'genres': rng.sample(GENRES, rng.randint(0, 3))}
+        if rng.random() > 0.05:
+            meta['year'] = rng.randint(1970, 2024)
+        if rng.random() > 0.05:
+            meta['season'] = rng.choice(SEASONS)
+        if rng.random() > 0.05:
+            meta['rating'] = round(rng.uniform(1, 10), 2)
+        metadata.append(meta)
+    return metadata
+
+
+def random_filter(rng, metadata):
+    ratings = [meta['rating'] for meta in metadata if 'rating' in meta]
+    filters = {}
+    if rng.random() < 0.5:
+        filters['genres'] = [genre.lower() if rng.random() < 0.5 else genre for genre in rng.sample(GENRES, rng.randint(1, 2))]
+    if rng.random() < 0.5:
+        start = rng.randint(1970, 2024)
+        filters['year_start'] = start
+        if rng.random() < 0.5:
+            filters['year_end'] = start + rng.randint(0, 10)
+    if rng.random() < 0.3:
+        filters['seasons'] = rng.sample([season.lower() for season in SEASONS], rng.randint(1, 2))
+    if rng.random() < 0.5:
+        # Bounds taken from stored values exercise the float32 column edge
+        filters['rating_min'] = rng.choice(ratings)
+    if rng.random() < 0.3:
+        filters['rating_max'] = rng.choice(ratings)
+    return QueryFilter(**filters)
+
+
+@pytest.fixture(scope='module')
+def metadata():
+    return random_metadata(random.Random(0), 2000)
+
+
+@pytest.fixture(scope='module')
+def index(metadata):
+    return AttributeIndex.from_metadata(metadata)
+
+
+def test_compile_matches_filter_metadata(metadata, index):
+    rng = random.Random(1)
+    for _ in range(300):
+        filters = random_filter(rng, metadata)
+        mask = index.compile(filters)
+        expected = np.array([filter_metadata(meta, filters) for meta in metadata])
+        if mask is None:
+            assert expected.all()
+        else:
+            np.testing.assert_array_equal(mask, expected, err_msg=str(filters))
+
+
+def test_compile_without_constraints_is_none(index):
+    assert index.compile(QueryFilter()) is None
+    assert index.selectivity(QueryFilter()) == 1.0
+
+
+def test_exclude_ids_are_removed(metadata, index):
+    mask = index.compile(QueryFilter(), exclude_ids=['3', '7', 'unknown'])
+    assert not mask[3] and not mask[7]
+    assert mask.sum() == len(metadata) - 2
+
+
+def test_check_reports_unknown_ids(metadata, index):
+    filters = QueryFilter(genres=['mecha'])
+    keep, known = index.check(['0', '1', 'missing'], filters)
+    assert known.tolist() == [True, True, False]
+    assert keep.tolist() == [filter_metadata(metadata[0], filters), filter_metadata(metadata[1], filters), False]
+
+
+def test_selectivity_is_exact(metadata, index):
+    filters = QueryFilter(year_start=2000, year_end=2009)
+    expected = sum(filter_metadata(meta, filters) for meta in metadata) / len(metadata)
+    assert index.selectivity(filters) == pytest.approx(expected)
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from app.item_neighbours import NeighbourTable, compute_neighbours
+
+
+def unit_rows(rows):
+    matrix = np.asarray(rows, dtype=np.float32)
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+def test_neighbours_are_sorted_and_exclude_self():
+    vectors = unit_rows([[1, 0], [0.9, 0.1], [0, 1], [0.1, 0.9]])
+    rows, scores = compute_neighbours(vectors, n_neighbours=2, block_size=3)
+    assert rows[0].tolist() == [1, 3]
+    assert rows[2].tolist() == [3, 1]
+    assert all(i not in rows[i] for i in range(4))
+    assert (np.diff(scores.astype(np.float32), axis=1) <= 0).all()
+
+
+def write_table(tmp_path, anime_ids, neighbour_ids, scores):
+    path = str(tmp_path / 'neighbours.npz')
+    np.savez(
+        path,
+        anime_ids=np.array(anime_ids, dtype=np.int32),
+        neighbour_ids=np.array(neighbour_ids, dtype=np.int32),
+        scores=np.array(scores, dtype=np.float16),
+    )
+    return NeighbourTable(path)
+
+
+@pytest.fixture
+def table(tmp_path):
+    # Item 1 likes 10 strongly, item 2 likes 20 strongly; both know 30 a little
+    return write_table(tmp_path, [1, 2], [[10, 30], [20, 30]], [[0.9, 0.5], [0.9, 0.5]])
+
+
+def test_plain_mean_without_decay(table):
+    result = dict(table.recommend(['1', '2'], 3))
+    assert result['30'] == pytest.approx(0.5, abs=1e-3)
+    assert result['10'] == pytest.approx(result['20'], abs=1e-3)
+
+
+def test_recency_decay_favours_the_latest_watch(table):
+    result = table.recommend(['1', '2'], 3, recency_decay=0.5)
+    assert [anime_id for anime_id, _ in result][0] == '20'
+    assert dict(result)['20'] > dict(result)['10']
+
+
+def test_unknown_items_are_skipped(table):
+    assert table.recommend(['999'], 3) == []
+
+
+def test_watched_items_are_dropped_from_each_others_lists(tmp_path):
+    # 1 and 2 are each other's closest neighbour, ahead of 30
+    table = write_table(tmp_path, [1, 2], [[2, 30], [1, 30]], [[0.9, 0.5], [0.9, 0.5]])
+    assert [anime_id for anime_id, _ in table.recommend(['1'], 10)] == ['2', '30']
+    assert [anime_id for anime_id, _ in table.recommend(['1', '2'], 10)] == ['30']
@@ -0,0 +1,58 @@
+import pytest
+
+from app.keyword_index import KeywordIndex, reciprocal_rank_fusion, tokenize
+
+DOCUMENTS = {
+    '1': 'Steins;Gate A self-proclaimed mad scientist sends messages to the past. Sci-Fi,Suspense',
+    '2': 'Cowboy Bebop Bounty hunters travel the solar system. Action,Sci-Fi',
+    '3': 'Mushishi Ginko travels to study the mushi. Mystery,Slice of Life',
+    '4': 'Space Brothers Two brothers dream of going to space. Comedy,Drama',
+}
+
+
+@pytest.fixture
+def index():
+    return KeywordIndex.build(list(DOCUMENTS), list(DOCUMENTS.values()))
+
+
+def test_tokenize_drops_stopwords_and_punctuation():
+    assert tokenize("The Steins;Gate anime, please!") == ['steins', 'gate', 'please']
+    assert tokenize(None) == []
+
+
+def test_exact_title_ranks_first(index):
+    assert index.search(tokenize('steins gate'), 2)[0][0] == '1'
+
+
+def test_rare_terms_outweigh_common_ones(index):
+    # "sci" is in two documents, "bounty" in one
+    assert [anime_id for anime_id, _ in index.search(tokenize('sci-fi bounty'), 4)][0] == '2'
+
+
+def test_unknown_terms_return_nothing(index):
+    assert index.search(['nonexistent'], 5) == []
+
+
+def test_top_k_limits_hits(index):
+    assert len(index.search(tokenize('travel travels sci fi space'), 2)) == 2
+
+
+def test_save_and_load_round_trip(index, tmp_path):
+    path = str(tmp_path / 'keywords.npz')
+    index.save(path)
+    loaded = KeywordIndex.load(path)
+    assert loaded.terms == index.terms
+    assert loaded.search(tokenize('space brothers'), 3) == index.search(tokenize('space brothers'), 3)
+
+
+def test_rrf_sums_reciprocal_ranks():
+    fused = reciprocal_rank_fusion([['a', 'b', 'c'], ['c', 'a']], k=60)
+    assert fused['a'] == pytest.approx(1 / 61 + 1 / 62)
+    assert fused['b'] == pytest.approx(1 / 62)
+    assert fused['c'] == pytest.approx(1 / 63 + 1 / 61)
+    assert sorted(fused, key=lambda anime_id: -fused[anime_id]) == ['a', 'c', 'b']
+
+
+def test_rrf_of_one_ranking_keeps_its_order():
+    fused = reciprocal_rank_fusion([['x', 'y', 'z']])
+    assert sorted(fused, key=lambda anime_id: -fused[anime_id]) == ['x', 'y', 'z']
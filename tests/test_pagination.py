@@ -0,0 +1,103 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from app.pagination import InvalidCursor, ResultSet, decode_cursor, encode_cursor, history_set_key, query_set_key
+
+
+def test_cursor_round_trip():
+    key = query_set_key('mecha anime', False, None, None)
+    assert decode_cursor(encode_cursor(key, 40), key) == 40
+
+
+def test_cursor_is_url_safe():
+    cursor = encode_cursor(query_set_key('?&/+', False, None, None), 5)
+    assert set(cursor) <= set('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_')
+
+
+def test_cursor_of_another_request_is_rejected():
+    cursor = encode_cursor(query_set_key('mecha', False, None, None), 10)
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor, query_set_key('romance', False, None, None))
+
+
+@pytest.mark.parametrize('cursor', ['', 'not base64!', encode_cursor('key', 0)[:-3], 'a2V5fGFiYw'])
+def test_malformed_cursor_is_rejected(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor, 'key')
+
+
+def test_negative_offset_is_rejected():
+    with pytest.raises(InvalidCursor):
+        decode_cursor(encode_cursor('key', -5), 'key')
+
+
+def test_set_keys_ignore_page_size_but_not_the_watch_list():
+    assert query_set_key('Mecha', True, None, ['1']) == query_set_key('mecha', True, None, ['1'])
+    assert query_set_key('mecha', True, None, ['1']) != query_set_key('mecha', True, None, ['1', '2'])
+    assert history_set_key('u', 'profile', None, ['1']) != history_set_key('u', 'neighbours', None, ['1'])
+
+
+class Match:
+    def __init__(self, anime_id, score):
+        self.score = score
+        self.metadata = {'id': anime_id, 'title': f'Title {anime_id}'}
+
+
+async def rank_by_score(candidates):
+    ordered = sorted(candidates, key=lambda match: -match.score)
+    return [match.metadata['id'] for match in ordered], np.array([[match.score] for match in ordered])
+
+
+def make_set(pool, keep=None):
+    built = []
+
+    async def fetch_more(count, seen_ids):
+        return [match for match in pool if match.metadata['id'] not in seen_ids][:count]
+
+    async def build(ids, scores):
+        built.append(len(ids))
+        return list(ids)
+
+    return ResultSet(fetch_more, rank_by_score, build, keep), built
+
+
+def test_result_set_builds_only_the_requested_page():
+    async def run():
+        result_set, built = make_set([])
+        await result_set.add([Match(str(i), i / 100) for i in range(50)])
+        page = await result_set.page(10, 5)
+        return result_set, page, built
+
+    result_set, page, built = asyncio.run(run())
+    assert page == ['39', '38', '37', '36', '35']
+    assert built == [5]
+    assert len(result_set) == 50
+
+
+def test_result_set_extends_without_reordering_served_positions():
+    pool = [Match(str(i), i / 100) for i in range(100, 120)]
+
+    async def run():
+        result_set, _ = make_set(pool)
+        await result_set.add([Match(str(i), i / 100) for i in range(5)])
+        first = await result_set.page(0, 5)
+        second = await result_set.page(5, 5)
+        return first, second, result_set
+
+    first, second, result_set = asyncio.run(run())
+    assert first == ['4', '3', '2', '1', '0']
+    assert second == ['104', '103', '102', '101', '100']
+    assert not result_set.complete
+
+
+def test_result_set_keep_filters_on_metadata_and_exhausts():
+    async def run():
+        result_set, _ = make_set([], keep=lambda metadata: metadata['title'] != 'Title 1')
+        await result_set.add([Match(str(i), i / 100) for i in range(3)])
+        return await result_set.page(0, 10), result_set
+
+    page, result_set = asyncio.run(run())
+    assert page == ['2', '0']
+    assert result_set.complete
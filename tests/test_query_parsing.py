@@ -0,0 +1,86 @@
+import pytest
+
+from app.utils import build_vector_filter, rule_based_parse
+
+
+def test_genres_years_and_seasons_are_fully_parsed():
+    filters, complete = rule_based_parse("romance anime from spring 2015")
+    assert filters.genres == ['romance']
+    assert (filters.year_start, filters.year_end) == (2015, 2015)
+    assert filters.seasons == ['spring']
+    assert complete
+
+
+def test_aliases_map_to_known_genres():
+    filters, _ = rule_based_parse("sci fi and shonen shows")
+    assert filters.genres == ['sci-fi', 'shounen']
+
+
+@pytest.mark.parametrize('query, years', [
+    ("mecha between 1995 and 2000", (1995, 2000)),
+    ("mecha after 2010", (2011, None)),
+    ("mecha since 2010", (2010, None)),
+    ("mecha before 2000", (None, 1999)),
+    ("mecha from the 90s", (1990, 1999)),
+])
+def test_year_expressions(query, years):
+    filters, complete = rule_based_parse(query)
+    assert (filters.year_start, filters.year_end) == years
+    assert complete
+
+
+def test_rating_thresholds():
+    filters, complete = rule_based_parse("comedy rated above 8 and below 9.5")
+    assert (filters.rating_min, filters.rating_max) == (8.0, 9.5)
+    assert complete
+
+
+def test_free_text_goes_to_the_llm():
+    filters, complete = rule_based_parse("drama about a girl who loses her memory")
+    assert filters.genres == ['drama']
+    assert not complete
+
+
+def test_query_without_criteria_is_not_complete():
+    assert rule_based_parse("anime")[1] is False
+
+
+def test_vector_filter_uses_typed_metadata():
+    filters, _ = rule_based_parse("Action anime from winter 2020 rated over 7")
+    assert build_vector_filter(filters) == {'$and': [
+        {'genre_keys': {'$in': ['action']}},
+        {'year': {'$gte': 2020, '$lte': 2020}},
+        {'season_key': {'$in': ['winter']}},
+        {'rating': {'$gte': 7.0}},
+    ]}
+
+
+@pytest.mark.parametrize('query', ["mecha under 12 episodes", "comedy with at least 20 episodes"])
+def test_counts_above_ten_are_not_ratings(query):
+    filters, complete = rule_based_parse(query)
+    assert filters.rating_min is None and filters.rating_max is None
+    assert not complete
+
+
+@pytest.mark.parametrize('query, bounds', [
+    ("romance with at least 2 seasons", (2.0, None)),
+    ("comedy over 7", (7.0, None)),
+    ("drama under 5", (None, 5.0)),
+    ("action 8+", (8.0, None)),
+])
+def test_bare_integer_comparisons_go_to_the_llm(query, bounds):
+    filters, complete = rule_based_parse(query)
+    assert (filters.rating_min, filters.rating_max) == bounds
+    assert not complete
+
+
+@pytest.mark.parametrize('query, bounds', [
+    ("comedy rated over 7", (7.0, None)),
+    ("drama with a score under 5", (None, 5.0)),
+    ("action above 7.5", (7.5, None)),
+    ("mecha 8.5+", (8.5, None)),
+])
+def test_rating_word_or_decimal_completes_the_parse(query, bounds):
+    filters, complete = rule_based_parse(query)
+    assert (filters.rating_min, filters.rating_max) == bounds
+    assert complete
@@ -0,0 +1,161 @@
+import asyncio
+
+import pytest
+
+from app.models import AnimeRecommendation, AnimeScore, ScoreWeights
+from app.resilience import current_parse_paths, note_parse_path, request_budget
+from app.response_cache import RESPONSE_CACHE_PREFIX, RedisBackend, ResponseCache, watch_list_hash
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeRedis:
+    """Dict-backed stand-in for the parts of `redis.Redis` the backend uses."""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.data = {}
+
+    def get(self, key):
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= self.clock():
+            del self.data[key]
+            return None
+        return value.encode('utf-8')
+
+    def set(self, key, value, ex=None):
+        self.data[key] = (value, self.clock() + ex if ex else float('inf'))
+
+
+class BrokenRedis:
+    def get(self, key):
+        raise ConnectionError("down")
+
+    def set(self, key, value, ex=None):
+        raise ConnectionError("down")
+
+
+def recommendation(title='Mushishi'):
+    return AnimeRecommendation(
+        title=title, description='', rating=8.7, year='2005', season='Fall', genres=['Mystery'],
+        scores=AnimeScore(cosine_similarity=0.5, feedback_score=0.0, normalized_score=0.8, combined_score=0.59),
+    )
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def cache(clock):
+    return ResponseCache(RedisBackend(FakeRedis(clock)), ttl_seconds=60)
+
+
+def counting(result):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return result
+    return compute, calls
+
+
+def test_second_call_is_served_from_the_backend(cache):
+    compute, calls = counting([recommendation()])
+    first = cache.get_or_compute('k', compute)
+    second = cache.get_or_compute('k', compute)
+    assert len(calls) == 1
+    assert second == first
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_entries_are_stored_under_the_prefix(cache):
+    cache.get_or_compute('k', lambda: [recommendation()])
+    assert list(cache.backend.client.data) == [RESPONSE_CACHE_PREFIX + 'k']
+
+
+def test_entries_expire_after_the_ttl(cache, clock):
+    compute, calls = counting([recommendation()])
+    cache.get_or_compute('k', compute)
+    clock.now += 59
+    cache.get_or_compute('k', compute)
+    assert len(calls) == 1
+    clock.now += 2
+    cache.get_or_compute('k', compute)
+    assert len(calls) == 2
+
+
+def test_empty_responses_are_not_stored(cache):
+    compute, calls = counting([])
+    cache.get_or_compute('k', compute)
+    cache.get_or_compute('k', compute)
+    assert len(calls) == 2
+
+
+def test_degraded_responses_are_not_stored(cache):
+    compute, calls = counting([recommendation()])
+    with request_budget(5):
+        note_parse_path('llm_timeout')
+        cache.get_or_compute('k', compute)
+    cache.get_or_compute('k', compute)
+    assert len(calls) == 2
+
+
+def test_hits_replay_the_parse_path_of_the_stored_response(cache):
+    def compute():
+        note_parse_path('rules')
+        return [recommendation()]
+
+    with request_budget(5):
+        cache.get_or_compute('k', compute)
+        assert current_parse_paths() == ['rules']
+    with request_budget(5):
+        cache.get_or_compute('k', compute)
+        assert current_parse_paths() == ['cached-response', 'rules']
+
+
+def test_backend_errors_only_cost_the_hit():
+    cache = ResponseCache(RedisBackend(BrokenRedis()), ttl_seconds=60)
+    assert cache.get_or_compute('k', lambda: [recommendation()]) == [recommendation()]
+    assert cache.errors == 2
+
+
+def test_async_path_uses_the_blocking_backend(cache):
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        return [recommendation()]
+
+    async def twice():
+        await cache.aget_or_compute('k', compute)
+        return await cache.aget_or_compute('k', compute)
+
+    assert asyncio.run(twice()) == [recommendation()]
+    assert len(calls) == 1
+
+
+def test_watch_list_change_changes_the_keys(cache):
+    weights = ScoreWeights()
+    before = ['1', '2']
+    after = ['1', '2', '3']
+    assert watch_list_hash(before) != watch_list_hash(after)
+    assert cache.query_key('mecha', 5, True, weights, before) != cache.query_key('mecha', 5, True, weights, after)
+    assert cache.history_key(5, 'profile', weights, before) != cache.history_key(5, 'profile', weights, after)
+    # Recency can affect results, so order is part of the version
+    assert watch_list_hash(['1', '2']) != watch_list_hash(['2', '1'])
+
+
+def test_same_request_gets_the_same_key(cache):
+    assert cache.query_key('Mecha  anime!', 5, True, None, ['1']) == cache.query_key('mecha anime', 5, True, None, ['1'])
+    assert cache.query_key('mecha', 5, False, None, None) != cache.query_key('mecha', 6, False, None, None)
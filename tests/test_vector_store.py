@@ -0,0 +1,52 @@
+from app.vector_store import TYPED_METADATA_PROBE_SIZE, VectorStore
+
+TYPED = {'id': '1', 'genres': ['Action'], 'genre_keys': ['action'], 'season': 'Spring', 'season_key': 'spring',
+         'year': 2004, 'rating': 8.1}
+UNTYPED = {'id': '1', 'genres': 'Action', 'season': 'Spring', 'year': 2004, 'rating': 8.1}
+
+
+class MetadataStore(VectorStore):
+    def __init__(self, metadata):
+        self.metadata = metadata
+        self.fetched = []
+
+    def query(self, vector, top_k, filter=None, include_metadata=True):
+        raise NotImplementedError
+
+    def fetch(self, ids):
+        return {}
+
+    def fetch_metadata(self, ids):
+        self.fetched.append(list(ids))
+        return {anime_id: self.metadata[anime_id] for anime_id in ids if anime_id in self.metadata}
+
+
+def test_typed_index_keeps_pushdown():
+    store = MetadataStore({str(i): {**TYPED, 'id': str(i)} for i in range(100)})
+    assert store.probe_typed_metadata([str(i) for i in range(100)])
+    assert store.typed_metadata
+
+
+def test_index_without_typed_fields_disables_pushdown():
+    store = MetadataStore({str(i): {**UNTYPED, 'id': str(i)} for i in range(100)})
+    assert not store.probe_typed_metadata([str(i) for i in range(100)])
+    assert not store.typed_metadata
+
+
+def test_string_ratings_are_not_typed():
+    store = MetadataStore({'1': {**TYPED, 'rating': '8.1'}})
+    assert not store.probe_typed_metadata(['1'])
+
+
+def test_missing_optional_fields_are_fine():
+    meta = {key: value for key, value in TYPED.items() if key not in ('season', 'season_key', 'year')}
+    assert MetadataStore({'1': meta}).probe_typed_metadata(['1'])
+
+
+def test_probe_samples_across_the_catalog_in_one_fetch():
+    store = MetadataStore({})
+    assert store.probe_typed_metadata([str(i) for i in range(1000)])  # nothing found: unchanged
+    assert len(store.fetched) == 1
+    sample = store.fetched[0]
+    assert len(sample) == TYPED_METADATA_PROBE_SIZE
+    assert sample[0] == '0' and int(sample[-1]) >= 900